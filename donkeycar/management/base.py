@@ -10,8 +10,12 @@ import time
 import donkeycar as dk
 from donkeycar.parts.datastore import Tub
 from donkeycar.utils import *
+from donkeycar.management.command import BaseCommand
 from donkeycar.management.tub import TubManager
 from donkeycar.management.joystick_creator import CreateJoystick
+from donkeycar.management.bench import Bench
+from donkeycar.management.makemovie import MakeMovie
+from donkeycar.management.evaluate import Evaluate
 import numpy as np
 
 PACKAGE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -46,10 +50,6 @@ def load_config(config_path):
     return cfg
 
 
-class BaseCommand(object):
-    pass
-
-
 class CreateCar(BaseCommand):
     
     def parse_args(self, args):
@@ -184,280 +184,6 @@ class CalibrateCar(BaseCommand):
             c.run(pmw)
 
 
-class MakeMovie(BaseCommand):    
-    
-    def parse_args(self, args):
-        parser = argparse.ArgumentParser(prog='makemovie')
-        parser.add_argument('--tub', help='The tub to make movie from')
-        parser.add_argument('--out', default='tub_movie.mp4', help='The movie filename to create. default: tub_movie.mp4')
-        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
-        parser.add_argument('--model', default='None', help='the model to use to show control outputs')
-        parser.add_argument('--type', default='categorical', help='the model type to load')
-        parser.add_argument('--salient', action="store_true", help='should we overlay salient map showing avtivations')
-        parser.add_argument('--start', type=int, default=1, help='first frame to process')
-        parser.add_argument('--end', type=int, default=-1, help='last frame to process')
-        parser.add_argument('--scale', type=int, default=2, help='make image frame output larger by X mult')
-        parsed_args = parser.parse_args(args)
-        return parsed_args, parser
-
-    def run(self, args):
-        '''
-        Load the images from a tub and create a movie from them.
-        Movie
-        '''
-        import moviepy.editor as mpy
-
-        args, parser = self.parse_args(args)
-
-        if args.tub is None:
-            parser.print_help()
-            return
-
-        if args.salient:
-            #imported like this, we make TF conditional on use of --salient
-            #and we keep the context maintained throughout our callbacks to 
-            #compute the salient mask
-            from keras import backend as K
-            import tensorflow as tf
-            os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  
-
-        conf = os.path.expanduser(args.config)
-
-        if not os.path.exists(conf):
-            print("No config file at location: %s. Add --config to specify\
-                 location or run from dir containing config.py." % conf)
-            return
-
-        try:
-            cfg = dk.load_config(conf)
-        except:
-            print("Exception while loading config from", conf)
-            return
-
-        self.tub = Tub(args.tub)
-        self.num_rec = self.tub.get_num_records()
-        
-        if args.start == 1:
-            self.start = self.tub.get_index(shuffled=False)[0]
-        else:
-            self.start = args.start
-        
-        if args.end != -1:
-            self.end = args.end    
-        else:
-            self.end = self.num_rec - self.start
-
-        self.num_rec = self.end - self.start
-        
-        self.iRec = args.start
-        self.scale = args.scale
-        self.keras_part = None
-        self.convolution_part = None
-        if not args.model == "None":
-            self.keras_part = get_model_by_type(args.type, cfg=cfg)
-            self.keras_part.load(args.model)
-            self.keras_part.compile()
-            if args.salient:
-                self.init_salient(self.keras_part.model)
-
-                #This method nested in this way to take the conditional import of TF
-                #in a manner that extends to this callback. Done this way, we avoid
-                #importing in the below method, which triggers a new cuda device allocation
-                #each call.
-                def compute_visualisation_mask(img):
-                    #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-                    
-                    activations = self.functor([np.array([img])])
-                    activations = [np.reshape(img, (1, img.shape[0], img.shape[1], img.shape[2]))] + activations
-                    upscaled_activation = np.ones((3, 6))
-                    for layer in [5, 4, 3, 2, 1]:
-                        averaged_activation = np.mean(activations[layer], axis=3).squeeze(axis=0) * upscaled_activation
-                        output_shape = (activations[layer - 1].shape[1], activations[layer - 1].shape[2])
-                        x = tf.constant(
-                            np.reshape(averaged_activation, (1,averaged_activation.shape[0],averaged_activation.shape[1],1)),
-                            tf.float32
-                        )
-                        conv = tf.nn.conv2d_transpose(
-                            x, self.layers_kernels[layer],
-                            output_shape=(1,output_shape[0],output_shape[1], 1), 
-                            strides=self.layers_strides[layer], 
-                            padding='VALID'
-                        )
-                        with tf.Session() as session:
-                            result = session.run(conv)
-                        upscaled_activation = np.reshape(result, output_shape)
-                    final_visualisation_mask = upscaled_activation
-                    return (final_visualisation_mask - np.min(final_visualisation_mask))/(np.max(final_visualisation_mask) - np.min(final_visualisation_mask))
-                self.compute_visualisation_mask = compute_visualisation_mask
-
-        print('making movie', args.out, 'from', self.num_rec, 'images')
-        clip = mpy.VideoClip(self.make_frame, duration=(self.num_rec//cfg.DRIVE_LOOP_HZ) - 1)
-        clip.write_videofile(args.out,fps=cfg.DRIVE_LOOP_HZ)
-
-        print('done')
-
-    def draw_model_prediction(self, record, img):
-        '''
-        query the model for it's prediction, draw the user input and the predictions
-        as green and blue lines on the image
-        '''
-        if self.keras_part is None:
-            return
-
-        import cv2
-         
-        user_angle = float(record["user/angle"])
-        user_throttle = float(record["user/throttle"])
-        pilot_angle, pilot_throttle = self.keras_part.run(img)
-
-        a1 = user_angle * 45.0
-        l1 = user_throttle * 3.0 * 80.0
-        a2 = pilot_angle * 45.0
-        l2 = pilot_throttle * 3.0 * 80.0
-
-        p1 = tuple((74, 119))
-        p2 = tuple((84, 119))
-        p11 = tuple(( int(p1[0] + l1 * math.cos((a1 + 270.0) * math.pi / 180.0)), int(p1[1] + l1 * math.sin((a1 + 270.0) * math.pi / 180.0))))
-        p22 = tuple(( int(p2[0] + l2 * math.cos((a2 + 270.0) * math.pi / 180.0)), int(p2[1] + l2 * math.sin((a2 + 270.0) * math.pi / 180.0))))
-
-        cv2.line(img, p1, p11, (0, 255, 0), 2)
-        cv2.line(img, p2, p22, (0, 0, 255), 2)
-
-    def draw_steering_distribution(self, record, img):
-        '''
-        query the model for it's prediction, draw the distribution of steering choices
-        '''
-        from donkeycar.parts.keras import KerasCategorical
-
-        if self.keras_part is None or type(self.keras_part) is not KerasCategorical:
-            return
-
-        import cv2
-         
-        orig_shape = img.shape
-        pred_img = img.reshape((1,) + img.shape)
-        angle_binned, throttle = self.keras_part.model.predict(pred_img)
-        #img.reshape(orig_shape)
-
-        x = 4
-        dx = 4
-        y = 120 - 4
-        iArgMax = np.argmax(angle_binned)
-        for i in range(15):
-            p1 = (x, y)
-            p2 = (x, y - int(angle_binned[0][i] * 100.0))
-            if i == iArgMax:
-                cv2.line(img, p1, p2, (255, 0, 0), 2)
-            else:
-                cv2.line(img, p1, p2, (200, 200, 200), 2)
-            x += dx
-        
-
-    def init_salient(self, model):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        from keras.layers import Input, Dense, merge
-        from keras.models import Model
-        from keras.layers import Convolution2D, MaxPooling2D, Reshape, BatchNormalization
-        from keras.layers import Activation, Dropout, Flatten, Dense
-
-
-        img_in = Input(shape=(120, 160, 3), name='img_in')
-        x = img_in
-        x = Convolution2D(24, (5,5), strides=(2,2), activation='relu', name='conv1')(x)
-        x = Convolution2D(32, (5,5), strides=(2,2), activation='relu', name='conv2')(x)
-        x = Convolution2D(64, (5,5), strides=(2,2), activation='relu', name='conv3')(x)
-        x = Convolution2D(64, (3,3), strides=(2,2), activation='relu', name='conv4')(x)
-        conv_5 = Convolution2D(64, (3,3), strides=(1,1), activation='relu', name='conv5')(x)
-        self.convolution_part = Model(inputs=[img_in], outputs=[conv_5])
-
-        for layer_num in ('1', '2', '3', '4', '5'):
-            self.convolution_part.get_layer('conv' + layer_num).set_weights(model.get_layer('conv2d_' + layer_num).get_weights())
-
-        from keras import backend as K
-        import tensorflow as tf
-        os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-        
-        self.inp = self.convolution_part.input                                           # input placeholder
-        self.outputs = [layer.output for layer in self.convolution_part.layers[1:]]          # all layer outputs
-        self.functor = K.function([self.inp], self.outputs)
-
-        kernel_3x3 = tf.constant(np.array([
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]]
-        ]), tf.float32)
-
-        kernel_5x5 = tf.constant(np.array([
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]]
-        ]), tf.float32)
-
-        self.layers_kernels = {5: kernel_3x3, 4: kernel_3x3, 3: kernel_5x5, 2: kernel_5x5, 1: kernel_5x5}
-
-        self.layers_strides = {5: [1, 1, 1, 1], 4: [1, 2, 2, 1], 3: [1, 2, 2, 1], 2: [1, 2, 2, 1], 1: [1, 2, 2, 1]}
-
-        
-
-    def draw_salient(self, img):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        import cv2
-        alpha = 0.004
-        beta = 1.0 - alpha
-
-        salient_mask = self.compute_visualisation_mask(img)
-        salient_mask_stacked = np.dstack((salient_mask,salient_mask))
-        salient_mask_stacked = np.dstack((salient_mask_stacked,salient_mask))
-        blend = cv2.addWeighted(img.astype('float32'), alpha, salient_mask_stacked, beta, 0.0)
-        return blend
-        
-
-    def make_frame(self, t):
-        '''
-        Callback to return an image from from our tub records.
-        This is called from the VideoClip as it references a time.
-        We don't use t to reference the frame, but instead increment
-        a frame counter. This assumes sequential access.
-        '''
-        
-        if self.iRec >= self.end:
-            return None
-
-        rec = None
-
-        while rec is None and self.iRec < self.end:
-            try:
-                rec = self.tub.get_record(self.iRec)
-            except Exception as e:
-                print(e)
-                print("Failed to get image for frame", self.iRec)
-                self.iRec = self.iRec + 1
-                rec = None
-
-        image = rec['cam/image_array']
-
-        if self.convolution_part:
-            image = self.draw_salient(image)
-            image = image * 255
-            image = image.astype('uint8')
-        
-        self.draw_model_prediction(rec, image)
-        self.draw_steering_distribution(rec, image)
-
-        if self.scale != 1:
-            import cv2
-            h, w, d = image.shape
-            dsize = (w * self.scale, h * self.scale)
-            image = cv2.resize(image, dsize=dsize, interpolation=cv2.INTER_CUBIC)
-        
-        self.iRec = self.iRec + 1
-        
-        return image # returns a 8-bit RGB array
-
-
-
 class Sim(BaseCommand):
     '''
     Start a websocket SocketIO server to talk to a donkey simulator    
@@ -552,6 +278,233 @@ class TubCheck(BaseCommand):
         self.check(args.tubs, args.fix, args.delete_empty)
 
 
+class TubIndex(BaseCommand):
+    '''
+    Rebuild the record catalog of tubs recorded by older versions, or of tubs
+    whose record files were changed by hand.
+    '''
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubindex', usage='%(prog)s [options]')
+        parser.add_argument('tubs', nargs='+', help='paths to tubs')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def rebuild(self, tub_paths):
+        for path in tub_paths:
+            tub = Tub(path)
+            num_records = tub.rebuild_catalog()
+            print('indexed %d records in %s' % (num_records, tub.path))
+
+    def run(self, args):
+        args = self.parse_args(args)
+        self.rebuild(args.tubs)
+
+
+class TubPack(BaseCommand):
+    '''
+    Decode and scale the images of tubs once, into a memory mapped pack that
+    training reads instead of the jpg files.
+    '''
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='tubpack', usage='%(prog)s [options]')
+        parser.add_argument('tubs', nargs='+', help='paths to tubs')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def pack(self, cfg, tub_paths):
+        for path in tub_paths:
+            tub = Tub(path)
+            start = time.time()
+            pack = tub.pack_images(cfg)
+            print('packed %d of %d images of %s at %dx%dx%d in %.1f sec' %
+                  (len(pack), tub.get_num_records(), tub.path,
+                   cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH, time.time() - start))
+
+    def run(self, args):
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+        self.pack(cfg, args.tubs)
+
+
+class CodecBench(BaseCommand):
+    '''
+    Time encoding and decoding camera frames with each installed image codec,
+    to choose the IMAGE_CODEC, IMAGE_QUALITY and IMAGE_SUBSAMPLING of a car.
+    '''
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='codecbench', usage='%(prog)s [options]')
+        parser.add_argument('--tub', help='tub to take the frames from. default: synthetic frames')
+        parser.add_argument('--frames', type=int, default=100, help='number of frames')
+        parser.add_argument('--repeat', type=int, default=3, help='times each frame is encoded and decoded')
+        parser.add_argument('--quality', type=int, default=75, help='JPEG quality')
+        parser.add_argument('--subsampling', default='420', help='JPEG chroma subsampling (444|422|420)')
+        parser.add_argument('--width', type=int, default=160, help='width of the synthetic frames')
+        parser.add_argument('--height', type=int, default=120, help='height of the synthetic frames')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def load_frames(self, args):
+        if args.tub:
+            tub = Tub(args.tub)
+            ixs = tub.get_index(shuffled=False)[:args.frames]
+            return [tub.get_record(ix)['cam/image_array'] for ix in ixs]
+
+        #a smooth gradient with some noise compresses about like a camera frame.
+        rs = np.random.RandomState(0)
+        y, x = np.mgrid[0:args.height, 0:args.width]
+        base = np.stack([x * 255 / args.width, y * 255 / args.height, (x + y) * 127 / (args.width + args.height)], axis=2)
+        return [np.uint8(np.clip(base + rs.normal(0, 8, base.shape), 0, 255)) for _ in range(args.frames)]
+
+    def bench(self, frames, quality=75, subsampling='420', repeat=3):
+        from donkeycar.parts.codec import available_codecs, benchmark_codec
+        results = [benchmark_codec(codec, frames, repeat) for codec in available_codecs(quality, subsampling)]
+        print('%d frames of %s, quality %d, subsampling %s' % (len(frames), frames[0].shape, quality, subsampling))
+        print('%-12s %10s %10s %10s' % ('codec', 'encode ms', 'decode ms', 'bytes'))
+        for r in results:
+            print('%-12s %10.3f %10.3f %10d' % (r['codec'], r['encode_ms'], r['decode_ms'], r['bytes']))
+        return results
+
+    def run(self, args):
+        args = self.parse_args(args)
+        frames = self.load_frames(args)
+        if not frames:
+            print('no frames to benchmark')
+            return
+        self.bench(frames, args.quality, args.subsampling, args.repeat)
+
+
+class ConvertModel(BaseCommand):
+    '''
+    Convert a trained Keras model to TensorFlow Lite, optionally quantized, and
+    compare the two on sample frames: how far the outputs moved and how fast
+    each one runs on this machine.
+    '''
+    TYPES = ['categorical', 'linear', 'imu', 'behavior']
+    IMU_KEYS = ['imu/acl_x', 'imu/acl_y', 'imu/acl_z', 'imu/gyr_x', 'imu/gyr_y', 'imu/gyr_z']
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='convert', usage='%(prog)s [options]')
+        parser.add_argument('--model', required=True, help='the .h5 model to convert')
+        parser.add_argument('--out', help='the .tflite file to write. default: the model path with .tflite')
+        parser.add_argument('--type', default='categorical', choices=self.TYPES, help='model type')
+        parser.add_argument('--precision', default='float32', choices=['float32', 'float16', 'int8'],
+                            help='int8 with --tub also quantizes the activations, calibrated on the tub frames')
+        parser.add_argument('--tub', help='tubs to take sample frames from, comma separated. default: random frames')
+        parser.add_argument('--samples', type=int, default=200, help='number of sample frames')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def pilot_args(self, model_type, cfg, record=None):
+        '''
+        the arguments of the pilot's run for a tub record, or random ones.
+        '''
+        if record is None:
+            img = np.random.randint(0, 256, (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)).astype(np.uint8)
+            if cfg.ROI_CROP_AT_LOAD:
+                img = img[cfg.ROI_CROP_TOP:cfg.IMAGE_H - cfg.ROI_CROP_BOTTOM]
+            imu = [0.0] * len(self.IMU_KEYS)
+            bhv = np.eye(len(cfg.BEHAVIOR_LIST))[0]
+        else:
+            img = load_scaled_image_arr(record['cam/image_array'], cfg)
+            if img is None:
+                return None
+            imu = [record.get(k, 0.0) for k in self.IMU_KEYS]
+            bhv = record.get('behavior/one_hot_state_array')
+
+        if model_type == 'imu':
+            return [img] + imu
+        if model_type == 'behavior':
+            return [img, bhv]
+        return [img]
+
+    def model_inputs(self, model_type, args):
+        '''
+        the model inputs of one frame, as the pilot's run feeds them.
+        '''
+        inputs = [args[0][np.newaxis]]
+        if model_type == 'imu':
+            inputs.append(np.array(args[1:]).reshape(1, -1))
+        elif model_type == 'behavior':
+            inputs.append(np.array(args[1]).reshape(1, -1))
+        return inputs
+
+    def load_samples(self, model_type, cfg, tub_names, samples):
+        if not tub_names:
+            return [self.pilot_args(model_type, cfg) for _ in range(samples)]
+        records = gather_records(cfg, tub_names)
+        rs = np.random.RandomState(0)
+        records = [records[i] for i in rs.permutation(len(records))[:samples]]
+        tubs = {}
+        sample_args = []
+        for record_path in records:
+            tub_path = os.path.dirname(record_path)
+            if tub_path not in tubs:
+                tubs[tub_path] = Tub(tub_path)
+            record = tubs[tub_path].get_json_record(get_record_index(record_path))
+            args = self.pilot_args(model_type, cfg, record)
+            if args is not None:
+                sample_args.append(args)
+        return sample_args
+
+    def time_pilot(self, pilot, sample_args):
+        outputs = [pilot.run(*args) for args in sample_args]
+        start = time.time()
+        for args in sample_args:
+            pilot.run(*args)
+        fps = len(sample_args) / max(time.time() - start, 1e-9)
+        return np.array(outputs, dtype=np.float64), fps
+
+    def convert(self, cfg, model_path, out_path, model_type='categorical', precision='float32',
+                tub_names=None, samples=200):
+        from donkeycar.parts.tflite import keras_model_to_tflite
+
+        kl = get_model_by_type(model_type, cfg)
+        kl.load(model_path)
+        kl.build_backend()
+        sample_args = self.load_samples(model_type, cfg, tub_names, samples)
+        if not sample_args:
+            print('no sample frames could be loaded')
+            return None
+
+        representative = None
+        if precision == 'int8' and tub_names:
+            representative = [self.model_inputs(model_type, args) for args in sample_args]
+        with open(out_path, 'wb') as fp:
+            fp.write(keras_model_to_tflite(kl.model, precision, representative))
+        print('wrote %s, %d KB, from %s, %d KB' % (out_path, os.path.getsize(out_path) // 1024,
+                                                  model_path, os.path.getsize(model_path) // 1024))
+
+        tl = get_model_by_type('tflite_' + model_type, cfg)
+        tl.load(out_path)
+        keras_out, keras_fps = self.time_pilot(kl, sample_args)
+        tflite_out, tflite_fps = self.time_pilot(tl, sample_args)
+        delta = np.abs(keras_out - tflite_out)
+        source = 'tub' if tub_names else 'random'
+        print('%d %s frames, %s%s' % (len(sample_args), source, precision,
+                                      ' with calibrated activations' if representative else ''))
+        print('%-10s %12s %12s' % ('', 'mean delta', 'max delta'))
+        for i, name in enumerate(['angle', 'throttle']):
+            print('%-10s %12.5f %12.5f' % (name, delta[:, i].mean(), delta[:, i].max()))
+        print('keras %.1f fps, tflite %.1f fps' % (keras_fps, tflite_fps))
+        return {'mean_delta': delta.mean(axis=0).tolist(), 'max_delta': delta.max(axis=0).tolist(),
+                'keras_fps': keras_fps, 'tflite_fps': tflite_fps}
+
+    def run(self, args):
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+        out_path = args.out or os.path.splitext(args.model)[0] + '.tflite'
+        self.convert(cfg, args.model, out_path, args.type, args.precision, args.tub, args.samples)
+
+
 class ShowHistogram(BaseCommand):
 
     def parse_args(self, args):
@@ -565,12 +518,13 @@ class ShowHistogram(BaseCommand):
         '''
         Produce a histogram of record type frequency in the given tub
         '''
+        import pandas as pd
         from matplotlib import pyplot as plt
         from donkeycar.parts.datastore import TubGroup
 
         tg = TubGroup(tub_paths=tub_paths)
         if record_name is not None:
-            tg.df[record_name].hist(bins=50)
+            pd.Series(tg.get_columns([record_name])[record_name]).hist(bins=50)
         else:
             tg.df.hist(bins=50)
 
@@ -748,11 +702,13 @@ class ShowPredictionPlots(BaseCommand):
         num_records = len(records)
         print('processing %d records:' % num_records)
 
+        tubs = {}
         for record_path in records:
-            with open(record_path, 'r') as fp:
-                record = json.load(fp)
-            img_filename = os.path.join(tub_paths, record['cam/image_array'])
-            img = load_scaled_image_arr(img_filename, cfg)
+            tub_path = os.path.dirname(record_path)
+            if tub_path not in tubs:
+                tubs[tub_path] = Tub(tub_path)
+            record = tubs[tub_path].get_json_record(get_record_index(record_path))
+            img = load_scaled_image_arr(record['cam/image_array'], cfg)
             user_angle = float(record["user/angle"])
             user_throttle = float(record["user/throttle"])
             pilot_angle, pilot_throttle = model.run(img)
@@ -810,7 +766,13 @@ def execute_from_command_line():
             'tubclean': TubManager,
             'tubhist': ShowHistogram,
             'tubplot': ShowPredictionPlots,
+            'evaluate': Evaluate,
             'tubcheck': TubCheck,
+            'tubindex': TubIndex,
+            'tubpack': TubPack,
+            'codecbench': CodecBench,
+            'convert': ConvertModel,
+            'bench': Bench,
             'makemovie': MakeMovie,            
             'sim': Sim,
             'createjs': CreateJoystick,
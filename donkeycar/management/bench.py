@@ -0,0 +1,319 @@
+'''
+bench.py
+
+Reproducible throughput benchmarks of pilots, tubs, the training batches
+and the drive loop, written as json so runs can be compared.
+'''
+
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+import donkeycar as dk
+from donkeycar.config import Config
+from donkeycar.management.command import BaseCommand
+from donkeycar.vehicle import TimingWindow
+
+
+SCENARIOS = ['model', 'tub', 'train', 'vehicle']
+
+
+def load_bench_config(config_path):
+    '''
+    the car's config when there is one, the defaults otherwise, so the
+    benchmarks also run outside a car directory.
+    '''
+    path = os.path.expanduser(config_path)
+    if os.path.exists(path):
+        return dk.load_config(path)
+    import donkeycar.templates.config_defaults as defaults
+    cfg = Config()
+    cfg.from_object(defaults)
+    return cfg
+
+
+def timings(seconds):
+    '''
+    count, avg and percentiles in ms of a list of durations in seconds.
+    '''
+    window = TimingWindow('bench', max(len(seconds), 1))
+    for s in seconds:
+        window.add(s)
+    return window.stats()
+
+
+def make_frames(cfg, n, seed=0):
+    '''
+    n synthetic camera frames: a gradient with noise, which compresses like
+    a real frame does. the same for every run.
+    '''
+    rs = np.random.RandomState(seed)
+    h, w = cfg.IMAGE_H, cfg.IMAGE_W
+    y, x = np.mgrid[0:h, 0:w]
+    base = np.stack([x * 255. / w, y * 255. / h, (x + y) * 127. / (w + h)], axis=2)[:, :, :cfg.IMAGE_DEPTH]
+    return [np.uint8(np.clip(base + rs.normal(0, 8, base.shape), 0, 255)) for _ in range(n)]
+
+
+def pilot_frame(model_type, cfg):
+    img = make_frames(cfg, 1)[0]
+    if cfg.ROI_CROP_AT_LOAD and model_type not in ('rnn', '3d'):
+        img = img[cfg.ROI_CROP_TOP:cfg.IMAGE_H - cfg.ROI_CROP_BOTTOM]
+    return img
+
+
+def pilot_args(model_type, cfg, img):
+    if model_type.endswith('imu'):
+        return [img] + [0.0] * 6
+    if model_type.endswith('behavior'):
+        return [img, np.eye(len(cfg.BEHAVIOR_LIST))[0]]
+    return [img]
+
+
+def bench_model(cfg, model_types, frames, model_path=None):
+    '''
+    latency of the pilot's run, per model type, one frame at a time as
+    the drive loop calls it.
+    '''
+    from donkeycar.utils import get_model_by_type
+    results = OrderedDict()
+    for model_type in model_types:
+        kl = get_model_by_type(model_type, cfg)
+        if model_path:
+            kl.load(model_path)
+        kl.build_backend()
+        args = pilot_args(model_type, cfg, pilot_frame(model_type, cfg))
+        for _ in range(5):
+            kl.run(*args)
+
+        run_times, inference_times = [], []
+        for _ in range(frames):
+            start = time.perf_counter()
+            kl.run(*args)
+            run_times.append(time.perf_counter() - start)
+            inference = kl.profile_timings().get('inference')
+            if inference is not None:
+                inference_times.append(inference)
+
+        results[model_type] = OrderedDict([('backend', getattr(kl, 'backend_type', 'tflite')),
+                                           ('precision', getattr(kl, 'precision', None)),
+                                           ('run', timings(run_times)),
+                                           ('inference', timings(inference_times))])
+    return results
+
+
+def bench_tub(cfg, path, records):
+    '''
+    records per second written by Tub, TubWriter in the background, and
+    read back by Tub and TubGroup, for each storage format.
+    '''
+    from donkeycar.parts.datastore import Tub, TubWriter, TubGroup
+    inputs = ['cam/image_array', 'user/angle', 'user/throttle', 'user/mode']
+    types = ['image_array', 'float', 'float', 'str']
+    frames = make_frames(cfg, 16)
+    results = OrderedDict()
+
+    for storage in ['json', 'columnar']:
+        tub_path = os.path.join(path, 'tub_%s' % storage)
+        tub = Tub(tub_path, inputs=inputs, types=types, storage=storage)
+        start = time.perf_counter()
+        for i in range(records):
+            tub.put_record({'cam/image_array': frames[i % len(frames)], 'user/angle': 0.1,
+                            'user/throttle': 0.2, 'user/mode': 'user'})
+        write_s = time.perf_counter() - start
+
+        writer = TubWriter(tub_path + '_background', inputs=inputs, types=types, storage=storage,
+                           background=True, block=True)
+        start = time.perf_counter()
+        for i in range(records):
+            writer.run(frames[i % len(frames)], 0.1, 0.2, 'user')
+        queue_s = time.perf_counter() - start
+        writer.shutdown()
+        background_s = time.perf_counter() - start
+
+        tub = Tub(tub_path)
+        start = time.perf_counter()
+        for ix in tub.get_index(shuffled=False):
+            tub.get_record(ix)
+        read_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        group = TubGroup(','.join([tub_path, tub_path + '_background']))
+        group_s = time.perf_counter() - start
+
+        size = sum(os.path.getsize(os.path.join(tub_path, f)) for f in os.listdir(tub_path))
+        results[storage] = OrderedDict([
+            ('write_records_per_sec', records / write_s),
+            ('write_mb_per_sec', size / write_s / 1e6),
+            ('background_enqueue_records_per_sec', records / queue_s),
+            ('background_records_per_sec', records / background_s),
+            ('read_records_per_sec', records / read_s),
+            ('tubgroup_open_sec', group_s),
+            ('tubgroup_records', group.get_num_records()),
+        ])
+    return results
+
+
+def bench_train(cfg, tub_path, batches, model_type='linear'):
+    '''
+    training samples per second produced by TubSequence, without and with
+    augmentation, from a tub written by bench_tub.
+    '''
+    from donkeycar.utils import get_model_by_type
+    from donkeycar.parts.datastore import Tub, ImageCache
+    from donkeycar.templates.train import collate_records, TubSequence
+
+    kl = get_model_by_type(model_type, cfg)
+    results = OrderedDict()
+    for aug in [False, True]:
+        opts = {'cfg': cfg, 'categorical': model_type == 'categorical'}
+        gen_records = {}
+        collate_records(Tub(tub_path).gather_records(), gen_records, opts)
+        for record in gen_records.values():
+            record['train'] = True
+        seq = TubSequence(gen_records, kl, cfg, cfg.BATCH_SIZE, True, aug, ImageCache.from_config(cfg))
+        n = min(batches, len(seq))
+        if n == 0:
+            raise ValueError('not enough records for a batch of %d' % cfg.BATCH_SIZE)
+        start = time.perf_counter()
+        for i in range(n):
+            seq[i]
+        elapsed = time.perf_counter() - start
+        results['aug' if aug else 'plain'] = OrderedDict([('batches', n),
+                                                          ('samples_per_sec', n * cfg.BATCH_SIZE / elapsed)])
+    return results
+
+
+def bench_vehicle(cfg, path, loops, model_type='linear'):
+    '''
+    the drive loop end to end, as fast as it can go: a mock camera, the
+    pilot, PWM steering and throttle on mock controllers, and a tub writer.
+    '''
+    from donkeycar.utils import get_model_by_type
+    from donkeycar.parts.camera import MockCamera
+    from donkeycar.parts.actuator import MockController, PWMSteering, PWMThrottle
+    from donkeycar.parts.datastore import TubWriter
+    from donkeycar.parts.transform import Lambda
+
+    frame = pilot_frame(model_type, cfg)
+    V = dk.vehicle.Vehicle()
+    V.add(MockCamera(image=frame), outputs=['cam/image_array'], threaded=True)
+    kl = get_model_by_type(model_type, cfg)
+    kl.build_backend()
+    kl.run(frame)
+    V.add(kl, inputs=['cam/image_array'], outputs=['pilot/angle', 'pilot/throttle'])
+    V.add(PWMSteering(controller=MockController(), left_pulse=cfg.STEERING_LEFT_PWM,
+                      right_pulse=cfg.STEERING_RIGHT_PWM), inputs=['pilot/angle'])
+    V.add(PWMThrottle(controller=MockController(), max_pulse=cfg.THROTTLE_FORWARD_PWM,
+                      zero_pulse=cfg.THROTTLE_STOPPED_PWM, min_pulse=cfg.THROTTLE_REVERSE_PWM),
+          inputs=['pilot/throttle'])
+    V.add(Lambda(lambda: True), outputs=['recording'])
+    inputs = ['cam/image_array', 'pilot/angle', 'pilot/throttle']
+    V.add(TubWriter(os.path.join(path, 'tub_vehicle'), inputs=inputs, types=['image_array', 'float', 'float']),
+          inputs=inputs, outputs=['tub/num_records'], run_condition='recording', priority=-1)
+
+    start = time.perf_counter()
+    V.start(rate_hz=100000, max_loop_count=loops - 1)
+    elapsed = time.perf_counter() - start
+    stats = V.profiler.stats()
+    return OrderedDict([('loops_per_sec', loops / elapsed), ('tick', stats['tick']), ('parts', stats['parts'])])
+
+
+def flatten(results, prefix=''):
+    flat = OrderedDict()
+    for key, val in results.items():
+        name = prefix + str(key)
+        if isinstance(val, dict):
+            flat.update(flatten(val, name + '.'))
+        elif isinstance(val, (int, float)) and not isinstance(val, bool):
+            flat[name] = val
+    return flat
+
+
+def compare(old, new):
+    '''
+    print the change of every number the two runs share.
+    '''
+    old_flat, new_flat = flatten(old['results']), flatten(new['results'])
+    print('%-70s %12s %12s %8s' % ('metric', 'before', 'after', 'change'))
+    for name, val in new_flat.items():
+        if name in old_flat:
+            before = old_flat[name]
+            change = (val - before) / before * 100 if before else 0.0
+            print('%-70s %12.3f %12.3f %+7.1f%%' % (name, before, val, change))
+
+
+class Bench(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='bench', usage='%(prog)s [options]')
+        parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS, help='what to benchmark. default: all')
+        parser.add_argument('--types', default='linear,categorical', help='model types for the model scenario, comma separated')
+        parser.add_argument('--model', help='model file to load for the model scenario. default: untrained weights')
+        parser.add_argument('--frames', type=int, default=200, help='frames per model type')
+        parser.add_argument('--records', type=int, default=500, help='records written per tub')
+        parser.add_argument('--batches', type=int, default=3, help='training batches')
+        parser.add_argument('--loops', type=int, default=300, help='drive loop iterations')
+        parser.add_argument('--out', default='bench.json', help='json file to write the results to')
+        parser.add_argument('--compare', help='results of an earlier run to compare with')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def bench(self, cfg, scenarios=SCENARIOS, model_types=('linear', 'categorical'), model_path=None,
+              frames=200, records=500, batches=3, loops=300):
+        np.random.seed(0)
+        results = OrderedDict()
+        path = tempfile.mkdtemp(prefix='donkey_bench_')
+        try:
+            if 'model' in scenarios:
+                print('benchmarking models ...')
+                results['model'] = bench_model(cfg, model_types, frames, model_path)
+            if 'tub' in scenarios or 'train' in scenarios:
+                print('benchmarking tubs ...')
+                results['tub'] = bench_tub(cfg, path, records)
+            if 'train' in scenarios:
+                print('benchmarking training batches ...')
+                results['train'] = bench_train(cfg, os.path.join(path, 'tub_json'), batches)
+            if 'vehicle' in scenarios:
+                print('benchmarking the drive loop ...')
+                results['vehicle'] = bench_vehicle(cfg, path, loops)
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        meta = OrderedDict([('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+                            ('donkeycar', dk.__version__),
+                            ('python', platform.python_version()),
+                            ('numpy', np.__version__),
+                            ('platform', platform.platform()),
+                            ('machine', platform.machine()),
+                            ('image', [cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH]),
+                            ('pilot_backend', cfg.PILOT_BACKEND),
+                            ('settings', OrderedDict([('frames', frames), ('records', records),
+                                                      ('batches', batches), ('loops', loops)]))])
+        try:
+            import tensorflow as tf
+            meta['tensorflow'] = tf.__version__
+        except ImportError:
+            pass
+        return OrderedDict([('meta', meta), ('results', results)])
+
+    def run(self, args):
+        args = self.parse_args(args)
+        cfg = load_bench_config(args.config)
+        report = self.bench(cfg, args.scenario, args.types.split(','), args.model,
+                            args.frames, args.records, args.batches, args.loops)
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        for name, val in flatten(report['results']).items():
+            print('%-70s %12.3f' % (name, val))
+        print('wrote', args.out)
+        if args.compare:
+            with open(args.compare) as fp:
+                compare(json.load(fp), report)
@@ -0,0 +1,10 @@
+'''
+command.py
+
+The base class of the donkey commands, apart from base.py so the commands
+in their own modules can subclass it.
+'''
+
+
+class BaseCommand(object):
+    pass
@@ -0,0 +1,241 @@
+'''
+evaluate.py
+
+Score models against the user's steering and throttle over every record
+of one or more tubs. Each frame is decoded once and fed to all the models
+in batches, and their errors, bin accuracies and inference throughput are
+written to a json file so models can be compared.
+'''
+
+import os
+import json
+import time
+import argparse
+from collections import OrderedDict
+
+import numpy as np
+
+import donkeycar as dk
+from donkeycar.management.bench import load_bench_config, flatten
+from donkeycar.management.command import BaseCommand
+
+
+IMAGE_KEY = 'cam/image_array'
+
+#the model types that drive from the frame alone. the others also take imu
+#or behavior inputs, or a history of frames, which a tub's records in
+#batches don't give them.
+MODEL_TYPES = ('categorical', 'linear', 'tflite_categorical', 'tflite_linear')
+
+
+def bin_index(values, N, offset, R):
+    '''
+    the bin linear_bin puts each of values in
+    '''
+    b = np.round((np.asarray(values, dtype=np.float64) + offset) / (R / (N - offset)))
+    return np.clip(b, 0, N - 1).astype(int)
+
+
+def control_metrics(user, pilot, N, offset, R):
+    '''
+    mean absolute and root mean squared error of the pilot's values, and
+    how often it picks the user's bin, overall and for the records of each
+    user bin. the accuracy of a bin no record falls in is None.
+    '''
+    err = pilot - user
+    user_bins = bin_index(user, N, offset, R)
+    pilot_bins = bin_index(pilot, N, offset, R)
+    hits = user_bins == pilot_bins
+    counts = np.bincount(user_bins, minlength=N)
+    bin_hits = np.bincount(user_bins, weights=hits, minlength=N)
+    return OrderedDict([('mae', float(np.mean(np.abs(err)))),
+                        ('rmse', float(np.sqrt(np.mean(err ** 2)))),
+                        ('bin_accuracy', float(np.mean(hits))),
+                        ('bin_counts', counts.tolist()),
+                        ('per_bin_accuracy', [float(h / c) if c else None for h, c in zip(bin_hits, counts)])])
+
+
+class TubEvaluator(object):
+    '''
+    streams the records of a TubGroup in batches, leaving out the records
+    excluded in each tub, with their frames loaded like training does.
+    a tub packed with `donkey tubpack` at the image size in cfg is read
+    from its pack without decoding. worker threads load batch_size
+    records at a time, a few batches ahead.
+    '''
+    def __init__(self, cfg, group, batch_size=128, workers=4):
+        self.cfg = cfg
+        self.group = group
+        self.batch_size = batch_size
+        self.workers = workers
+        self.packs = [tub.get_image_pack(cfg) for tub in group.tubs]
+
+        self.positions = []
+        for i, tub in enumerate(group.tubs):
+            positions = np.nonzero(group.tub_ids == i)[0]
+            if tub.exclude:
+                positions = positions[~np.isin(group.ixs[positions], list(tub.exclude))]
+            self.positions.append(positions)
+
+    def __len__(self):
+        return sum(len(p) for p in self.positions)
+
+    def load_batch(self, positions):
+        '''
+        user angles, user throttles and frames of the records at positions,
+        all in one tub. records whose frame fails to load are left out.
+        '''
+        from donkeycar.utils import load_scaled_image_arr
+
+        cols = self.group.get_columns([IMAGE_KEY, 'user/angle', 'user/throttle'], positions)
+        pack = self.packs[self.group.tub_ids[positions[0]]]
+        ixs = self.group.ixs[positions]
+        if pack is not None and np.all(pack.rows(ixs) >= 0):
+            imgs = list(pack.get_batch(ixs))
+        else:
+            imgs = [load_scaled_image_arr(path, self.cfg) for path in cols[IMAGE_KEY]]
+        keep = np.array([img is not None for img in imgs], dtype=bool)
+        if not np.any(keep):
+            return None
+        return (np.asarray(cols['user/angle'][keep], dtype=np.float64),
+                np.asarray(cols['user/throttle'][keep], dtype=np.float64),
+                np.stack([img for img in imgs if img is not None]))
+
+    def batches(self):
+        chunks = (positions[i:i + self.batch_size]
+                  for positions in self.positions
+                  for i in range(0, len(positions), self.batch_size))
+        for batch in dk.utils.prefetch_map(self.load_batch, chunks, self.workers):
+            if batch is not None:
+                yield batch
+
+    def evaluate(self, models):
+        '''
+        run each of models, a dict of name: pilot of one of MODEL_TYPES,
+        over every batch and return their metrics. the tflite pilots,
+        without run_batch, run one frame at a time.
+        '''
+        angle_range = 2.0
+        throttle_range = self.cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE
+        user_angles, user_throttles = [], []
+        pilot_angles = {name: [] for name in models}
+        pilot_throttles = {name: [] for name in models}
+        inference = {name: 0.0 for name in models}
+        wait = 0.0
+
+        start = time.perf_counter()
+        batches = self.batches()
+        while True:
+            t = time.perf_counter()
+            batch = next(batches, None)
+            wait += time.perf_counter() - t
+            if batch is None:
+                break
+            angles, throttles, imgs = batch
+            user_angles.append(angles)
+            user_throttles.append(throttles)
+            for name, pilot in models.items():
+                t = time.perf_counter()
+                if hasattr(pilot, 'run_batch'):
+                    pilot_angle, pilot_throttle = pilot.run_batch(imgs)
+                else:
+                    controls = [pilot.run(img) for img in imgs]
+                    pilot_angle, pilot_throttle = np.array(controls, dtype=np.float64).reshape(-1, 2).T
+                inference[name] += time.perf_counter() - t
+                pilot_angles[name].append(np.asarray(pilot_angle, dtype=np.float64))
+                pilot_throttles[name].append(np.asarray(pilot_throttle, dtype=np.float64))
+        elapsed = time.perf_counter() - start
+
+        if not user_angles:
+            raise ValueError('no records to evaluate in %s' % [tub.path for tub in self.group.tubs])
+        user_angles = np.concatenate(user_angles)
+        user_throttles = np.concatenate(user_throttles)
+        num_records = len(user_angles)
+
+        results = OrderedDict()
+        for name in models:
+            results[name] = OrderedDict([
+                ('angle', control_metrics(user_angles, np.concatenate(pilot_angles[name]), 15, 1, angle_range)),
+                ('throttle', control_metrics(user_throttles, np.concatenate(pilot_throttles[name]), 20, 0,
+                                             throttle_range)),
+                ('inference_sec', inference[name]),
+                ('frames_per_sec', num_records / inference[name] if inference[name] else 0.0)])
+
+        stats = OrderedDict([('records', num_records),
+                             ('elapsed_sec', elapsed),
+                             ('load_wait_sec', wait),
+                             ('records_per_sec', num_records / elapsed if elapsed else 0.0)])
+        return OrderedDict([('stats', stats), ('models', results)])
+
+
+class Evaluate(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='evaluate', usage='%(prog)s [options]')
+        parser.add_argument('--tub', nargs='+', help='paths to tubs')
+        parser.add_argument('--model', nargs='+', help='model files to evaluate')
+        parser.add_argument('--type', nargs='+', default=['categorical'],
+                            help='model type, one for all the models or one per model. default: categorical')
+        parser.add_argument('--batch_size', type=int, default=None, help='frames per inference batch. default: BATCH_SIZE')
+        parser.add_argument('--workers', type=int, default=4, help='threads loading records')
+        parser.add_argument('--out', default='evaluate.json', help='json file to write the results to')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args, parser
+
+    def evaluate(self, cfg, tub_paths, model_paths, model_types, batch_size=None, workers=4):
+        from donkeycar.parts.datastore import TubGroup
+
+        if len(model_types) == 1:
+            model_types = model_types * len(model_paths)
+        if len(model_types) != len(model_paths):
+            raise ValueError('give one model type, or one per model')
+        unsupported = sorted(set(model_types) - set(MODEL_TYPES))
+        if unsupported:
+            raise ValueError('evaluate can not score %s models, only %s' % (', '.join(unsupported),
+                                                                             ', '.join(MODEL_TYPES)))
+
+        models = OrderedDict()
+        for model_path, model_type in zip(model_paths, model_types):
+            model_path = os.path.expanduser(model_path)
+            pilot = dk.utils.get_model_by_type(model_type, cfg)
+            if not hasattr(pilot, 'run_batch') and not model_type.startswith('tflite_'):
+                #TRAIN_BEHAVIORS or TRAIN_LOCALIZER in cfg swap the model type.
+                raise ValueError('evaluate can not score the %s of model type %s with this config'
+                                 % (type(pilot).__name__, model_type))
+            pilot.load(model_path)
+            name = os.path.basename(model_path)
+            models[name if name not in models else model_path] = pilot
+
+        group = TubGroup(','.join(tub_paths))
+        evaluator = TubEvaluator(cfg, group, batch_size or cfg.BATCH_SIZE, workers)
+        print('evaluating %d models on %d records' % (len(models), len(evaluator)))
+        results = evaluator.evaluate(models)
+
+        meta = OrderedDict([('time', time.strftime('%Y-%m-%d %H:%M:%S')),
+                            ('tubs', [tub.path for tub in group.tubs]),
+                            ('models', OrderedDict((name, [os.path.expanduser(path), model_type]) for name, path, model_type
+                                                   in zip(models, model_paths, model_types))),
+                            ('batch_size', evaluator.batch_size),
+                            ('image', list(dk.utils.get_image_shape(cfg)))])
+        return OrderedDict([('meta', meta), ('results', results)])
+
+    def run(self, args):
+        args, parser = self.parse_args(args)
+        if not args.tub or not args.model:
+            parser.print_help()
+            return
+        cfg = load_bench_config(args.config)
+        report = self.evaluate(cfg, args.tub, args.model, args.type, args.batch_size, args.workers)
+        with open(args.out, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+        results = report['results']
+        for name, val in flatten(results['stats']).items():
+            print('%-30s %12.3f' % (name, val))
+        names = list(results['models'].keys())
+        flat = [flatten(results['models'][name]) for name in names]
+        print('%-30s' % 'metric' + ''.join(' %20s' % name[-20:] for name in names))
+        for metric in flat[0]:
+            print('%-30s' % metric + ''.join(' %20.4f' % f[metric] for f in flat))
+        print('wrote', args.out)
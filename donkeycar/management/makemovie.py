@@ -0,0 +1,295 @@
+'''
+makemovie.py
+
+Render the frames of a tub to a movie, with the predictions and the
+saliency of a model drawn over them.
+
+Records are read and decoded by a pool of threads a few batches ahead of
+the model, which runs on a whole batch at a time. The frames are piped to
+an ffmpeg process that scales and encodes them while the next batch is
+drawn.
+'''
+
+import os
+import time
+import argparse
+
+import numpy as np
+
+import donkeycar as dk
+from donkeycar.parts.datastore import Tub
+from donkeycar.utils import get_model_by_type, prefetch_map
+from donkeycar.management.command import BaseCommand
+
+
+def model_crop(cfg):
+    '''
+    the rows, (top, bottom), cut off the frames before the model sees them.
+    a model trained with ROI_CROP_AT_LOAD takes the frames without them.
+    '''
+    if cfg.ROI_CROP_AT_LOAD:
+        return cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM
+    return 0, 0
+
+
+class MovieRenderer(object):
+    '''
+    renders the records of a tub from record index start to end, both
+    included. start None is the first record, end -1 the last.
+
+    keras_part draws its steering and throttle in blue next to the user's
+    in green, and the steering bins of a categorical model. with a
+    SaliencyEngine as salient, the frames are replaced by their saliency
+    overlay.
+
+    crop, the (top, bottom) rows from model_crop, is cut off the frames
+    fed to the model and the saliency engine. the movie keeps the whole
+    frame, with no saliency in the rows cut off.
+    '''
+    def __init__(self, tub, keras_part=None, salient=None, start=None, end=-1,
+                 batch_size=64, workers=4, image_key='cam/image_array', crop=(0, 0)):
+        self.tub = tub
+        self.keras_part = keras_part
+        self.salient = salient
+        self.crop = crop
+        self.batch_size = batch_size
+        self.workers = workers
+        self.image_key = image_key
+
+        ixs = np.asarray(tub.get_index(shuffled=False), dtype=np.int64)
+        if start is not None:
+            ixs = ixs[ixs >= start]
+        if end != -1:
+            ixs = ixs[ixs <= end]
+        self.ixs = ixs
+
+    def __len__(self):
+        return len(self.ixs)
+
+    def load_record(self, ix):
+        try:
+            record = self.tub.get_json_record(ix)
+            with open(record[self.image_key], 'rb') as fp:
+                img = self.tub.codec.decode(fp.read())
+        except Exception as e:
+            print(e)
+            print("Failed to get image for frame", ix)
+            return None
+        if img.ndim == 2:
+            img = np.stack([img] * 3, axis=2)
+        return record, img
+
+    def load_batch(self, ixs):
+        '''
+        the records and the stacked frames of ixs, leaving out the records
+        that fail to load
+        '''
+        loaded = [r for r in map(self.load_record, ixs) if r is not None]
+        if not loaded:
+            return [], None
+        records, imgs = zip(*loaded)
+        return list(records), np.stack(imgs)
+
+    def batches(self):
+        '''
+        yield (records, frames) batches in record order, prefetched by the
+        worker threads
+        '''
+        chunks = [self.ixs[i:i + self.batch_size] for i in range(0, len(self.ixs), self.batch_size)]
+        return prefetch_map(self.load_batch, chunks, self.workers)
+
+    def model_frames(self, imgs):
+        '''
+        the frames as the model takes them
+        '''
+        top, bottom = self.crop
+        if not top and not bottom:
+            return imgs
+        return imgs[:, top:imgs.shape[1] - bottom]
+
+    def predict(self, imgs):
+        '''
+        steering, throttle and the steering bins, None but for categorical
+        models, of a batch of frames as the model takes them
+        '''
+        from donkeycar.parts.keras import KerasCategorical
+
+        if not hasattr(self.keras_part, 'controls'):
+            controls = [self.keras_part.run(img) for img in imgs]
+            angles, throttles = np.array(controls, dtype=np.float64).reshape(-1, 2).T
+            return angles, throttles, None
+
+        outputs = self.keras_part.model.predict(imgs, batch_size=len(imgs))
+        angles, throttles = self.keras_part.controls(outputs)
+        angle_binned = outputs[0] if isinstance(self.keras_part, KerasCategorical) else None
+        return angles, throttles, angle_binned
+
+    def draw_batch(self, records, imgs):
+        '''
+        the movie frames of a batch of records, as uint8 images
+        '''
+        model_imgs = self.model_frames(imgs)
+        if self.salient is not None:
+            top, bottom = self.crop
+            masks = np.pad(self.salient.masks(model_imgs), ((0, 0), (top, bottom), (0, 0)), mode='constant')
+            frames = self.salient.overlay(imgs, masks)
+        else:
+            frames = imgs
+
+        if self.keras_part is not None:
+            angles, throttles, angle_binned = self.predict(model_imgs)
+            user_angles = np.array([float(r["user/angle"]) for r in records])
+            user_throttles = np.array([float(r["user/throttle"]) for r in records])
+            self.draw_controls(frames, user_angles, user_throttles, angles, throttles)
+            if angle_binned is not None:
+                self.draw_steering_distribution(frames, angle_binned)
+        return frames
+
+    @staticmethod
+    def draw_controls(frames, user_angles, user_throttles, angles, throttles):
+        '''
+        draw the user input and the predictions as green and blue lines
+        from the bottom of the frames
+        '''
+        import cv2
+
+        h, w = frames.shape[1:3]
+
+        def line_ends(x, angle, throttle):
+            a = np.radians(np.asarray(angle) * 45.0 + 270.0)
+            l = np.asarray(throttle) * 3.0 * 80.0
+            return np.stack([x + l * np.cos(a), h - 1 + l * np.sin(a)], axis=1).astype(int).tolist()
+
+        p1 = (w // 2 - 6, h - 1)
+        p2 = (w // 2 + 4, h - 1)
+        user_ends = line_ends(p1[0], user_angles, user_throttles)
+        pilot_ends = line_ends(p2[0], angles, throttles)
+        for frame, p11, p22 in zip(frames, user_ends, pilot_ends):
+            cv2.line(frame, p1, tuple(p11), (0, 255, 0), 2)
+            cv2.line(frame, p2, tuple(p22), (0, 0, 255), 2)
+
+    @staticmethod
+    def draw_steering_distribution(frames, angle_binned):
+        '''
+        draw the steering bins as bars in the bottom left corner of the
+        frames, the most likely one in red. one bar of the whole batch at
+        a time.
+        '''
+        h = frames.shape[1]
+        y = h - 4
+        heights = (angle_binned * 100.0).astype(int)
+        best = np.argmax(angle_binned, axis=1)
+        rows = np.arange(h)[np.newaxis, :]
+        for i in range(angle_binned.shape[1]):
+            x = 4 + 4 * i
+            bar = (rows <= y) & (rows >= y - heights[:, i:i + 1])
+            color = np.where((best == i)[:, np.newaxis], (255, 0, 0), (200, 200, 200))
+            columns = frames[:, :, x - 1:x + 1]
+            columns[bar] = color[np.nonzero(bar)[0], np.newaxis, :]
+
+    def render(self, out, fps, size=None, scale=1):
+        '''
+        write the movie to out, scaled to size (width, height) or by scale.
+        returns the number of frames written.
+        '''
+        from moviepy.tools import extensions_dict
+        from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+        batches = self.batches()
+        writer = None
+        num_frames = 0
+        start = time.time()
+        try:
+            for records, imgs in batches:
+                if not records:
+                    continue
+                frames = self.draw_batch(records, imgs)
+                if writer is None:
+                    h, w = frames.shape[1:3]
+                    out_w, out_h = size or (w * scale, h * scale)
+                    #yuv420p wants even sizes.
+                    out_w, out_h = out_w - out_w % 2, out_h - out_h % 2
+                    params = None
+                    if (out_w, out_h) != (w, h):
+                        params = ['-vf', 'scale=%d:%d:flags=bicubic' % (out_w, out_h)]
+                    ext = os.path.splitext(out)[1][1:].lower()
+                    codec = extensions_dict.get(ext, {}).get('codec', ['libx264'])[0]
+                    writer = FFMPEG_VideoWriter(out, (w, h), fps, codec=codec, ffmpeg_params=params)
+                for frame in frames:
+                    writer.write_frame(frame)
+                num_frames += len(frames)
+                print('\rframes: %d/%d, %.1f fps' % (num_frames, len(self), num_frames / (time.time() - start)),
+                      end='', flush=True)
+        finally:
+            batches.close()
+            if writer is not None:
+                writer.close()
+        print()
+        return num_frames
+
+
+class MakeMovie(BaseCommand):
+    '''
+    render a tub to a movie
+    '''
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='makemovie')
+        parser.add_argument('--tub', help='The tub to make movie from')
+        parser.add_argument('--out', default='tub_movie.mp4', help='The movie filename to create. default: tub_movie.mp4')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parser.add_argument('--model', default='None', help='the model to use to show control outputs')
+        parser.add_argument('--type', default='categorical', help='the model type to load')
+        parser.add_argument('--salient', action="store_true", help='should we overlay salient map showing avtivations')
+        parser.add_argument('--start', type=int, default=None, help='first record index to render. default: the first record')
+        parser.add_argument('--end', type=int, default=-1, help='last record index to render. default: the last record')
+        parser.add_argument('--scale', type=int, default=2, help='make image frame output larger by X mult')
+        parser.add_argument('--size', default=None, help='output frame size as WIDTHxHEIGHT, overrides --scale')
+        parser.add_argument('--fps', type=float, default=None, help='frames per second of the movie. default: DRIVE_LOOP_HZ')
+        parser.add_argument('--batch_size', type=int, default=64, help='frames decoded and predicted together')
+        parser.add_argument('--workers', type=int, default=4, help='threads decoding records')
+        parsed_args = parser.parse_args(args)
+        return parsed_args, parser
+
+    def run(self, args):
+        '''
+        Load the images from a tub and create a movie from them.
+        '''
+        args, parser = self.parse_args(args)
+
+        if args.tub is None:
+            parser.print_help()
+            return
+
+        conf = os.path.expanduser(args.config)
+
+        if not os.path.exists(conf):
+            print("No config file at location: %s. Add --config to specify\
+                 location or run from dir containing config.py." % conf)
+            return
+
+        try:
+            cfg = dk.load_config(conf)
+        except:
+            print("Exception while loading config from", conf)
+            return
+
+        size = None
+        if args.size is not None:
+            size = tuple(int(v) for v in args.size.lower().split('x'))
+
+        keras_part = None
+        salient = None
+        if not args.model == "None":
+            keras_part = get_model_by_type(args.type, cfg=cfg)
+            keras_part.load(args.model)
+            keras_part.compile()
+            if args.salient:
+                from donkeycar.parts.salient import SaliencyEngine
+                salient = SaliencyEngine(keras_part.model)
+
+        renderer = MovieRenderer(Tub(args.tub), keras_part, salient, start=args.start, end=args.end,
+                                 batch_size=args.batch_size, workers=args.workers, crop=model_crop(cfg))
+        print('making movie', args.out, 'from', len(renderer), 'images')
+        renderer.render(args.out, args.fps or cfg.DRIVE_LOOP_HZ, size=size, scale=args.scale)
+        print('done')
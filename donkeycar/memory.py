@@ -6,13 +6,107 @@ Created on Sun Jun 25 11:07:48 2017
 @author: wroscoe
 """
 
+import time
+from threading import Lock
+
+import numpy as np
+
+
+class FrameBuffer:
+    """
+    Holds the value of a large channel, like camera frames or lidar scans,
+    in a ring of preallocated numpy arrays.
+
+    Each put copies the new value into the slot after the latest one and
+    only then publishes it, with a sequence number and a time.monotonic()
+    timestamp. A reader gets a view of the latest slot, which is not written
+    to again until `depth - 1` newer values have been put. So with the
+    default triple buffer, a part reading a frame never sees it half
+    overwritten by the next one. Parts that keep a frame for longer than
+    that should copy it.
+
+    The slots are allocated by the first value put, or up front when
+    shape and dtype are given. A value of a different shape or dtype
+    reallocates them.
+    """
+    def __init__(self, shape=None, dtype=None, depth=3):
+        if depth < 2:
+            raise ValueError('a frame buffer needs at least 2 slots')
+        self.depth = depth
+        self.slots = None
+        self.latest = None
+        self.seq = 0
+        self.timestamp = None
+        self.lock = Lock()
+        if shape is not None:
+            self.allocate(shape, dtype or np.uint8)
+
+    def allocate(self, shape, dtype):
+        self.slots = np.zeros((self.depth,) + tuple(shape), dtype=dtype)
+
+    def put(self, value):
+        if value is None:
+            with self.lock:
+                self.latest = None
+            return
+
+        value = np.asarray(value)
+        if self.slots is None or self.slots.shape[1:] != value.shape \
+                or self.slots.dtype != value.dtype:
+            self.allocate(value.shape, value.dtype)
+
+        i = 0 if self.latest is None else (self.latest + 1) % self.depth
+        np.copyto(self.slots[i], value)
+
+        with self.lock:
+            self.latest = i
+            self.seq += 1
+            self.timestamp = time.monotonic()
+
+    def get(self):
+        with self.lock:
+            if self.latest is None:
+                return None
+            return self.slots[self.latest]
+
+    def get_stamped(self):
+        '''
+        the latest value with its sequence number and timestamp
+        '''
+        with self.lock:
+            if self.latest is None:
+                return None, self.seq, self.timestamp
+            return self.slots[self.latest], self.seq, self.timestamp
+
+
 class Memory:
     """
     A convenience class to save key/value pairs.
+
+    Channels added with add_buffer are kept in a FrameBuffer rather than
+    the dict, so their values are copied into preallocated arrays and
+    carry a sequence number and timestamp.
     """
     def __init__(self, *args, **kw):
         self.d = {}
-    
+        self.buffers = {}
+
+    def add_buffer(self, key, shape=None, dtype=None, depth=3):
+        '''
+        keep the channel key in a FrameBuffer of depth preallocated slots
+        '''
+        self.buffers[key] = FrameBuffer(shape, dtype, depth)
+        if self.d.get(key) is not None:
+            self.buffers[key].put(self.d[key])
+        self.d.pop(key, None)
+        return self.buffers[key]
+
+    def set(self, key, value):
+        if key in self.buffers:
+            self.buffers[key].put(value)
+        else:
+            self.d[key] = value
+
     def __setitem__(self, key, value):
         if type(key) is not tuple:
             print('tuples')
@@ -20,40 +114,56 @@ class Memory:
             value=(value,)
         
         for i, k in enumerate(key):
-            self.d[k] = value[i]
+            self.set(k, value[i])
         
     def __getitem__(self, key):
         if type(key) is tuple:
-            return [self.d[k] for k in key]
+            return [self[k] for k in key]
+        elif key in self.buffers:
+            return self.buffers[key].get()
         else:
             return self.d[key]
         
     def update(self, new_d):
-        self.d.update(new_d)
+        for key, value in new_d.items():
+            self.set(key, value)
         
     def put(self, keys, inputs):
         if len(keys) > 1:
             for i, key in enumerate(keys):
                 try:
-                    self.d[key] = inputs[i]
+                    self.set(key, inputs[i])
                 except IndexError as e:
                     error = str(e) + ' issue with keys: ' + str(key)
                     raise IndexError(error)
         
         else:
-            self.d[keys[0]] = inputs
+            self.set(keys[0], inputs)
 
             
             
     def get(self, keys):
-        result = [self.d.get(k) for k in keys]
+        result = [self.buffers[k].get() if k in self.buffers else self.d.get(k) for k in keys]
         return result
+
+    def get_stamped(self, key):
+        '''
+        the value of a buffered channel with its sequence number and timestamp,
+        so a part can tell whether it has seen it already
+        '''
+        return self.buffers[key].get_stamped()
+
+    def seq(self, key):
+        '''
+        how many values were put in a buffered channel so far
+        '''
+        return self.buffers[key].seq
     
     def keys(self):
-        return self.d.keys()
+        return list(self.d.keys()) + list(self.buffers.keys())
     
     def values(self):
-        return self.d.values()
+        return list(self.d.values()) + [b.get() for b in self.buffers.values()]
     
     def iteritems(self):
         return self.d.iteritems()
\ No newline at end of file
@@ -85,3 +85,191 @@ def load_shadow_images(path_mask):
     return shadow_images
 
 
+
+'''
+    Batch augmentation.
+    augment_batch applies the same enhancements as augment_image to a whole
+    (N, H, W, C) uint8 batch, with separate random factors for each image.
+    The random factors for the batch are drawn up front, so a seed, or a
+    np.random.RandomState, gives the same augmentation again. OpenCV does
+    the work when it's installed, numpy otherwise.
+'''
+GRAY_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13.0
+
+def random_shadows(n, h, w, rng, min_light=0.5, max_light=0.9):
+    '''
+    (N, H, W) light multipliers, darkening one side of a random line across each image
+    '''
+    ys, xs = np.mgrid[0:h, 0:w].astype(np.float32)
+    top = rng.uniform(0, w, n).astype(np.float32)[:, None, None]
+    bottom = rng.uniform(0, w, n).astype(np.float32)[:, None, None]
+    left = rng.uniform(0.0, 1.0, n)[:, None, None] < 0.5
+    shade = (xs < top + (bottom - top) * ys / h) == left
+    light = rng.uniform(min_light, max_light, n).astype(np.float32)[:, None, None]
+    return np.where(shade, light, np.float32(1.0))
+
+def random_persp_coeffs(n, w, h, rng):
+    '''
+    the coefficients of rand_persp_transform for a whole batch, solved in one go.
+    each row maps output pixels to the input pixels they sample.
+    '''
+    new_width = np.floor(w * rng.uniform(0.9, 1.1, n))
+    xshift = np.floor(w * rng.uniform(-0.2, 0.2, n))
+    pa = [(0, 0), (w, 0), (w, h), (0, h)]
+    pb = np.zeros((n, 4, 2))
+    pb[:, 1] = (w, 0)
+    pb[:, 2, 0] = new_width
+    pb[:, 2:, 1] = h
+    pb[:, 3, 0] = xshift
+
+    A = np.zeros((n, 8, 8))
+    for i, (x, y) in enumerate(pa):
+        px, py = pb[:, i, 0], pb[:, i, 1]
+        A[:, 2 * i, 0:3] = (x, y, 1)
+        A[:, 2 * i, 6] = -px * x
+        A[:, 2 * i, 7] = -px * y
+        A[:, 2 * i + 1, 3:6] = (x, y, 1)
+        A[:, 2 * i + 1, 6] = -py * x
+        A[:, 2 * i + 1, 7] = -py * y
+    return np.linalg.solve(A, pb.reshape(n, 8, 1))[..., 0]
+
+def batch_gray(imgs):
+    '''
+    grayscale of a float (N, H, W, C) batch as (N, H, W, 1), like PIL's L mode
+    '''
+    if imgs.shape[-1] == 1:
+        return imgs
+    gray = imgs[..., 0] * GRAY_WEIGHTS[0]
+    gray += imgs[..., 1] * GRAY_WEIGHTS[1]
+    gray += imgs[..., 2] * GRAY_WEIGHTS[2]
+    return gray[..., np.newaxis]
+
+def batch_smooth(imgs):
+    '''
+    the SMOOTH filter PIL's Sharpness blends against. border pixels are kept.
+    '''
+    out = imgs.copy()
+    h, w = imgs.shape[1:3]
+    total = imgs[:, 1:-1, 1:-1] * np.float32(4.0)
+    for dy in range(3):
+        for dx in range(3):
+            total += imgs[:, dy:h - 2 + dy, dx:w - 2 + dx]
+    total /= np.float32(13.0)
+    out[:, 1:-1, 1:-1] = total
+    return out
+
+def blend(degenerate, imgs, factor):
+    '''
+    PIL's ImageEnhance, in place: interpolate, or extrapolate, from degenerate to imgs
+    '''
+    imgs -= degenerate
+    imgs *= factor
+    imgs += degenerate
+    return np.clip(imgs, 0.0, 255.0, out=imgs)
+
+def batch_persp_transform(imgs, coeffs):
+    '''
+    warp a float batch by the coefficients of random_persp_coeffs, with
+    bilinear sampling. pixels that come from outside the input are black.
+    '''
+    n, h, w, _ = imgs.shape
+    a, b, c, d, e, f, g, k = [coeffs[:, i, None, None] for i in range(8)]
+
+    ys, xs = np.mgrid[0:h, 0:w] + 0.5
+    denom = g * xs + k * ys + 1.0
+    sx = (a * xs + b * ys + c) / denom - 0.5
+    sy = (d * xs + e * ys + f) / denom - 0.5
+
+    x0 = np.floor(sx)
+    y0 = np.floor(sy)
+    wx = (sx - x0).astype(np.float32)[..., np.newaxis]
+    wy = (sy - y0).astype(np.float32)[..., np.newaxis]
+    x0 = x0.astype(np.int64)
+    y0 = y0.astype(np.int64)
+    ix = np.arange(n)[:, None, None]
+
+    def sample(yy, xx):
+        inside = ((xx >= 0) & (xx < w) & (yy >= 0) & (yy < h))[..., np.newaxis]
+        return imgs[ix, np.clip(yy, 0, h - 1), np.clip(xx, 0, w - 1)] * inside
+
+    top = sample(y0, x0) * (1 - wx) + sample(y0, x0 + 1) * wx
+    bottom = sample(y0 + 1, x0) * (1 - wx) + sample(y0 + 1, x0 + 1) * wx
+    return top * (1 - wy) + bottom * wy
+
+def augment_batch_np(imgs, factors, shade, coeffs):
+    out = imgs.astype(np.float32)
+    bright, contrast, sharp, color = [factors[:, i, None, None, None].astype(np.float32) for i in range(4)]
+
+    #same coloration and sharpness changes, in the same order, as augment_image
+    blend(0.0, out, bright)
+    blend(batch_gray(out).mean(axis=(1, 2, 3), keepdims=True), out, contrast)
+    blend(batch_smooth(out), out, sharp)
+    blend(batch_gray(out), out, color)
+
+    if shade is not None:
+        out *= shade[..., np.newaxis]
+
+    if coeffs is not None:
+        out = batch_persp_transform(out, coeffs)
+
+    return np.rint(out).astype(np.uint8)
+
+def augment_image_cv2(img, factors, shade, coeffs, cv2):
+    bright, contrast, sharp, color = factors
+    shape = img.shape
+    rgb = shape[-1] == 3
+
+    img = cv2.convertScaleAbs(img, alpha=bright)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY) if rgb else img
+    img = cv2.convertScaleAbs(img, alpha=contrast, beta=gray.mean() * (1.0 - contrast))
+    smooth = cv2.filter2D(img, -1, SMOOTH_KERNEL)
+    img = cv2.addWeighted(img, sharp, smooth, 1.0 - sharp, 0)
+    if rgb:
+        gray = cv2.cvtColor(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+        img = cv2.addWeighted(img, color, gray, 1.0 - color, 0)
+
+    img = img.reshape(shape)
+
+    if shade is not None:
+        img = (img * shade[..., np.newaxis]).astype(np.uint8)
+
+    if coeffs is not None:
+        M = np.append(coeffs, 1.0).reshape(3, 3)
+        img = cv2.warpPerspective(img, M, (shape[1], shape[0]),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP).reshape(shape)
+
+    return img
+
+def augment_batch(imgs, shadows=False, do_warp_persp=False, seed=None):
+    '''
+    augment a (N, H, W, C) uint8 batch, returns a new uint8 batch.
+    seed may be an int or a np.random.RandomState. when None, the global
+    np.random state is used.
+    '''
+    if seed is None:
+        rng = np.random
+    elif isinstance(seed, np.random.RandomState):
+        rng = seed
+    else:
+        rng = np.random.RandomState(seed)
+
+    n, h, w = imgs.shape[:3]
+    factors = np.stack([rng.uniform(0.5, 2.0, n),
+                        rng.uniform(0.5, 1.0, n),
+                        rng.uniform(0.5, 1.5, n),
+                        rng.uniform(0.0, 1.0, n)], axis=1)
+    shade = random_shadows(n, h, w, rng) if shadows else None
+    coeffs = random_persp_coeffs(n, w, h, rng) if do_warp_persp else None
+
+    try:
+        import cv2
+    except ImportError:
+        return augment_batch_np(imgs, factors, shade, coeffs)
+
+    out = np.empty_like(imgs)
+    for i in range(n):
+        out[i] = augment_image_cv2(imgs[i], factors[i],
+            None if shade is None else shade[i],
+            None if coeffs is None else coeffs[i], cv2)
+    return out
@@ -0,0 +1,255 @@
+'''
+    File: codec.py
+    Image codecs shared by the tub writer, ImgArrToJpg and the web video stream.
+
+    Every codec turns a (H, W, C) uint8 numpy image into bytes and back.
+    The JPEG codecs differ only in the library doing the work, so pick the
+    fastest one installed on the machine with get_codec('auto'), or compare
+    them with `donkey codecbench`.
+'''
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+class ImageCodec:
+    '''
+    Base class of the codecs. quality is the JPEG quality from 1 to 100,
+    subsampling the chroma subsampling, one of '444', '422' or '420'.
+    The defaults are the ones PIL uses when saving a JPEG.
+    '''
+    name = None
+    ext = '.jpg'
+    mime = 'image/jpeg'
+    SUBSAMPLING = ('444', '422', '420')
+
+    def __init__(self, quality=75, subsampling='420'):
+        if subsampling not in self.SUBSAMPLING:
+            raise ValueError('unknown chroma subsampling: %s' % subsampling)
+        self.quality = int(quality)
+        self.subsampling = subsampling
+
+    def __repr__(self):
+        return '%s(quality=%d, subsampling=%s)' % (self.__class__.__name__, self.quality, self.subsampling)
+
+    def encode(self, arr):
+        raise NotImplementedError()
+
+    def decode(self, data):
+        raise NotImplementedError()
+
+    def save(self, arr, path):
+        with open(path, 'wb') as fp:
+            fp.write(self.encode(arr))
+
+
+def as_image_array(arr):
+    '''
+    uint8 array of the image, with single channel images as (H, W)
+    '''
+    arr = np.asarray(arr)
+    if arr.dtype != np.uint8:
+        arr = np.uint8(arr)
+    if arr.ndim == 3 and arr.shape[2] == 1:
+        arr = arr[:, :, 0]
+    return arr
+
+
+class PILCodec(ImageCodec):
+    name = 'pil'
+    PIL_SUBSAMPLING = {'444': 0, '422': 1, '420': 2}
+
+    def encode(self, arr):
+        f = BytesIO()
+        Image.fromarray(as_image_array(arr)).save(f, format='jpeg', quality=self.quality,
+            subsampling=self.PIL_SUBSAMPLING[self.subsampling])
+        return f.getvalue()
+
+    def decode(self, data):
+        return np.array(Image.open(BytesIO(data)))
+
+
+class OpenCVCodec(ImageCodec):
+    '''
+    cv2.imencode. OpenCV before 4.5.5 can't set the subsampling and always uses 4:2:0.
+    '''
+    name = 'opencv'
+
+    def __init__(self, *args, **kwargs):
+        super(OpenCVCodec, self).__init__(*args, **kwargs)
+        import cv2
+        self.cv2 = cv2
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        if hasattr(cv2, 'IMWRITE_JPEG_SAMPLING_FACTOR'):
+            factor = {'444': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+                      '422': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+                      '420': cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420}[self.subsampling]
+            self.params += [cv2.IMWRITE_JPEG_SAMPLING_FACTOR, factor]
+
+    def encode(self, arr):
+        arr = as_image_array(arr)
+        if arr.ndim == 3:
+            arr = self.cv2.cvtColor(arr, self.cv2.COLOR_RGB2BGR)
+        ok, buf = self.cv2.imencode('.jpg', arr, self.params)
+        if not ok:
+            raise ValueError('OpenCV failed to encode the image')
+        return buf.tobytes()
+
+    def decode(self, data):
+        arr = self.cv2.imdecode(np.frombuffer(data, dtype=np.uint8), self.cv2.IMREAD_UNCHANGED)
+        if arr.ndim == 3:
+            arr = self.cv2.cvtColor(arr, self.cv2.COLOR_BGR2RGB)
+        return arr
+
+
+class SimpleJpegCodec(ImageCodec):
+    '''
+    libjpeg-turbo through the simplejpeg package
+    '''
+    name = 'simplejpeg'
+
+    def __init__(self, *args, **kwargs):
+        super(SimpleJpegCodec, self).__init__(*args, **kwargs)
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+
+    def encode(self, arr):
+        arr = np.ascontiguousarray(np.asarray(arr, dtype=np.uint8))
+        if arr.ndim == 2:
+            arr = arr[:, :, np.newaxis]
+        colorspace = 'GRAY' if arr.shape[2] == 1 else 'RGB'
+        return self.simplejpeg.encode_jpeg(arr, quality=self.quality, colorspace=colorspace,
+            colorsubsampling=self.subsampling)
+
+    def decode(self, data):
+        return self.simplejpeg.decode_jpeg(data, colorspace='RGB')
+
+
+class TurboJpegCodec(ImageCodec):
+    '''
+    libjpeg-turbo through the PyTurboJPEG package
+    '''
+    name = 'turbojpeg'
+
+    def __init__(self, *args, **kwargs):
+        super(TurboJpegCodec, self).__init__(*args, **kwargs)
+        import turbojpeg
+        self.turbojpeg = turbojpeg
+        self.jpeg = turbojpeg.TurboJPEG()
+        self.tjsamp = {'444': turbojpeg.TJSAMP_444,
+                       '422': turbojpeg.TJSAMP_422,
+                       '420': turbojpeg.TJSAMP_420}[self.subsampling]
+
+    def encode(self, arr):
+        arr = np.asarray(arr, dtype=np.uint8)
+        if arr.ndim == 2:
+            arr = arr[:, :, np.newaxis]
+        if arr.shape[2] == 1:
+            return self.jpeg.encode(arr, quality=self.quality, pixel_format=self.turbojpeg.TJPF_GRAY,
+                jpeg_subsample=self.turbojpeg.TJSAMP_GRAY)
+        return self.jpeg.encode(arr, quality=self.quality, pixel_format=self.turbojpeg.TJPF_RGB,
+            jpeg_subsample=self.tjsamp)
+
+    def decode(self, data):
+        return self.jpeg.decode(data, pixel_format=self.turbojpeg.TJPF_RGB)
+
+
+class PNGCodec(ImageCodec):
+    '''
+    lossless PNG. quality is ignored, compress_level trades speed for size.
+    '''
+    name = 'png'
+    ext = '.png'
+    mime = 'image/png'
+
+    def __init__(self, quality=75, subsampling='420', compress_level=1):
+        super(PNGCodec, self).__init__(quality, subsampling)
+        self.compress_level = compress_level
+
+    def encode(self, arr):
+        f = BytesIO()
+        Image.fromarray(as_image_array(arr)).save(f, format='png', compress_level=self.compress_level)
+        return f.getvalue()
+
+    def decode(self, data):
+        return np.array(Image.open(BytesIO(data)))
+
+
+class RawCodec(ImageCodec):
+    '''
+    the uncompressed array in the .npy format. nothing to encode, but large.
+    '''
+    name = 'raw'
+    ext = '.npy'
+    mime = 'application/octet-stream'
+
+    def encode(self, arr):
+        f = BytesIO()
+        np.save(f, np.asarray(arr, dtype=np.uint8))
+        return f.getvalue()
+
+    def decode(self, data):
+        return np.load(BytesIO(data))
+
+
+CODECS = [SimpleJpegCodec, TurboJpegCodec, OpenCVCodec, PILCodec, PNGCodec, RawCodec]
+
+#the JPEG codecs, fastest first. Pillow wheels bundle libjpeg-turbo too, it
+#beats cv2.imencode once the RGB to BGR conversion is counted.
+JPEG_CODECS = ['simplejpeg', 'turbojpeg', 'pil', 'opencv']
+
+
+def get_codec(name='pil', quality=75, subsampling='420'):
+    '''
+    the codec called name, see CODECS. 'auto' is the fastest JPEG codec
+    installed. raises ImportError when the codec's library isn't installed.
+    '''
+    if name == 'auto':
+        for jpeg_name in JPEG_CODECS:
+            try:
+                return get_codec(jpeg_name, quality, subsampling)
+            except ImportError:
+                continue
+
+    for codec in CODECS:
+        if codec.name == name:
+            return codec(quality, subsampling)
+
+    raise ValueError('unknown image codec: %s' % name)
+
+
+def available_codecs(quality=75, subsampling='420'):
+    '''
+    an instance of each codec whose library is installed
+    '''
+    codecs = []
+    for codec in CODECS:
+        try:
+            codecs.append(codec(quality, subsampling))
+        except ImportError:
+            pass
+    return codecs
+
+
+def benchmark_codec(codec, frames, repeat=3):
+    '''
+    encode and decode the frames repeat times with codec. returns the
+    average encode and decode ms per frame and bytes per frame.
+    '''
+    encoded = [codec.encode(frame) for frame in frames]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = [codec.encode(frame) for frame in frames]
+    encode_ms = (time.perf_counter() - start) * 1000 / (repeat * len(frames))
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in encoded:
+            codec.decode(data)
+    decode_ms = (time.perf_counter() - start) * 1000 / (repeat * len(frames))
+
+    size = sum(len(data) for data in encoded) / len(encoded)
+    return {'codec': codec.name, 'encode_ms': encode_ms, 'decode_ms': decode_ms, 'bytes': size}
@@ -2,6 +2,8 @@ import time
 import cv2
 import numpy as np
 
+from donkeycar.utils import FrameHistory
+
 class ImgGreyscale():
 
     def run(self, img_arr):
@@ -160,8 +162,8 @@ class ImgStack:
     The most recent image is the last channel, and pushes previous images towards the front.
     """
     def __init__(self, num_channels=3):
-        self.img_arr = None
         self.num_channels = num_channels
+        self.history = FrameHistory(num_channels, axis=-1, dtype=np.uint8, fill=0)
 
     def rgb2gray(self, rgb):
         '''
@@ -170,18 +172,7 @@ class ImgStack:
         return np.dot(rgb[...,:3], [0.299, 0.587, 0.114])
         
     def run(self, img_arr):
-        width, height, _ = img_arr.shape        
-        gray = self.rgb2gray(img_arr)
-        
-        if self.img_arr is None:
-            self.img_arr = np.zeros([width, height, self.num_channels], dtype=np.dtype('B'))
-
-        for ch in range(self.num_channels - 1):
-            self.img_arr[...,ch] = self.img_arr[...,ch+1]
-
-        self.img_arr[...,self.num_channels - 1:] = np.reshape(gray, (width, height, 1))
-
-        return self.img_arr
+        return self.history.push(self.rgb2gray(img_arr))
 
     def shutdown(self):
         pass
@@ -12,11 +12,18 @@ import json
 import datetime
 import random
 import glob
+import struct
+import threading
+import queue
+from collections import OrderedDict
+from io import BytesIO
 import numpy as np
 import pandas as pd
 
 from PIL import Image
 
+from donkeycar.parts.codec import PILCodec, PNGCodec
+
 
 class OriginalWriter:
     """
@@ -131,6 +138,690 @@ class OriginalWriter:
 
 
 
+class TubCatalog(object):
+    """
+    An append-only index of the records stored in a tub.
+
+    Each record gets one fixed width entry of (record index, offset,
+    milliseconds, flags) in catalog.bin, so the whole catalog loads with a
+    single read and the tub never has to list its directory or parse
+    record file names to find out what it contains. The offset is the
+    position of the record in the order it was written.
+
+    Entries are only ever appended. Removing a record flags its entry as
+    deleted in place, or truncates the file when the removed records are
+    the most recent ones, which is the common case of erasing the last N
+    records while driving.
+    """
+
+    dtype = np.dtype([('ix', '<i8'), ('offset', '<i8'), ('ms', '<i8'), ('flags', '<u1')])
+
+    EXCLUDED = 1
+    DELETED = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.load()
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        if self.exists():
+            raw = np.fromfile(self.path, dtype=np.uint8)
+            #drop a partially written trailing entry, if any.
+            num = len(raw) // self.dtype.itemsize
+            rows = raw[:num * self.dtype.itemsize].view(self.dtype)
+        else:
+            rows = np.zeros(0, dtype=self.dtype)
+        self.set_rows(rows)
+
+    def set_rows(self, rows):
+        '''
+        replace the entries held in memory, without touching catalog.bin
+        '''
+        self.rows = np.zeros(max(64, len(rows) * 2), dtype=self.dtype)
+        self.rows[:len(rows)] = rows
+        self.n = len(rows)
+        ixs = rows['ix']
+        #while records arrive in increasing order, which is how a tub is
+        #written, rows can be binary searched directly.
+        self.in_order = bool(np.all(ixs[1:] > ixs[:-1]))
+        self.num_live = int(np.count_nonzero(self._live_mask()))
+        self._invalidate()
+
+    def _invalidate(self):
+        self._live = None
+        self._positions = None
+
+    def _live_mask(self):
+        return (self.rows['flags'][:self.n] & self.DELETED) == 0
+
+    def entries(self):
+        '''
+        return the entries of all records that have not been removed, sorted
+        by record index.
+        '''
+        if self._live is None:
+            live = self.rows[:self.n][self._live_mask()]
+            if not self.in_order:
+                live = np.sort(live, order='ix', kind='mergesort')
+            self._live = live
+        return self._live
+
+    def _position(self, ix):
+        '''
+        position in self.rows of the live entry for record ix, or None.
+        '''
+        if self.in_order:
+            pos = int(np.searchsorted(self.rows['ix'][:self.n], ix))
+        else:
+            if self._positions is None:
+                live = np.nonzero(self._live_mask())[0]
+                order = np.argsort(self.rows['ix'][live], kind='mergesort')
+                self._positions = live[order]
+            i = int(np.searchsorted(self.rows['ix'][self._positions], ix))
+            pos = int(self._positions[i]) if i < len(self._positions) else self.n
+        if pos < self.n and self.rows['ix'][pos] == ix and \
+                not self.rows['flags'][pos] & self.DELETED:
+            return pos
+        return None
+
+    def lookup(self, ixs):
+        '''
+        the entries of the records ixs, in that order. raises KeyError for
+        an index with no entry, rather than returning its neighbour's.
+        '''
+        entries = self.entries()
+        ixs = np.asarray(ixs, dtype=np.int64)
+        pos = np.searchsorted(entries['ix'], ixs)
+        found = pos < len(entries)
+        found[found] = entries['ix'][pos[found]] == ixs[found]
+        if not np.all(found):
+            raise KeyError('no records %s in the catalog' % ixs[~found].tolist())
+        return entries[pos]
+
+    def __len__(self):
+        return self.num_live
+
+    def __contains__(self, ix):
+        return self._position(ix) is not None
+
+    def index(self, exclude=None):
+        '''
+        sorted numpy array of record indexes, optionally leaving out the
+        ones in the exclude set.
+        '''
+        ixs = self.entries()['ix']
+        if exclude:
+            ixs = ixs[~np.isin(ixs, list(exclude))]
+        return ixs
+
+    def last_ix(self):
+        if self.num_live == 0:
+            raise ValueError('tub catalog is empty')
+        if self.in_order:
+            pos = self.n - 1
+            while self.rows['flags'][pos] & self.DELETED:
+                pos -= 1
+            return int(self.rows['ix'][pos])
+        return int(self.entries()['ix'][-1])
+
+    def get(self, ix):
+        pos = self._position(ix)
+        if pos is None:
+            raise KeyError(ix)
+        return self.rows[pos]
+
+    def append(self, ix, ms, offset=None):
+        if offset is None:
+            offset = self.n
+        row = np.array([(ix, offset, ms, 0)], dtype=self.dtype)
+        with open(self.path, 'ab') as f:
+            f.write(row.tobytes())
+        if self.n == len(self.rows):
+            grown = np.zeros(len(self.rows) * 2, dtype=self.dtype)
+            grown[:self.n] = self.rows
+            self.rows = grown
+        if self.n > 0 and ix <= self.rows['ix'][self.n - 1]:
+            self.in_order = False
+        self.rows[self.n] = row[0]
+        self.n += 1
+        self.num_live += 1
+        self._invalidate()
+        return offset
+
+    def remove(self, ix):
+        pos = self._position(ix)
+        if pos is None:
+            return
+        self.rows['flags'][pos] |= self.DELETED
+        self.num_live -= 1
+        #trim removed entries from the end of the file, otherwise just
+        #flag this one as deleted in place.
+        end = self.n
+        while end > 0 and self.rows['flags'][end - 1] & self.DELETED:
+            end -= 1
+        if end < self.n:
+            self.n = end
+            with open(self.path, 'r+b') as f:
+                f.truncate(end * self.dtype.itemsize)
+        else:
+            with open(self.path, 'r+b') as f:
+                f.seek(pos * self.dtype.itemsize + self.dtype.fields['flags'][1])
+                f.write(self.rows['flags'][pos:pos + 1].tobytes())
+        self._invalidate()
+
+    def set_excluded(self, exclude):
+        rows = self.rows[:self.n]
+        excluded = np.isin(rows['ix'], list(exclude))
+        rows['flags'][excluded] |= self.EXCLUDED
+        rows['flags'][~excluded] &= ~np.uint8(self.EXCLUDED)
+        self.write()
+
+    def excluded(self):
+        entries = self.entries()
+        return set(entries['ix'][(entries['flags'] & self.EXCLUDED) != 0].tolist())
+
+    def write(self, rows=None):
+        '''
+        replace the catalog with the given entries, or with the current
+        live entries, compacting away removed records. The entries in
+        memory are replaced first, so when writing catalog.bin fails with
+        an OSError the catalog is still usable for this session.
+        '''
+        if rows is None:
+            rows = self.entries().copy()
+        self.set_rows(rows)
+        tmp_path = self.path + '.tmp'
+        try:
+            rows.tofile(tmp_path)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def rebuild(self, ixs, timestamps, exclude=(), offsets=None):
+        ixs = np.asarray(ixs, dtype=np.int64)
+        if offsets is None:
+            offsets = np.arange(len(ixs))
+        order = np.argsort(ixs, kind='mergesort')
+        rows = np.zeros(len(ixs), dtype=self.dtype)
+        rows['ix'] = ixs[order]
+        rows['offset'] = np.asarray(offsets, dtype=np.int64)[order]
+        rows['ms'] = np.asarray(timestamps, dtype=np.int64)[order]
+        rows['flags'] = np.where(np.isin(rows['ix'], list(exclude)), self.EXCLUDED, 0)
+        self.write(rows)
+
+
+class TubColumnStore(object):
+    """
+    Columnar storage for the scalar channels of a tub.
+
+    Instead of one record_N.json per record, every non image channel is
+    packed into one fixed width row that is appended to a chunked binary
+    segment (columns_00000.bin, columns_00001.bin, ...). manifest.json holds
+    the row layout, so a whole tub's angles or throttles load as NumPy arrays
+    with no parsing at all. Images are still written as separate files and
+    their names are derived from the record index, so they take no space
+    in the row.
+
+    Supported types are float, int, boolean, str (stored as utf-8, cut to
+    str_width bytes with a warning) and vector (a fixed length float array, the length taken
+    from the first record written).
+    """
+
+    version = 1
+
+    def __init__(self, path, inputs=None, types=None, chunk_size=10000, str_width=32):
+        self.path = path
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        self.inputs = inputs
+        self.types = types
+        self.chunk_size = chunk_size
+        self.str_width = str_width
+        self.dtype = None
+        self._segments = {}
+        self._truncated = set()
+        self.num_rows = 0
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.manifest = json.load(f)
+            self.chunk_size = self.manifest['chunk_size']
+            self.inputs = self.manifest['inputs']
+            self.types = self.manifest['types']
+            self.dtype = np.dtype([(name, fmt, tuple(shape)) for name, fmt, shape in self.manifest['columns']])
+            self.num_rows = self.count_rows()
+
+    def column_format(self, typ, val):
+        if typ == 'float':
+            return '<f8', ()
+        elif typ == 'int':
+            return '<i8', ()
+        elif typ == 'boolean':
+            return '?', ()
+        elif typ == 'str':
+            return 'S%d' % self.str_width, ()
+        elif typ == 'vector':
+            return '<f8', (len(val),)
+        msg = 'TubColumnStore does not know what to do with this type {}'.format(typ)
+        raise TypeError(msg)
+
+    def stored_keys(self):
+        return [k for k, t in zip(self.inputs, self.types) if t not in ('image_array', 'image')]
+
+    def create_manifest(self, record):
+        '''
+        fix the row layout. This waits for the first record so that the
+        length of vector channels is known.
+        '''
+        input_types = dict(zip(self.inputs, self.types))
+        columns = [('_ix', '<i8', []), ('milliseconds', '<i8', [])]
+        for key in self.stored_keys():
+            fmt, shape = self.column_format(input_types[key], record.get(key))
+            columns.append((key, fmt, list(shape)))
+        self.manifest = {'version': self.version,
+                         'chunk_size': self.chunk_size,
+                         'inputs': self.inputs,
+                         'types': self.types,
+                         'columns': columns}
+        with open(self.manifest_path, 'w') as f:
+            json.dump(self.manifest, f)
+        self.dtype = np.dtype([(name, fmt, tuple(shape)) for name, fmt, shape in columns])
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, 'columns_%05d.bin' % segment)
+
+    def segment_rows(self, segment):
+        try:
+            return os.path.getsize(self.segment_path(segment)) // self.dtype.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def count_rows(self):
+        '''
+        count the rows in the segment files. the store keeps the count in
+        num_rows from then on, so appending doesn't stat the segments.
+        '''
+        if self.dtype is None:
+            return 0
+        segment = 0
+        count = 0
+        while True:
+            rows = self.segment_rows(segment)
+            count += rows
+            if rows < self.chunk_size:
+                return count
+            segment += 1
+
+    def __len__(self):
+        return self.num_rows
+
+    def to_row(self, ix, record):
+        row = np.zeros(1, dtype=self.dtype)
+        row['_ix'] = ix
+        row['milliseconds'] = record.get('milliseconds', 0)
+        input_types = dict(zip(self.inputs, self.types))
+        for key in self.stored_keys():
+            val = record.get(key)
+            typ = input_types[key]
+            if typ == 'str':
+                val = b'' if val is None else str(val).encode('utf-8')
+                if len(val) > self.str_width:
+                    if key not in self._truncated:
+                        print('TubColumnStore: values of {} are cut to {} bytes'.format(key, self.str_width))
+                        self._truncated.add(key)
+                    val = val[:self.str_width].decode('utf-8', 'ignore').encode('utf-8')
+            elif val is None:
+                val = np.nan if typ in ('float', 'vector') else 0
+            elif typ == 'vector' and len(val) != self.dtype[key].shape[0]:
+                raise ValueError('vector {} should have length {}'.format(key, self.dtype[key].shape[0]))
+            row[key] = val
+        return row
+
+    def append(self, ix, record):
+        '''
+        append a record and return its row offset
+        '''
+        if self.dtype is None:
+            self.create_manifest(record)
+        row = self.to_row(ix, record)
+        offset = self.num_rows
+        with open(self.segment_path(offset // self.chunk_size), 'ab') as f:
+            f.write(row.tobytes())
+        self.num_rows += 1
+        return offset
+
+    def _locate(self, offset):
+        segment, local = divmod(int(offset), self.chunk_size)
+        return self.segment_path(segment), local * self.dtype.itemsize
+
+    def row(self, offset):
+        path, pos = self._locate(offset)
+        with open(path, 'rb') as f:
+            f.seek(pos)
+            buf = f.read(self.dtype.itemsize)
+        if len(buf) != self.dtype.itemsize:
+            raise IndexError('no row at offset %d' % offset)
+        return np.frombuffer(buf, dtype=self.dtype)[0]
+
+    def update(self, offset, key, val):
+        '''
+        overwrite one channel of an existing row in place.
+        '''
+        row = self.row(offset).copy()
+        input_types = dict(zip(self.inputs, self.types))
+        record = {k: self.decode(row[k], input_types[k]) for k in self.stored_keys()}
+        record[key] = val
+        record['milliseconds'] = row['milliseconds']
+        path, pos = self._locate(offset)
+        with open(path, 'r+b') as f:
+            f.seek(pos)
+            f.write(self.to_row(row['_ix'], record).tobytes())
+
+    def read(self):
+        '''
+        all rows written so far, as one structured array. Segments are
+        memory mapped, so only the columns that get touched are paged in.
+        '''
+        if self.dtype is None:
+            return np.zeros(0, dtype=[('_ix', '<i8'), ('milliseconds', '<i8')])
+        segments = []
+        segment = 0
+        while True:
+            rows = self.segment_rows(segment)
+            if rows == 0:
+                break
+            cached = self._segments.get(segment)
+            if cached is None or len(cached) != rows:
+                cached = np.memmap(self.segment_path(segment), dtype=self.dtype, mode='r', shape=(rows,))
+                if rows == self.chunk_size:
+                    self._segments[segment] = cached
+            segments.append(cached)
+            if rows < self.chunk_size:
+                break
+            segment += 1
+        if len(segments) == 1:
+            return segments[0]
+        return np.concatenate(segments)
+
+    def columns(self, keys, offsets=None):
+        '''
+        return a dict of key: numpy array, optionally only for the rows at
+        the given offsets.
+        '''
+        rows = self.read()
+        if offsets is not None:
+            rows = rows[np.asarray(offsets, dtype=np.int64)]
+        input_types = dict(zip(self.inputs, self.types))
+        cols = {}
+        for key in keys:
+            col = np.asarray(rows[key])
+            if input_types.get(key) == 'str':
+                col = np.char.decode(col, 'utf-8')
+            cols[key] = col
+        return cols
+
+    @staticmethod
+    def decode(val, typ):
+        if typ == 'str':
+            return val.decode('utf-8')
+        elif typ == 'float':
+            val = float(val)
+            return None if np.isnan(val) else val
+        elif typ == 'int':
+            return int(val)
+        elif typ == 'boolean':
+            return bool(val)
+        elif typ == 'vector':
+            return val.tolist()
+        return val
+
+    def to_record(self, row, image_name):
+        '''
+        rebuild the dict that the json format would have stored for a row.
+        image_name maps (ix, key) to the file name of an image channel.
+        '''
+        ix = int(row['_ix'])
+        record = {}
+        for key, typ in zip(self.inputs, self.types):
+            if typ == 'image_array':
+                record[key] = image_name(ix, key)
+            elif typ != 'image':
+                record[key] = self.decode(row[key], typ)
+        record['milliseconds'] = int(row['milliseconds'])
+        return record
+
+
+class TubImagePack(object):
+    """
+    The frames of one image channel of a tub, already decoded and scaled to
+    a given width, height and depth, packed into a single .npy file.
+
+    The pack is opened as a read only memory map, so looking up a frame is a
+    slice of the mapped array with no decoding and no copy, and the OS page
+    cache decides what stays in memory. Build one with Tub.pack_images or
+    the `donkey tubpack` command. Records written after the pack was built
+    are simply not in it.
+    """
+
+    def __init__(self, tub_path, width, height, depth, key='cam/image_array'):
+        name = 'pack_%s_%dx%dx%d' % (key.replace('/', '-'), width, height, depth)
+        self.path = os.path.join(tub_path, name + '.npy')
+        self.index_path = os.path.join(tub_path, name + '_index.npy')
+        self.shape = (height, width, depth)
+        self.key = key
+        self.images = None
+        self.ixs = None
+
+    def exists(self):
+        return os.path.exists(self.path) and os.path.exists(self.index_path)
+
+    def open(self):
+        self.images = np.load(self.path, mmap_mode='r')
+        self.ixs = np.load(self.index_path)
+        return self
+
+    def __len__(self):
+        return len(self.ixs)
+
+    def rows(self, ixs):
+        '''
+        rows of the pack holding the given record indexes, -1 where a record
+        is not in the pack.
+        '''
+        ixs = np.asarray(ixs, dtype=np.int64)
+        rows = np.searchsorted(self.ixs, ixs)
+        rows[rows >= len(self.ixs)] = 0
+        found = self.ixs[rows] == ixs if len(self.ixs) else np.zeros(len(ixs), dtype=bool)
+        return np.where(found, rows, -1)
+
+    def __contains__(self, ix):
+        return self.rows([ix])[0] >= 0
+
+    def get(self, ix):
+        row = self.rows([ix])[0]
+        if row < 0:
+            return None
+        return self.images[row]
+
+    def get_batch(self, ixs):
+        '''
+        gather the frames of several records into one (N, H, W, D) array.
+        '''
+        rows = self.rows(ixs)
+        if np.any(rows < 0):
+            raise KeyError('records missing from image pack: %s' % list(np.asarray(ixs)[rows < 0]))
+        return self.images[rows]
+
+    def build(self, ixs, load_image):
+        '''
+        decode every record through load_image(ix) and write the pack.
+        Records that fail to load are left out.
+        '''
+        ixs = np.sort(np.asarray(ixs, dtype=np.int64))
+        tmp_path = self.path + '.tmp.npy'
+        images = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                           shape=(len(ixs),) + self.shape)
+        packed = np.zeros(len(ixs), dtype=bool)
+        for row, ix in enumerate(ixs):
+            img_arr = load_image(ix)
+            if img_arr is None:
+                continue
+            images[row] = np.asarray(img_arr).reshape(self.shape)
+            packed[row] = True
+        images.flush()
+        del images
+
+        if not np.all(packed):
+            #compact the frames that loaded.
+            images = np.load(tmp_path, mmap_mode='r')
+            compact_path = self.path + '.compact.npy'
+            compact = np.lib.format.open_memmap(compact_path, mode='w+', dtype=np.uint8,
+                                                shape=(int(packed.sum()),) + self.shape)
+            compact[:] = images[packed]
+            compact.flush()
+            del compact, images
+            os.replace(compact_path, tmp_path)
+            ixs = ixs[packed]
+
+        np.save(self.index_path, ixs)
+        os.replace(tmp_path, self.path)
+        return self.open()
+
+
+class ImageCache(object):
+    """
+    A least recently used cache of images, bounded by the bytes it holds
+    rather than by the number of images.
+
+    Images are kept decoded by default. With compressed=True the cache keeps
+    the bytes of the image files instead and decodes them on every hit, which
+    fits several times more frames in the same memory budget. It's safe to
+    share between threads, but every process gets its own copy.
+    """
+
+    def __init__(self, max_bytes, compressed=False):
+        self.max_bytes = max_bytes
+        self.compressed = compressed
+        self.images = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, cfg):
+        '''
+        the image cache configured by CACHE_IMAGES, IMAGE_CACHE_MB and
+        IMAGE_CACHE_COMPRESSED, or None when caching is off.
+        '''
+        if not cfg.CACHE_IMAGES:
+            return None
+        return cls(int(cfg.IMAGE_CACHE_MB * 1024 * 1024), cfg.IMAGE_CACHE_COMPRESSED)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, path):
+        return path in self.images
+
+    def __str__(self):
+        return '%d images, %.1f MB, %d hits, %d misses, %d evicted' % \
+            (len(self.images), self.nbytes / (1024 * 1024), self.hits, self.misses, self.evictions)
+
+    def get(self, path, load):
+        '''
+        the image at path, decoded by load. load takes a filename or a file
+        object and returns the image array, or None when it can't be read.
+        '''
+        with self.lock:
+            val = self.images.get(path)
+            if val is not None:
+                self.images.move_to_end(path)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if val is None:
+            if self.compressed:
+                try:
+                    with open(path, 'rb') as fp:
+                        val = fp.read()
+                except OSError:
+                    return load(path)
+            else:
+                val = load(path)
+                if val is None:
+                    return None
+            self.put(path, val)
+
+        if self.compressed:
+            return load(BytesIO(val))
+        return val
+
+    def put(self, path, val):
+        size = len(val) if self.compressed else val.nbytes
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            old = self.images.pop(path, None)
+            if old is not None:
+                self.nbytes -= len(old) if self.compressed else old.nbytes
+            self.images[path] = val
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                _, old = self.images.popitem(last=False)
+                self.nbytes -= len(old) if self.compressed else old.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.nbytes = 0
+
+
+class RecordSampler(object):
+    '''
+    Draws the positions 0..n-1 of n records, an epoch at a time, forever.
+
+    Shuffled epochs are a permutation, so every record is seen once per
+    epoch, otherwise the positions come in order. With weights, one per
+    record, each epoch is n draws with replacement in proportion to the
+    weights, for example np.abs(angles) + 0.1 to see turns more often than
+    straight road. seed makes the order repeatable.
+    '''
+    def __init__(self, n, shuffle=True, weights=None, seed=None):
+        self.n = n
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+            if weights.shape != (n,):
+                raise ValueError('need one weight per record, got %d for %d records' % (weights.size, n))
+            if np.any(weights < 0) or not weights.sum() > 0:
+                raise ValueError('weights must not be negative and not all zero')
+            weights = weights / weights.sum()
+        self.weights = weights
+
+    def epoch(self):
+        if self.weights is not None:
+            return self.random.choice(self.n, self.n, p=self.weights)
+        if self.shuffle:
+            return self.random.permutation(self.n)
+        return np.arange(self.n)
+
+    def __iter__(self):
+        if self.n == 0:
+            raise ValueError('no records to sample')
+        while True:
+            for pos in self.epoch().tolist():
+                yield pos
+
 
 class Tub(object):
     """
@@ -138,6 +829,14 @@ class Tub(object):
 
     Accepts str, int, float, image_array, image, and array data types.
 
+    Records are stored as one json file each, or with storage='columnar'
+    packed into binary segments by TubColumnStore. The format is kept in
+    the tub's meta.json, so readers don't need to be told.
+
+    image_array values are encoded with codec, see parts/codec.py. It
+    defaults to PIL JPEG. Tubs hold .jpg or .png images, a PNG tub records
+    its image_ext in meta.json.
+
     For example:
 
     #Create a tub to store speed values.
@@ -148,12 +847,13 @@ class Tub(object):
 
     """
 
-    def __init__(self, path, inputs=None, types=None, user_meta=[]):
+    def __init__(self, path, inputs=None, types=None, user_meta=[], storage='json', codec=None):
 
         self.path = os.path.expanduser(path)
         #print('path_in_tub:', self.path)
         self.meta_path = os.path.join(self.path, 'meta.json')
         self.exclude_path = os.path.join(self.path, "exclude.json")
+        self.catalog_path = os.path.join(self.path, 'catalog.bin')
         self.df = None
 
         exists = os.path.exists(self.path)
@@ -167,12 +867,27 @@ class Tub(object):
             except FileNotFoundError:
                 self.meta = {'inputs': [], 'types': []}
 
+            self.image_ext = self.meta.get('image_ext', '.jpg')
+            if codec is None:
+                codec = PNGCodec() if self.image_ext == '.png' else PILCodec()
+            elif codec.ext != self.image_ext:
+                raise ValueError('tub %s holds %s images, the %s codec writes %s' %
+                                 (self.path, self.image_ext, codec.name, codec.ext))
+            self.codec = codec
+
+            self.store = self.open_store()
+            self.catalog = TubCatalog(self.catalog_path)
+
             try:
                 with open(self.exclude_path,'r') as f:
                     excl = json.load(f) # stored as a list
                     self.exclude = set(excl)
             except FileNotFoundError:
-                self.exclude = set()
+                self.exclude = self.catalog.excluded()
+
+            if not self.catalog.exists():
+                #tubs recorded before the catalog existed get one built now.
+                self.rebuild_catalog()
 
             try:
                 self.current_ix = self.get_last_ix() + 1
@@ -187,10 +902,20 @@ class Tub(object):
 
         elif not exists and inputs:
             print('Tub does NOT exist. Creating new tub...')
+            self.codec = codec or PILCodec()
+            self.image_ext = self.codec.ext
+            if self.image_ext not in ('.jpg', '.png'):
+                raise ValueError('tubs hold .jpg or .png images, not %s' % self.image_ext)
             self.start_time = time.time()
             #create log and save meta
             os.makedirs(self.path)
             self.meta = {'inputs': inputs, 'types': types, 'start': self.start_time}
+            if storage == 'columnar':
+                self.meta['format'] = storage
+            elif storage != 'json':
+                raise ValueError('unknown tub storage: %s' % storage)
+            if self.image_ext != '.jpg':
+                self.meta['image_ext'] = self.image_ext
             for kv in user_meta:
                 kvs = kv.split(":")
                 if len(kvs) == 2:
@@ -198,6 +923,9 @@ class Tub(object):
                 # else exception? print message?
             with open(self.meta_path, 'w') as f:
                 json.dump(self.meta, f)
+            self.store = self.open_store()
+            self.catalog = TubCatalog(self.catalog_path)
+            self.catalog.write()
             self.current_ix = 0
             self.exclude = set()
             print('New tub created at: {}'.format(self.path))
@@ -208,14 +936,51 @@ class Tub(object):
             raise AttributeError(msg)
 
 
+    def open_store(self):
+        if self.meta.get('format') == 'columnar':
+            return TubColumnStore(self.path, self.inputs, self.types)
+        return None
+
     def get_last_ix(self):
-        index = self.get_index()           
-        return max(index)
+        return self.catalog.last_ix()
 
     def update_df(self):
-        df = pd.DataFrame([self.get_json_record(i) for i in self.get_index(shuffled=False)])
+        if self.store is not None:
+            df = pd.DataFrame(self.get_columns())
+        else:
+            df = pd.DataFrame([self.get_json_record(i) for i in self.get_index(shuffled=False)])
         self.df = df
 
+    def get_columns(self, keys=None, ixs=None):
+        '''
+        return a dict of key: numpy array over all records in index order,
+        or over the records ixs in that order.
+        For columnar tubs this reads the segments directly, image channels
+        become arrays of absolute image paths. milliseconds comes from the
+        catalog, so json record files are only opened for the other keys.
+        '''
+        if ixs is None:
+            entries = self.catalog.entries()
+        else:
+            entries = self.catalog.lookup(ixs)
+        if keys is None:
+            keys = self.inputs + ['milliseconds']
+        if self.store is None:
+            cols = {'milliseconds': entries['ms']}
+            file_keys = [k for k in keys if k != 'milliseconds']
+            if file_keys:
+                records = [self.get_json_record(ix) for ix in entries['ix']]
+                cols.update({k: np.array([r.get(k) for r in records]) for k in file_keys})
+            return {k: cols[k] for k in keys}
+
+        stored = [k for k in keys if k in self.store.stored_keys() or k == 'milliseconds']
+        cols = self.store.columns(stored, offsets=entries['offset'])
+        for key in keys:
+            if self.get_input_type(key) == 'image_array':
+                cols[key] = np.array([os.path.join(self.path, self.make_file_name(key, ext=self.image_ext, ix=ix))
+                                      for ix in entries['ix']])
+        return {k: cols[k] for k in keys if k in cols}
+
     def get_df(self):
         if self.df is None:
             self.update_df()
@@ -223,25 +988,70 @@ class Tub(object):
 
 
     def get_index(self, shuffled=True):
+        nums = self.catalog.index().tolist()
+
+        if shuffled:
+            random.shuffle(nums)
+
+        return nums
+
+    def scan_record_files(self):
+        '''
+        list the tub directory for record_N.json files and return their
+        indexes, sorted. This is what the catalog replaces, and is only
+        needed to rebuild it.
+        '''
         files = next(os.walk(self.path))[2]
-        record_files = [f for f in files if f[:6]=='record']
-        
+        record_files = [f for f in files if f[:7] == 'record_' and f.endswith('.json')]
+
         def get_file_ix(file_name):
             try:
                 name = file_name.split('.')[0]
                 num = int(name.split('_')[1])
             except:
-                num = 0
+                num = None
             return num
 
         nums = [get_file_ix(f) for f in record_files]
-        
-        if shuffled:
-            random.shuffle(nums)
+        return sorted([n for n in nums if n is not None])
+
+    def rebuild_catalog(self):
+        '''
+        recreate the catalog from the record files in the tub directory.
+        Used for tubs recorded before the catalog existed, or after record
+        files were added or removed behind the tub's back.
+
+        For columnar tubs the rows are the records. When a record index was
+        written more than once the last row wins, and rows whose images are
+        gone are taken to be erased.
+        '''
+        offsets = None
+        if self.store is not None:
+            rows = self.store.read()
+            ixs, first = np.unique(rows['_ix'][::-1], return_index=True)
+            offsets = len(rows) - 1 - first
+            image_keys = [k for k, t in zip(self.inputs, self.types) if t == 'image_array']
+            keep = [all(os.path.exists(os.path.join(self.path, self.make_file_name(k, ext=self.image_ext, ix=ix)))
+                        for k in image_keys) for ix in ixs]
+            ixs, offsets = ixs[keep], offsets[keep]
+            timestamps = rows['milliseconds'][offsets]
         else:
-            nums = sorted(nums)
-            
-        return nums 
+            ixs = self.scan_record_files()
+            timestamps = []
+            for ix in ixs:
+                try:
+                    with open(self.get_json_record_path(ix), 'r') as fp:
+                        timestamps.append(int(json.load(fp).get('milliseconds', 0)))
+                except (ValueError, TypeError, UnicodeDecodeError):
+                    timestamps.append(0)
+        try:
+            self.catalog.rebuild(ixs, timestamps, exclude=self.exclude, offsets=offsets)
+        except OSError as e:
+            #the catalog is already rebuilt in memory, so a read-only tub
+            #can still be used, it just can't keep its catalog.
+            print('unable to write tub catalog:', e)
+        self.df = None
+        return len(ixs)
 
 
     @property
@@ -271,9 +1081,7 @@ class Tub(object):
             raise
 
     def get_num_records(self):
-        import glob
-        files = glob.glob(os.path.join(self.path, 'record_*.json'))
-        return len(files)
+        return len(self.catalog)
 
 
 
@@ -300,6 +1108,13 @@ class Tub(object):
         print('Checking tub:%s.' % self.path)
         print('Found: %d records.' % self.get_num_records())
         problems = False
+        if self.store is None and self.scan_record_files() != self.get_index(shuffled=False):
+            problems = True
+            if fix == False:
+                print('catalog does not match the record files in:', self.path)
+            else:
+                print('catalog does not match the record files, rebuilding:', self.path)
+                self.rebuild_catalog()
         for ix in self.get_index(shuffled=False):
             try:
                 self.get_record(ix)
@@ -317,8 +1132,10 @@ class Tub(object):
         '''
         remove data associate with a record
         '''
-        record = self.get_json_record_path(ix)
-        os.unlink(record)
+        if self.store is None:
+            record = self.get_json_record_path(ix)
+            os.unlink(record)
+        self.catalog.remove(ix)
 
     def put_record(self, data):
         """
@@ -330,6 +1147,8 @@ class Tub(object):
         self.current_ix += 1
         
         for key, val in data.items():
+            if key == 'milliseconds':
+                continue
             typ = self.get_input_type(key)
 
             if (val is not None) and (typ == 'float'):
@@ -345,20 +1164,43 @@ class Tub(object):
                 json_data[key]=path
 
             elif typ == 'image_array':
-                img = Image.fromarray(np.uint8(val))
-                name = self.make_file_name(key, ext='.jpg')
-                img.save(os.path.join(self.path, name))
+                name = self.make_file_name(key, ext=self.image_ext)
+                self.codec.save(val, os.path.join(self.path, name))
                 json_data[key]=name
 
             else:
                 msg = 'Tub does not know what to do with this type {}'.format(typ)
                 raise TypeError(msg)
 
-        json_data['milliseconds'] = int((time.time() - self.start_time) * 1000)
+        #keep the time the record was captured at, when it's given.
+        if data.get('milliseconds') is not None:
+            json_data['milliseconds'] = int(data['milliseconds'])
+        else:
+            json_data['milliseconds'] = int((time.time() - self.start_time) * 1000)
 
-        self.write_json_record(json_data)
+        if self.store is not None:
+            offset = self.store.append(self.current_ix, json_data)
+        else:
+            self.write_json_record(json_data)
+            offset = None
+        self.catalog.append(self.current_ix, json_data['milliseconds'], offset)
         return self.current_ix
 
+    def update_record(self, ix, key, val):
+        '''
+        change the value of one channel of a record that was already written.
+        '''
+        if self.store is not None:
+            self.store.update(self.catalog.get(ix)['offset'], key, val)
+        else:
+            path = self.get_json_record_path(ix)
+            with open(path, 'r') as fp:
+                json_data = json.load(fp)
+            json_data[key] = val
+            with open(path, 'w') as fp:
+                json.dump(json_data, fp)
+        self.df = None
+
     def erase_last_n_records(self, num_erase):
         '''
         erase N records from the disc and move current back accordingly
@@ -378,15 +1220,24 @@ class Tub(object):
         json_path = self.get_json_record_path(i)
         if os.path.exists(json_path):
             os.unlink(json_path)
-        img_filename = '%d_cam-image_array_.jpg' % (i)
+        img_filename = '%d_cam-image_array_%s' % (i, self.image_ext)
         img_path = os.path.join(self.path, img_filename)
         if os.path.exists(img_path):
             os.unlink(img_path)
+        self.catalog.remove(i)
 
     def get_json_record_path(self, ix):
         return os.path.join(self.path, 'record_'+str(ix)+'.json')
 
     def get_json_record(self, ix):
+        if self.store is not None:
+            try:
+                row = self.store.row(self.catalog.get(ix)['offset'])
+            except KeyError:
+                raise FileNotFoundError('no record %d in tub %s' % (ix, self.path))
+            image_name = lambda i, key: self.make_file_name(key, ext=self.image_ext, ix=i)
+            return self.make_record_paths_absolute(self.store.to_record(row, image_name))
+
         path = self.get_json_record_path(ix)
         try:
             with open(path, 'r') as fp:
@@ -428,16 +1279,42 @@ class Tub(object):
 
 
     def gather_records(self):
-        ri = lambda fnm : int( os.path.basename(fnm).split('_')[1].split('.')[0] )
+        return [self.get_json_record_path(ix) for ix in self.catalog.index(exclude=self.exclude)]
 
-        record_paths = glob.glob(os.path.join(self.path, 'record_*.json'))
-        if len(self.exclude) > 0:
-            record_paths = [f for f in record_paths if ri(f) not in self.exclude]
-        record_paths.sort(key=ri)
-        return record_paths
+    def get_image_pack(self, cfg, key='cam/image_array'):
+        '''
+        the image pack of this tub matching the image size in cfg, or None
+        when the tub has not been packed at that size.
+        '''
+        from donkeycar.utils import get_image_shape
+        height, width, depth = get_image_shape(cfg)
+        pack = TubImagePack(self.path, width, height, depth, key=key)
+        if not pack.exists():
+            return None
+        return pack.open()
+
+    def pack_images(self, cfg, key='cam/image_array'):
+        '''
+        decode and scale every image of the tub to the size in cfg and store
+        them in a TubImagePack.
+        '''
+        from donkeycar.utils import load_scaled_image_arr, get_image_shape
 
-    def make_file_name(self, key, ext='.png'):
-        name = '_'.join([str(self.current_ix), key, ext])
+        def load_image(ix):
+            try:
+                path = self.get_json_record(ix)[key]
+            except Exception:
+                return None
+            return load_scaled_image_arr(path, cfg)
+
+        height, width, depth = get_image_shape(cfg)
+        pack = TubImagePack(self.path, width, height, depth, key=key)
+        return pack.build(self.get_index(shuffled=False), load_image)
+
+    def make_file_name(self, key, ext='.png', ix=None):
+        if ix is None:
+            ix = self.current_ix
+        name = '_'.join([str(ix), key, ext])
         name = name = name.replace('/', '-')
         return name
 
@@ -470,32 +1347,47 @@ class Tub(object):
         else:
             with open(self.exclude_path,'w') as f:
                 json.dump( list(self.exclude), f )
+        self.catalog.set_excluded(self.exclude)
 
-    def get_record_gen(self, record_transform=None, shuffle=True, df=None):
-
+    def get_record_gen(self, record_transform=None, shuffle=True, df=None, keys=None, weights=None, seed=None,
+                       positions=None):
+        '''
+        endless records of df, the whole tub by default, drawn an epoch at a
+        time by a RecordSampler. positions keeps only those rows of df.
+        weights, one per row drawn from, draws records in proportion to
+        them, seed makes the order repeatable.
+        '''
         if df is None:
             df = self.get_df()
+        rows = np.arange(len(df)) if positions is None else np.asarray(positions, dtype=np.int64)
 
+        #pull the columns out once, a record is then a list lookup per column.
+        columns = list(df.columns)
+        values = [df[c].tolist() for c in columns]
 
-        while True:
-            for row in self.df.iterrows():
-                if shuffle:
-                    record_dict = df.sample(n=1).to_dict(orient='record')[0]
+        for pos in RecordSampler(len(rows), shuffle=shuffle, weights=weights, seed=seed):
+            row = rows[pos]
+            record_dict = {c: v[row] for c, v in zip(columns, values)}
 
-                if record_transform:
-                    record_dict = record_transform(record_dict)
+            if record_transform:
+                record_dict = record_transform(record_dict)
 
-                record_dict = self.read_record(record_dict)
+            if keys is not None:
+                record_dict = {k: record_dict[k] for k in keys}
 
-                yield record_dict
+            record_dict = self.read_record(record_dict)
 
+            yield record_dict
 
-    def get_batch_gen(self, keys, record_transform=None, batch_size=128, shuffle=True, df=None):
 
-        record_gen = self.get_record_gen(record_transform, shuffle=shuffle, df=df)
+    def get_batch_gen(self, keys, record_transform=None, batch_size=128, shuffle=True, df=None,
+                      weights=None, seed=None, positions=None):
 
         if keys == None:
-            keys = list(self.df.columns)
+            keys = list(self.get_df().columns)
+
+        record_gen = self.get_record_gen(record_transform, shuffle=shuffle, df=df, keys=keys,
+                                         weights=weights, seed=seed, positions=positions)
 
         while True:
             record_list = []
@@ -512,10 +1404,12 @@ class Tub(object):
             yield batch_arrays
 
 
-    def get_train_gen(self, X_keys, Y_keys, batch_size=128, record_transform=None, df=None):
+    def get_train_gen(self, X_keys, Y_keys, batch_size=128, record_transform=None, df=None,
+                      weights=None, seed=None, positions=None):
 
         batch_gen = self.get_batch_gen(X_keys + Y_keys,
-                                       batch_size=batch_size, record_transform=record_transform, df=df)
+                                       batch_size=batch_size, record_transform=record_transform, df=df,
+                                       weights=weights, seed=seed, positions=positions)
 
         while True:
             batch = next(batch_gen)
@@ -524,15 +1418,17 @@ class Tub(object):
             yield X, Y
 
 
-    def get_train_val_gen(self, X_keys, Y_keys, batch_size=128, record_transform=None, train_frac=.8):
-        train_df = train=self.df.sample(frac=train_frac,random_state=200)
-        val_df = self.df.drop(train_df.index)
+    def get_train_val_gen(self, X_keys, Y_keys, batch_size=128, record_transform=None, train_frac=.8, seed=None):
+        df = self.get_df()
+        train_df = df.sample(frac=train_frac, random_state=200)
+        val_df = df.drop(train_df.index)
 
         train_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
-                                       record_transform=record_transform, df=train_df)
+                                       record_transform=record_transform, df=train_df, seed=seed)
 
         val_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
-                                       record_transform=record_transform, df=val_df)
+                                       record_transform=record_transform, df=val_df,
+                                       seed=None if seed is None else seed + 1)
 
         return train_gen, val_gen
 
@@ -541,8 +1437,41 @@ class Tub(object):
 
 
 class TubWriter(Tub):
-    def __init__(self, *args, **kwargs):
+    '''
+    The part recording the drive loop into a tub.
+
+    With background=True, run only copies the record into a queue of at
+    most queue_size records, and a worker thread encodes and writes them,
+    so a slow SD card doesn't hold up the drive loop. Every sync_every
+    records the worker fsyncs the files it wrote and the tub directory,
+    0 never syncs. When the queue is full the record is dropped and
+    counted, or with block=True run waits for room and counts the wait.
+    shutdown writes everything still queued.
+
+    In both modes a record's milliseconds are taken in run, when it is
+    captured, and run returns the index the last accepted record is
+    written at.
+    '''
+    FLUSH = 'flush'
+
+    def __init__(self, *args, background=False, queue_size=100, sync_every=100, block=False, **kwargs):
         super(TubWriter, self).__init__(*args, **kwargs)
+        self.background = background
+        self.sync_every = sync_every
+        self.block = block
+        self.accepted = self.current_ix
+        self.dropped = 0
+        self.waits = 0
+        self.high_water = 0
+        self.errors = 0
+        self.write_lock = threading.Lock()
+        self.queue = None
+        self.worker = None
+
+        if background:
+            self.queue = queue.Queue(maxsize=queue_size)
+            self.worker = threading.Thread(target=self.write_records, daemon=True)
+            self.worker.start()
 
     def run(self, *args):
         '''
@@ -555,8 +1484,124 @@ class TubWriter(Tub):
 
         self.record_time = int(time.time() - self.start_time)
         record = dict(zip(self.inputs, args))
-        self.put_record(record)
-        return self.current_ix
+        record['milliseconds'] = int((time.time() - self.start_time) * 1000)
+
+        if not self.background:
+            self.put_record(record)
+            self.accepted = self.current_ix
+            return self.accepted
+
+        #the parts may reuse their arrays and images, so queue copies.
+        for key, val in record.items():
+            if isinstance(val, np.ndarray):
+                record[key] = val.copy()
+            elif isinstance(val, Image.Image):
+                record[key] = val.copy()
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not self.block:
+                self.dropped += 1
+                return self.accepted
+            self.waits += 1
+            self.queue.put(record)
+
+        self.accepted += 1
+        self.high_water = max(self.high_water, self.queue.qsize())
+        return self.accepted
+
+    def write_records(self):
+        '''
+        the background worker, writing queued records until it gets None
+        '''
+        unsynced = []
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None or record is self.FLUSH:
+                    self.sync(unsynced)
+                    unsynced = []
+                    if record is None:
+                        return
+                    continue
+
+                with self.write_lock:
+                    unsynced.append(self.put_record(record))
+
+                if self.sync_every and len(unsynced) >= self.sync_every:
+                    self.sync(unsynced)
+                    unsynced = []
+            except Exception as e:
+                self.errors += 1
+                print('failed to write tub record:', e)
+            finally:
+                self.queue.task_done()
+
+    def sync(self, ixs):
+        '''
+        fsync the files of the records ixs, the catalog and the tub directory
+        '''
+        if not ixs or not self.sync_every:
+            return
+
+        paths = set([self.catalog_path])
+        image_keys = [k for k, t in zip(self.inputs, self.types) if t == 'image_array']
+        for ix in ixs:
+            if self.store is not None:
+                if ix in self.catalog:
+                    segment = self.catalog.get(ix)['offset'] // self.store.chunk_size
+                    paths.add(self.store.segment_path(segment))
+            else:
+                paths.add(self.get_json_record_path(ix))
+            for key in image_keys:
+                paths.add(os.path.join(self.path, self.make_file_name(key, ext=self.image_ext, ix=ix)))
+
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        #the directory entries of new files need a sync of their own.
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def flush(self):
+        '''
+        wait until every queued record is written and synced
+        '''
+        if self.background and self.worker.is_alive():
+            self.queue.put(self.FLUSH)
+            self.queue.join()
+
+    def update_record(self, ix, key, val):
+        self.flush()
+        with self.write_lock:
+            super(TubWriter, self).update_record(ix, key, val)
+
+    def erase_last_n_records(self, num_erase):
+        self.flush()
+        with self.write_lock:
+            super(TubWriter, self).erase_last_n_records(num_erase)
+            self.accepted = self.current_ix
+
+    def shutdown(self):
+        if self.background and self.worker.is_alive():
+            self.queue.put(None)
+            self.worker.join()
+            if self.dropped or self.waits or self.errors:
+                print('tub writer: %d records dropped, %d waits for the queue, %d errors' %
+                      (self.dropped, self.waits, self.errors))
+        super(TubWriter, self).shutdown()
 
 
 class TubReader(Tub):
@@ -604,13 +1649,248 @@ class TubHandler():
         tub_path = os.path.join(self.path, name)
         return tub_path
 
-    def new_tub_writer(self, inputs, types, user_meta=[]):
+    def new_tub_writer(self, inputs, types, user_meta=[], storage='json', **kwargs):
         tub_path = self.create_tub_path()
-        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta)
+        tw = TubWriter(path=tub_path, inputs=inputs, types=types, user_meta=user_meta, storage=storage, **kwargs)
         return tw
 
 
 
+class Inotify(object):
+    '''
+    The linux inotify api through ctypes, read without blocking. Raises
+    OSError where inotify isn't available.
+    '''
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_MOVE_SELF = 0x800
+    IN_Q_OVERFLOW = 0x4000
+    IN_CLOEXEC = 0o2000000
+
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+        self.ctypes = ctypes
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            init = libc.inotify_init1
+        except (OSError, AttributeError):
+            raise OSError('inotify is not available')
+        fd = init(os.O_NONBLOCK | self.IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.libc = libc
+        self.fd = fd
+        self.watches = {}
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(self.ctypes.get_errno(), 'unable to watch %s' % path)
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, path):
+        for wd, watched in list(self.watches.items()):
+            if watched == path:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def read(self):
+        '''
+        the (watched path, mask, file name) of the events waiting
+        '''
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((self.watches.get(wd), mask, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class RecordWatcher(object):
+    '''
+    Keeps track of the records of the tubs given by tub_names as they are
+    written and deleted, for continuous training. Each poll returns the
+    record paths added and removed since the one before, the first poll
+    returns every record, like gather_records.
+
+    On linux the tub directories are watched with inotify, and a record
+    file showing up or going away is all it takes. Elsewhere, or with
+    use_inotify=False, each poll compares a stat of each tub directory and
+    its catalog with the last poll, and only rescans the tubs that changed.
+    Rescanning lists a json tub's record files, which is what rsync brings
+    over, and reads a columnar tub's catalog.
+    '''
+    WATCH_MASK = Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_DELETE | Inotify.IN_MOVED_FROM | \
+        Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF
+
+    #a tub scanned within this many seconds of its last change is scanned
+    #again, more files may have come with the same coarse timestamp.
+    SETTLE_SECONDS = 2.0
+
+    def __init__(self, cfg, tub_names=None, use_inotify=True):
+        self.cfg = cfg
+        self.tub_names = tub_names
+        self.tubs = {}
+        self.dirty = set()
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = Inotify()
+            except OSError:
+                pass
+
+    def tub_paths(self):
+        from donkeycar.utils import gather_tub_paths
+        return [os.path.abspath(p) for p in gather_tub_paths(self.cfg, self.tub_names) if os.path.isdir(p)]
+
+    @staticmethod
+    def record_path(tub_path, ix):
+        return os.path.join(tub_path, 'record_' + str(ix) + '.json')
+
+    def signature(self, tub_path):
+        '''
+        what changes when records are added to or removed from the tub
+        '''
+        sig = []
+        for path in (tub_path, os.path.join(tub_path, 'catalog.bin'), os.path.join(tub_path, 'exclude.json')):
+            try:
+                st = os.stat(path)
+                sig += [st.st_mtime, st.st_size]
+            except OSError:
+                sig += [None, None]
+        return sig
+
+    def scan(self, tub_path):
+        '''
+        the record indexes of the tub, less the excluded ones, read without
+        writing to the tub.
+        '''
+        try:
+            with open(os.path.join(tub_path, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        columnar = meta.get('format') == 'columnar'
+
+        try:
+            with open(os.path.join(tub_path, 'exclude.json'), 'r') as f:
+                exclude = set(json.load(f))
+        except (OSError, ValueError):
+            exclude = set()
+
+        if columnar:
+            ixs = set(TubCatalog(os.path.join(tub_path, 'catalog.bin')).index().tolist())
+        else:
+            files = next(os.walk(tub_path))[2]
+            ixs = set()
+            for f in files:
+                if f.startswith('record_') and f.endswith('.json'):
+                    try:
+                        ixs.add(int(f[7:-5]))
+                    except ValueError:
+                        pass
+        return columnar, ixs - exclude, exclude
+
+    def rescan(self, tub_path, added, removed):
+        tub = self.tubs[tub_path]
+        tub['sig'] = self.signature(tub_path)
+        mtimes = [t for t in tub['sig'][::2] if t is not None]
+        tub['settled'] = not mtimes or time.time() - max(mtimes) >= self.SETTLE_SECONDS
+        columnar, ixs, tub['exclude'] = self.scan(tub_path)
+        tub['columnar'] = columnar
+        added += [self.record_path(tub_path, ix) for ix in sorted(ixs - tub['ixs'])]
+        removed += [self.record_path(tub_path, ix) for ix in sorted(tub['ixs'] - ixs)]
+        tub['ixs'] = ixs
+
+    def handle_events(self, added, removed):
+        for tub_path, mask, name in self.inotify.read():
+            if mask & Inotify.IN_Q_OVERFLOW:
+                #events were lost, fall back to rescanning every tub.
+                self.dirty.update(self.tubs.keys())
+                continue
+            tub = self.tubs.get(tub_path)
+            if tub is None:
+                continue
+            if mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+                self.dirty.add(tub_path)
+            elif name in ('catalog.bin', 'exclude.json', 'meta.json'):
+                #json tubs are tracked by their record files.
+                if tub['columnar'] or name != 'catalog.bin':
+                    self.dirty.add(tub_path)
+            elif not tub['columnar'] and name.startswith('record_') and name.endswith('.json'):
+                try:
+                    ix = int(name[7:-5])
+                except ValueError:
+                    continue
+                if mask & (Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO):
+                    if ix not in tub['ixs'] and ix not in tub['exclude']:
+                        tub['ixs'].add(ix)
+                        added.append(self.record_path(tub_path, ix))
+                elif ix in tub['ixs']:
+                    tub['ixs'].discard(ix)
+                    removed.append(self.record_path(tub_path, ix))
+
+    def poll(self):
+        '''
+        returns the lists of record paths added and removed since the last poll
+        '''
+        added, removed = [], []
+
+        paths = self.tub_paths()
+        for tub_path in paths:
+            if tub_path not in self.tubs:
+                self.tubs[tub_path] = {'ixs': set(), 'exclude': set(), 'columnar': False, 'sig': None, 'settled': False}
+                if self.inotify is not None:
+                    #watch before scanning, so no record falls in between.
+                    try:
+                        self.inotify.add_watch(tub_path, self.WATCH_MASK)
+                    except OSError:
+                        pass
+                self.dirty.add(tub_path)
+
+        for tub_path in set(self.tubs.keys()) - set(paths):
+            removed += [self.record_path(tub_path, ix) for ix in sorted(self.tubs.pop(tub_path)['ixs'])]
+            self.dirty.discard(tub_path)
+            if self.inotify is not None:
+                self.inotify.rm_watch(tub_path)
+
+        if self.inotify is not None:
+            self.handle_events(added, removed)
+        else:
+            for tub_path, tub in self.tubs.items():
+                if not tub['settled'] or self.signature(tub_path) != tub['sig']:
+                    self.dirty.add(tub_path)
+
+        for tub_path in self.dirty:
+            self.rescan(tub_path, added, removed)
+        self.dirty = set()
+
+        return added, removed
+
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
 class TubImageStacker(Tub):
     '''
     A Tub for training a NN with images that are the last three records stacked 
@@ -620,6 +1900,26 @@ class TubImageStacker(Tub):
     Just make sure your inference pass uses the ImageFIFO that the NN will now expect.
     '''
     
+    def __init__(self, *args, image_cache=None, **kwargs):
+        '''
+        each image is read for three consecutive records, so an ImageCache
+        given here saves decoding it again for the other two.
+        '''
+        self.image_cache = image_cache
+        super(TubImageStacker, self).__init__(*args, **kwargs)
+
+    def read_record(self, record_dict):
+        if self.image_cache is None:
+            return super(TubImageStacker, self).read_record(record_dict)
+
+        data={}
+        for key, val in record_dict.items():
+            if self.get_input_type(key) == 'image_array':
+                val = self.image_cache.get(val, lambda f: np.array(Image.open(f)))
+            data[key] = val
+
+        return data
+
     def rgb2gray(self, rgb):
         '''
         take a numpy rgb image return a new single channel image converted to greyscale
@@ -726,29 +2026,172 @@ class TubTimeStacker(TubImageStacker):
         return data
 
 
-class TubGroup(Tub):
+class TubGroup(object):
+    '''
+    Several tubs read as one. Opening the group only loads each tub's meta
+    and catalog, records are read when they are used. A record of the group
+    is addressed by its position, get_index returns the positions and
+    get_json_record and get_record take one.
+
+    get_columns reads only the keys asked for, sample picks positions at
+    random and iter_records streams records. df, a DataFrame of every
+    record of the keys all tubs have, is only built when something asks
+    for it.
+
+    It isn't a Tub, having no path of its own, but reads records and
+    makes batches the way a Tub does.
+    '''
+    inputs = Tub.inputs
+    types = Tub.types
+    get_input_type = Tub.get_input_type
+    read_record = Tub.read_record
+    get_record = Tub.get_record
+    get_df = Tub.get_df
+    get_train_gen = Tub.get_train_gen
+
     def __init__(self, tub_paths):
         tub_paths = self.resolve_tub_paths(tub_paths)
         print('TubGroup:tubpaths:', tub_paths)
-        tubs = [Tub(path) for path in tub_paths]
+        self.tubs = [Tub(path) for path in tub_paths]
         self.input_types = {}
-
-        record_count = 0
-        for t in tubs:
-            t.update_df()
-            record_count += len(t.df)
+        for t in self.tubs:
             self.input_types.update(dict(zip(t.inputs, t.types)))
 
-        print('joining the tubs {} records together. This could take {} minutes.'.format(record_count,
-                                                                                         int(record_count / 300000)))
-
         self.meta = {'inputs': list(self.input_types.keys()),
                      'types': list(self.input_types.values())}
 
+        #the keys every tub has, the columns of df.
+        self.common_keys = [k for k in self.meta['inputs'] if all(k in t.inputs for t in self.tubs)]
 
-        self.df = pd.concat([t.df for t in tubs], axis=0, join='inner')
+        #the tub and record index of each position, from the catalogs.
+        indexes = [t.catalog.index() for t in self.tubs]
+        self.tub_ids = np.repeat(np.arange(len(self.tubs)), [len(ixs) for ixs in indexes])
+        self.ixs = np.concatenate(indexes) if indexes else np.zeros(0, dtype=np.int64)
+        self.exclude = set()
+        self._df = None
 
+        print('TubGroup: {} records in {} tubs'.format(len(self.ixs), len(self.tubs)))
 
+    @property
+    def df(self):
+        if self._df is None:
+            self.update_df()
+        return self._df
+
+    def update_df(self):
+        self._df = pd.DataFrame(self.get_columns())
+
+    def __len__(self):
+        return len(self.ixs)
+
+    def get_num_records(self):
+        return len(self.ixs)
+
+    def get_index(self, shuffled=True):
+        nums = list(range(len(self.ixs)))
+
+        if shuffled:
+            random.shuffle(nums)
+
+        return nums
+
+    def get_tub_record(self, position):
+        '''
+        the tub holding the record at position, and its index in that tub
+        '''
+        return self.tubs[self.tub_ids[position]], int(self.ixs[position])
+
+    def get_json_record(self, position):
+        tub, ix = self.get_tub_record(position)
+        return tub.get_json_record(ix)
+
+    def get_columns(self, keys=None, positions=None):
+        '''
+        return a dict of key: numpy array over the records at positions, all
+        of them by default. Each tub only reads the keys asked for, a key a
+        tub doesn't have is None in its records.
+        '''
+        if keys is None:
+            keys = self.common_keys + ['milliseconds']
+        if positions is None:
+            positions = np.arange(len(self.ixs))
+        positions = np.asarray(positions, dtype=np.int64)
+
+        tub_ids = self.tub_ids[positions]
+        selected, chunks = [], []
+        for i, tub in enumerate(self.tubs):
+            sel = np.nonzero(tub_ids == i)[0]
+            if len(sel) == 0:
+                continue
+            cols = tub.get_columns([k for k in keys if k in tub.inputs or k == 'milliseconds'],
+                                   ixs=self.ixs[positions[sel]])
+            selected.append(sel)
+            chunks.append(cols)
+
+        if not chunks:
+            return {k: np.zeros(0) for k in keys}
+        #back from tub order to the order of positions.
+        order = np.argsort(np.concatenate(selected), kind='mergesort')
+        return {k: np.concatenate([c.get(k, np.full(len(sel), None)) for c, sel in zip(chunks, selected)])[order]
+                for k in keys}
+
+    def sample(self, n, random_state=None, replace=False):
+        '''
+        positions of n records picked at random
+        '''
+        rs = np.random.RandomState(random_state)
+        return rs.choice(len(self.ixs), n, replace=replace)
+
+    def iter_records(self, positions=None, keys=None, record_transform=None):
+        '''
+        yield the records at positions, all of them by default, with their
+        images loaded. keys keeps only those keys of the transformed record,
+        so the images of the other keys aren't read.
+        '''
+        if positions is None:
+            positions = range(len(self.ixs))
+        for position in positions:
+            record_dict = self.get_json_record(position)
+            if record_transform:
+                record_dict = record_transform(record_dict)
+            if keys is not None:
+                record_dict = {k: record_dict[k] for k in keys}
+            yield self.read_record(record_dict)
+
+    def get_record_gen(self, record_transform=None, shuffle=True, df=None, keys=None, weights=None, seed=None,
+                       positions=None):
+        '''
+        endless records of the group at positions, all of them by default,
+        drawn by a RecordSampler like Tub.get_record_gen. Given a DataFrame
+        of records as df, its rows are drawn instead, as a Tub does.
+        '''
+        if df is not None:
+            return Tub.get_record_gen(self, record_transform, shuffle, df, keys, weights, seed, positions)
+        if positions is None:
+            positions = np.arange(len(self.ixs))
+        positions = np.asarray(positions, dtype=np.int64)
+        sampler = RecordSampler(len(positions), shuffle=shuffle, weights=weights, seed=seed)
+        return self.iter_records((positions[pos] for pos in sampler), keys, record_transform)
+
+    def get_batch_gen(self, keys, record_transform=None, batch_size=128, shuffle=True, df=None,
+                      weights=None, seed=None, positions=None):
+        if keys is None:
+            keys = self.common_keys + ['milliseconds'] if df is None else list(df.columns)
+        return Tub.get_batch_gen(self, keys, record_transform, batch_size, shuffle, df,
+                                 weights, seed, positions)
+
+    def get_train_val_gen(self, X_keys, Y_keys, batch_size=128, record_transform=None, train_frac=.8, seed=None):
+        train = self.sample(int(round(len(self.ixs) * train_frac)), random_state=200)
+        val = np.setdiff1d(np.arange(len(self.ixs)), train)
+
+        train_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
+                                       record_transform=record_transform, positions=train, seed=seed)
+
+        val_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
+                                     record_transform=record_transform, positions=val,
+                                     seed=None if seed is None else seed + 1)
+
+        return train_gen, val_gen
 
     def find_tub_paths(self, path):
         matches = []
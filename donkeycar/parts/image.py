@@ -3,16 +3,20 @@ import io
 from PIL import Image
 import numpy as np
 from donkeycar.utils import img_to_binary, binary_to_img, arr_to_img, img_to_arr
+from donkeycar.parts.codec import PILCodec
 
 class ImgArrToJpg():
+    '''
+    encode an image array with codec, see parts/codec.py. defaults to PIL JPEG.
+    '''
+    def __init__(self, codec=None):
+        self.codec = codec or PILCodec()
 
     def run(self, img_arr):
         if img_arr is None:
             return None
         try:
-            image = arr_to_img(img_arr)
-            jpg = img_to_binary(image)
-            return jpg
+            return self.codec.encode(img_arr)
         except:
             return None
 
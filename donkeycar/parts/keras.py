@@ -13,22 +13,125 @@ models to help direct the vehicles motion.
 
 
 import os
+import time
 import numpy as np
 import keras
+import keras.backend as K
 
 import donkeycar as dk
 
 
+class PredictBackend(object):
+    '''
+    Runs the model with model.predict, the same way training evaluates it.
+    Simple, but predict sets up batching for every call.
+    '''
+    def __init__(self, model, precision='float32'):
+        self.model = model
+
+    def run(self, inputs):
+        return self.model.predict(inputs)
+
+
+class FunctionBackend(object):
+    '''
+    Runs the model through a backend function built once, fed from
+    preallocated float32 input buffers. It skips the per call set up of
+    predict, which is most of the time spent on a 160x120 frame.
+    '''
+    def __init__(self, model, precision='float32'):
+        self.model = model
+        inputs = list(model.inputs)
+        self.learning_phase = []
+        if model.uses_learning_phase and not isinstance(K.learning_phase(), int):
+            inputs.append(K.learning_phase())
+            self.learning_phase = [0]
+        self.function = K.function(inputs, model.outputs)
+        self.inputs = [np.zeros((1,) + K.int_shape(t)[1:], dtype=np.float32) for t in model.inputs]
+
+    def run(self, inputs):
+        for buf, arr in zip(self.inputs, inputs):
+            np.copyto(buf, np.reshape(arr, buf.shape), casting='unsafe')
+        outputs = self.function(self.inputs + self.learning_phase)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+class TFLiteBackend(object):
+    '''
+    Converts the model to TensorFlow Lite once, and runs it with the TFLite
+    interpreter. The only backend that can run in float16 or int8.
+    '''
+    def __init__(self, model, precision='float32'):
+        from donkeycar.parts.tflite import keras_model_to_tflite, TFLiteRunner
+        self.model = model
+        self.runner = TFLiteRunner(model_content=keras_model_to_tflite(model, precision))
+
+    def run(self, inputs):
+        outputs = self.runner.run(inputs)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+BACKENDS = {'predict': PredictBackend, 'function': FunctionBackend, 'tflite': TFLiteBackend}
+
+
 class KerasPilot(object):
     def __init__(self):
         self.model = None
         self.optimizer = "adam"
+        self.backend_type = 'predict'
+        self.precision = 'float32'
+        self.backend = None
+        self.latency = None
  
     def load(self, model_path):
         self.model = keras.models.load_model(model_path)
+        self.backend = None
 
     def load_weights(self, model_path, by_name=True):
         self.model.load_weights(model_path, by_name=by_name)
+        self.backend = None
+
+    def set_backend(self, backend_type='predict', precision='float32'):
+        '''
+        choose how run calls the model, one of BACKENDS. only the tflite
+        backend runs in a precision other than float32.
+        '''
+        if backend_type not in BACKENDS:
+            raise ValueError('unknown inference backend: %s' % backend_type)
+        if precision != 'float32' and backend_type != 'tflite':
+            raise ValueError('the %s backend only runs in float32, use tflite for %s' % (backend_type, precision))
+        self.backend_type = backend_type
+        self.precision = precision
+        self.backend = None
+
+    def build_backend(self):
+        '''
+        set up the backend for the current model. run does it on first use,
+        call it after loading a model to keep that out of the drive loop.
+        '''
+        self.backend = BACKENDS[self.backend_type](self.model, self.precision)
+        return self.backend
+
+    def infer(self, inputs):
+        '''
+        run the model on a batch of one frame through the backend, and keep
+        the time it took.
+        '''
+        if self.backend is None or self.backend.model is not self.model:
+            self.build_backend()
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+        start = time.perf_counter()
+        outputs = self.backend.run(inputs)
+        self.latency = time.perf_counter() - start
+        return outputs
+
+    def profile_timings(self):
+        '''
+        the model latency of the last run, reported by the vehicle's PartProfiler.
+        '''
+        latency, self.latency = self.latency, None
+        return {} if latency is None else {'inference': latency}
 
     def shutdown(self):
         pass
@@ -104,7 +207,7 @@ class KerasCategorical(KerasPilot):
             return 0.0, 0.0
 
         img_arr = img_arr.reshape((1,) + img_arr.shape)
-        angle_binned, throttle = self.model.predict(img_arr)
+        angle_binned, throttle = self.infer(img_arr)
         #in order to support older models with linear throttle,
         #we will test for shape of throttle to see if it's the newer
         #binned version.
@@ -116,6 +219,25 @@ class KerasCategorical(KerasPilot):
             throttle = throttle[0][0]
         angle_unbinned = dk.utils.linear_unbin(angle_binned)
         return angle_unbinned, throttle
+
+    def run_batch(self, img_arrs):
+        '''
+        steering and throttle of a batch of frames, as two arrays. the model
+        runs with predict on the whole batch, whatever the backend.
+        '''
+        return self.controls(self.model.predict(img_arrs, batch_size=len(img_arrs)))
+
+    def controls(self, outputs):
+        '''
+        steering and throttle arrays from the outputs of the model on a batch
+        '''
+        angle_binned, throttle = outputs
+        N = throttle.shape[1]
+        if N > 0:
+            throttle = dk.utils.linear_unbin(throttle, N=N, offset=0.0, R=self.throttle_range, axis=1)
+        else:
+            throttle = throttle[:, 0]
+        return dk.utils.linear_unbin(angle_binned, axis=1), throttle
     
     
     
@@ -131,11 +253,19 @@ class KerasLinear(KerasPilot):
 
     def run(self, img_arr):
         img_arr = img_arr.reshape((1,) + img_arr.shape)
-        outputs = self.model.predict(img_arr)
+        outputs = self.infer(img_arr)
         steering = outputs[0]
         throttle = outputs[1]
         return steering[0][0], throttle[0][0]
 
+    def run_batch(self, img_arrs):
+        '''
+        steering and throttle of a batch of frames, as two arrays
+        '''
+        return self.controls(self.model.predict(img_arrs, batch_size=len(img_arrs)))
+
+    def controls(self, outputs):
+        return outputs[0][:, 0], outputs[1][:, 0]
 
 
 class KerasIMU(KerasPilot):
@@ -176,7 +306,7 @@ class KerasIMU(KerasPilot):
         #TODO: would be nice to take a vector input array.
         img_arr = img_arr.reshape((1,) + img_arr.shape)
         imu_arr = np.array([accel_x, accel_y, accel_z, gyr_x, gyr_y, gyr_z]).reshape(1,self.num_imu_inputs)
-        outputs = self.model.predict([img_arr, imu_arr])
+        outputs = self.infer([img_arr, imu_arr])
         steering = outputs[0]
         throttle = outputs[1]
         return steering[0][0], throttle[0][0]
@@ -199,7 +329,7 @@ class KerasBehavioral(KerasPilot):
     def run(self, img_arr, state_array):        
         img_arr = img_arr.reshape((1,) + img_arr.shape)
         bhv_arr = np.array(state_array).reshape(1,len(state_array))
-        angle_binned, throttle = self.model.predict([img_arr, bhv_arr])
+        angle_binned, throttle = self.infer([img_arr, bhv_arr])
         #in order to support older models with linear throttle,
         #we will test for shape of throttle to see if it's the newer
         #binned version.
@@ -229,7 +359,7 @@ class KerasLocalizer(KerasPilot):
         
     def run(self, img_arr):        
         img_arr = img_arr.reshape((1,) + img_arr.shape)
-        angle_binned, throttle, track_loc = self.model.predict([img_arr])
+        angle_binned, throttle, track_loc = self.infer([img_arr])
         #in order to support older models with linear throttle,
         #we will test for shape of throttle to see if it's the newer
         #binned version.
@@ -500,7 +630,7 @@ class KerasRNN_LSTM(KerasPilot):
         self.image_d = image_d
         self.image_w = image_w
         self.image_h = image_h
-        self.img_seq = []
+        self.img_seq = dk.utils.FrameHistory(seq_length)
         self.compile()
         self.optimizer = "rmsprop"
 
@@ -512,14 +642,9 @@ class KerasRNN_LSTM(KerasPilot):
         if img_arr.shape[2] == 3 and self.image_d == 1:
             img_arr = dk.utils.rgb2gray(img_arr)
 
-        while len(self.img_seq) < self.seq_length:
-            self.img_seq.append(img_arr)
-
-        self.img_seq = self.img_seq[1:]
-        self.img_seq.append(img_arr)
-        
-        img_arr = np.array(self.img_seq).reshape(1, self.seq_length, self.image_h, self.image_w, self.image_d )
-        outputs = self.model.predict([img_arr])
+        img_seq = self.img_seq.push(img_arr)
+        img_arr = img_seq.reshape(1, self.seq_length, self.image_h, self.image_w, self.image_d)
+        outputs = self.infer([img_arr])
         steering = outputs[0][0]
         throttle = outputs[0][1]
         return steering, throttle
@@ -576,7 +701,7 @@ class Keras3D_CNN(KerasPilot):
         self.image_d = image_d
         self.image_w = image_w
         self.image_h = image_h
-        self.img_seq = []
+        self.img_seq = dk.utils.FrameHistory(seq_length)
         self.compile()
 
     def compile(self):
@@ -587,14 +712,9 @@ class Keras3D_CNN(KerasPilot):
         if img_arr.shape[2] == 3 and self.image_d == 1:
             img_arr = dk.utils.rgb2gray(img_arr)
 
-        while len(self.img_seq) < self.seq_length:
-            self.img_seq.append(img_arr)
-
-        self.img_seq = self.img_seq[1:]
-        self.img_seq.append(img_arr)
-        
-        img_arr = np.array(self.img_seq).reshape(1, self.seq_length, self.image_h, self.image_w, self.image_d )
-        outputs = self.model.predict([img_arr])
+        img_seq = self.img_seq.push(img_arr)
+        img_arr = img_seq.reshape(1, self.seq_length, self.image_h, self.image_w, self.image_d)
+        outputs = self.infer([img_arr])
         steering = outputs[0][0]
         throttle = outputs[0][1]
         return steering, throttle
@@ -688,7 +808,7 @@ class KerasLatent(KerasPilot):
 
     def run(self, img_arr):
         img_arr = img_arr.reshape((1,) + img_arr.shape)
-        outputs = self.model.predict(img_arr)
+        outputs = self.infer(img_arr)
         steering = outputs[1]
         throttle = outputs[2]
         return steering[0][0], throttle[0][0]
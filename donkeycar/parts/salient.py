@@ -1,106 +1,108 @@
-#from https://github.com/ermolenkodev/keras-salient-object-visualisation
+'''
+    File: salient.py
+    Visual backprop saliency masks, after
+    https://github.com/ermolenkodev/keras-salient-object-visualisation
+
+    The mean activation of the last conv layer is scaled back up to the
+    image through each conv layer with a transposed convolution of ones,
+    multiplied on the way by the mean activation of the layer below.
+'''
 import os
-from keras import backend as K
-import tensorflow as tf
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-from keras.layers import Input, Dense, merge
-from keras.models import Model
-from keras.layers import Convolution2D, MaxPooling2D, Reshape, BatchNormalization
-from keras.layers import Activation, Dropout, Flatten, Dense
-import cv2
 import numpy as np
+from keras import backend as K
+from keras.layers import Conv2D, Conv2DTranspose, Cropping2D
+import tensorflow as tf
 
-class SalientVis():
-    '''
-    Note, this part is quite tuned ust for the image dimensions and layers
-    in our standard models. It will not reflect cropping or additional layers
-    that might be in your model.
+
+class SaliencyEngine(object):
     '''
+    Builds the saliency pipeline of a keras model once, in the model's own
+    graph, so every batch is a single session run and the graph doesn't
+    grow from frame to frame.
 
-    def __init__(self, kerasPart):
-        self.model = kerasPart.model
-        self.init_salient(self.model)
+    It follows the Conv2D layers of the model, with their kernel sizes and
+    strides, from the model's first input. They must be chained, each one
+    taking the output shape of the one before. A Cropping2D in front of
+    them is undone by padding the mask with zeros.
+    '''
+    def __init__(self, model, alpha=0.004):
+        self.alpha = alpha
+        self.img_in = model.inputs[0]
+        self.img_shape = tuple(K.int_shape(self.img_in)[1:])
+        convs = [layer for layer in model.layers
+                 if isinstance(layer, Conv2D) and not isinstance(layer, Conv2DTranspose)]
+        if not convs:
+            raise ValueError('the model has no Conv2D layers to take a saliency mask from')
+        for prev, conv in zip(convs, convs[1:]):
+            if K.int_shape(conv.input)[1:3] != K.int_shape(prev.output)[1:3]:
+                raise ValueError('%s does not take the output of %s' % (conv.name, prev.name))
 
-    def run(self, image):
-        if image is None:
-            return
-        image = self.draw_salient(image)
-        image = image * 255
-        image = image.astype('uint8')
-        return image
+        self.crop = ((0, 0), (0, 0))
+        for layer in model.layers:
+            if isinstance(layer, Cropping2D):
+                self.crop = layer.cropping
 
-    def init_salient(self, model):
-        img_in = Input(shape=(120, 160, 3), name='img_in')
-        x = img_in
-        x = Convolution2D(24, (5,5), strides=(2,2), activation='relu', name='conv1')(x)
-        x = Convolution2D(32, (5,5), strides=(2,2), activation='relu', name='conv2')(x)
-        x = Convolution2D(64, (5,5), strides=(2,2), activation='relu', name='conv3')(x)
-        x = Convolution2D(64, (3,3), strides=(2,2), activation='relu', name='conv4')(x)
-        conv_5 = Convolution2D(64, (3,3), strides=(1,1), activation='relu', name='conv5')(x)
-        self.convolution_part = Model(inputs=[img_in], outputs=[conv_5])
+        batch = tf.shape(self.img_in)[0]
+        upscaled = None
+        for conv in reversed(convs):
+            activation = K.mean(conv.output, axis=3, keepdims=True)
+            if upscaled is not None:
+                activation = activation * upscaled
+            h, w = K.int_shape(conv.input)[1:3]
+            kh, kw = conv.kernel_size
+            sh, sw = conv.strides
+            upscaled = tf.nn.conv2d_transpose(
+                activation, tf.ones((kh, kw, 1, 1)),
+                output_shape=tf.stack([batch, h, w, 1]),
+                strides=[1, sh, sw, 1],
+                padding='VALID')
 
-        for layer_num in ('1', '2', '3', '4', '5'):
-            self.convolution_part.get_layer('conv' + layer_num).set_weights(model.get_layer('conv2d_' + layer_num).get_weights())
-        
-        self.inp = self.convolution_part.input                                           # input placeholder
-        self.outputs = [layer.output for layer in self.convolution_part.layers[1:]]          # all layer outputs
-        self.functor = K.function([self.inp], self.outputs)
+        low = K.min(upscaled, axis=(1, 2, 3), keepdims=True)
+        high = K.max(upscaled, axis=(1, 2, 3), keepdims=True)
+        mask = (upscaled - low) / K.maximum(high - low, K.epsilon())
+        self.mask_fn = K.function([self.img_in], [mask[:, :, :, 0]])
 
-        kernel_3x3 = tf.constant(np.array([
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]], 
-        [[[1]], [[1]], [[1]]]
-        ]), tf.float32)
+    def masks(self, imgs):
+        '''
+        saliency masks of a batch of images, (N, H, W) float32 from 0 to 1
+        '''
+        imgs = np.asarray(imgs)
+        masks = self.mask_fn([imgs])[0]
+        (top, bottom), (left, right) = self.crop
+        if top or bottom or left or right:
+            masks = np.pad(masks, ((0, 0), (top, bottom), (left, right)), mode='constant')
+        return masks
 
-        kernel_5x5 = tf.constant(np.array([
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]], 
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]],
-                [[[1]], [[1]], [[1]], [[1]], [[1]]]
-        ]), tf.float32)
+    def overlay(self, imgs, masks=None):
+        '''
+        the masks blended over a batch of images, as uint8 images.
+        the image shows through faintly, weighted by alpha.
+        '''
+        imgs = np.asarray(imgs)
+        if masks is None:
+            masks = self.masks(imgs)
+        blend = imgs.astype(np.float32) * self.alpha + masks[..., np.newaxis] * (1.0 - self.alpha)
+        return np.clip(blend * 255, 0, 255).astype(np.uint8)
 
-        self.layers_kernels = {5: kernel_3x3, 4: kernel_3x3, 3: kernel_5x5, 2: kernel_5x5, 1: kernel_5x5}
 
-        self.layers_strides = {5: [1, 1, 1, 1], 4: [1, 2, 2, 1], 3: [1, 2, 2, 1], 2: [1, 2, 2, 1], 1: [1, 2, 2, 1]}
+class SalientVis():
+    '''
+    Vehicle part that replaces the image with its saliency overlay, see
+    SaliencyEngine for the models it can follow.
+    '''
 
-        
-    def compute_visualisation_mask(self, img):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        
-        activations = self.functor([np.array([img])])
-        activations = [np.reshape(img, (1, img.shape[0], img.shape[1], img.shape[2]))] + activations
-        upscaled_activation = np.ones((3, 6))
-        for layer in [5, 4, 3, 2, 1]:
-            averaged_activation = np.mean(activations[layer], axis=3).squeeze(axis=0) * upscaled_activation
-            output_shape = (activations[layer - 1].shape[1], activations[layer - 1].shape[2])
-            x = tf.constant(
-                np.reshape(averaged_activation, (1,averaged_activation.shape[0],averaged_activation.shape[1],1)),
-                tf.float32
-            )
-            conv = tf.nn.conv2d_transpose(
-                x, self.layers_kernels[layer],
-                output_shape=(1,output_shape[0],output_shape[1], 1), 
-                strides=self.layers_strides[layer], 
-                padding='VALID'
-            )
-            with tf.Session() as session:
-                result = session.run(conv)
-            upscaled_activation = np.reshape(result, output_shape)
-        final_visualisation_mask = upscaled_activation
-        return (final_visualisation_mask - np.min(final_visualisation_mask))/(np.max(final_visualisation_mask) - np.min(final_visualisation_mask))
+    def __init__(self, kerasPart):
+        self.model = kerasPart.model
+        self.engine = SaliencyEngine(self.model)
 
-    def draw_salient(self, img):
-        #from https://github.com/ermolenkodev/keras-salient-object-visualisation
-        alpha = 0.004
-        beta = 1.0 - alpha
+    def run(self, image):
+        if image is None:
+            return
+        return self.engine.overlay(image[np.newaxis])[0]
 
-        salient_mask = self.compute_visualisation_mask(img)
-        salient_mask_stacked = np.dstack((salient_mask,salient_mask))
-        salient_mask_stacked = np.dstack((salient_mask_stacked,salient_mask))
-        blend = cv2.addWeighted(img.astype('float32'), alpha, salient_mask_stacked, beta, 0.0)
-        return blend
+    def compute_visualisation_mask(self, img):
+        return self.engine.masks(img[np.newaxis])[0]
 
     def shutdown(self):
         pass
-        
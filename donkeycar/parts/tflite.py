@@ -0,0 +1,184 @@
+'''
+    File: tflite.py
+    Convert Keras models to TensorFlow Lite, and run them with the TFLite
+    interpreter.
+'''
+import re
+import time
+import numpy as np
+import tensorflow as tf
+import keras
+import keras.backend as K
+
+from donkeycar.parts.keras import KerasCategorical, KerasLinear, KerasIMU, KerasBehavioral
+
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+#the name keras_model_to_tflite gives the i-th output of the Keras model,
+#so the runner returns them in the model's order, whatever order the
+#interpreter lists them in.
+OUTPUT_NAME = 'output_%d'
+
+
+def keras_model_to_tflite(model, precision='float32', representative_data=None):
+    '''
+    convert a keras model to a TFLite flatbuffer, returned as bytes.
+    precision float16 stores the weights as float16, int8 quantizes the
+    weights to 8 bits (dynamic range quantization) and the activations stay
+    float. with representative_data, a list of model input lists of one
+    frame each, int8 quantizes the activations too, calibrated on that data.
+    the model's inputs and outputs stay float either way.
+
+    the model is rebuilt in a graph of its own with the learning phase set
+    to inference, so Dropout and BatchNormalization don't leave the training
+    branches TFLite can't convert, and the live model's session is untouched.
+
+    the outputs are named after their position in the model's outputs,
+    see OUTPUT_NAME.
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError('unknown precision: %s' % precision)
+
+    weights = model.get_weights()
+    config = model.to_json()
+    session = K.get_session()
+    graph = tf.Graph()
+    with graph.as_default():
+        convert_session = tf.Session(graph=graph)
+        K.set_session(convert_session)
+        try:
+            K.set_learning_phase(0)
+            clone = keras.models.model_from_json(config)
+            clone.set_weights(weights)
+            outputs = [tf.identity(out, name=OUTPUT_NAME % i) for i, out in enumerate(clone.outputs)]
+            converter = tf.lite.TFLiteConverter.from_session(convert_session, clone.inputs, outputs)
+            if precision != 'float32':
+                converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if precision == 'float16':
+                converter.target_spec.supported_types = [tf.float16]
+            if precision == 'int8' and representative_data is not None:
+                converter.representative_dataset = lambda: ([np.asarray(x, dtype=np.float32) for x in inputs]
+                                                            for inputs in representative_data)
+            content = converter.convert()
+        finally:
+            K.set_session(session)
+            convert_session.close()
+
+    interpreter = tf.lite.Interpreter(model_content=content)
+    names = sorted(d['name'] for d in interpreter.get_output_details())
+    if names != sorted(OUTPUT_NAME % i for i in range(len(outputs))):
+        raise ValueError('the converted model lost the names of its outputs: %s' % names)
+    return content
+
+
+class TFLiteRunner(object):
+    '''
+    runs a TFLite model one batch at a time, from preallocated input and
+    output buffers. give either the flatbuffer bytes or a .tflite file path.
+
+    the arrays returned by run are the runner's output buffers, overwritten
+    by the next run, so copy what needs to outlive it. they come in the
+    order of the Keras model's outputs, matched by the names
+    keras_model_to_tflite gives them.
+    '''
+    def __init__(self, model_content=None, model_path=None, num_threads=None):
+        if model_content is not None:
+            self.interpreter = tf.lite.Interpreter(model_content=model_content)
+        else:
+            self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        if num_threads is not None and hasattr(self.interpreter, 'set_num_threads'):
+            self.interpreter.set_num_threads(num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.order_outputs(self.interpreter.get_output_details())
+        self.inputs = [np.zeros(d['shape'], dtype=d['dtype']) for d in self.input_details]
+        self.outputs = [np.zeros(d['shape'], dtype=d['dtype']) for d in self.output_details]
+
+    @staticmethod
+    def order_outputs(output_details):
+        '''
+        the output details sorted by the position of the Keras output they
+        were named after. a model converted before the outputs were named
+        keeps the interpreter's order.
+        '''
+        positions = [re.match(OUTPUT_NAME.replace('%d', r'(\d+)') + '$', d['name']) for d in output_details]
+        if not all(positions):
+            print('the outputs of the model are not named by donkey convert, convert it again to be sure '
+                  'they come in the order of the Keras model')
+            return output_details
+        return [d for _, d in sorted(zip([int(m.group(1)) for m in positions], output_details),
+                                     key=lambda pair: pair[0])]
+
+    @property
+    def input_shapes(self):
+        return [tuple(d['shape']) for d in self.input_details]
+
+    def run(self, inputs):
+        for buf, detail, arr in zip(self.inputs, self.input_details, inputs):
+            np.copyto(buf, np.reshape(arr, buf.shape), casting='unsafe')
+            self.interpreter.set_tensor(detail['index'], buf)
+        self.interpreter.invoke()
+        for buf, detail in zip(self.outputs, self.output_details):
+            np.copyto(buf, self.interpreter.get_tensor(detail['index']))
+        return self.outputs
+
+
+class TFLitePilot(object):
+    '''
+    Drives with a .tflite model. The subclasses mirror the Keras pilots of
+    the same model type and share their run, only the model under infer
+    is a TFLite interpreter instead of Keras. Create them with
+    get_model_by_type('tflite_<type>', cfg) and load a file made by
+    `donkey convert`.
+    '''
+    def __init__(self, num_threads=None):
+        self.model = None
+        self.runner = None
+        self.num_threads = num_threads
+        self.latency = None
+
+    def load(self, model_path):
+        self.runner = TFLiteRunner(model_path=model_path, num_threads=self.num_threads)
+
+    def build_backend(self):
+        pass
+
+    def infer(self, inputs):
+        if not isinstance(inputs, list):
+            inputs = [inputs]
+        start = time.perf_counter()
+        outputs = self.runner.run(inputs)
+        self.latency = time.perf_counter() - start
+        return outputs if len(outputs) > 1 else outputs[0]
+
+    def profile_timings(self):
+        latency, self.latency = self.latency, None
+        return {} if latency is None else {'inference': latency}
+
+    def shutdown(self):
+        pass
+
+
+class TFLiteCategorical(TFLitePilot):
+    def __init__(self, throttle_range=0.5, *args, **kwargs):
+        super(TFLiteCategorical, self).__init__(*args, **kwargs)
+        self.throttle_range = throttle_range
+
+    run = KerasCategorical.run
+
+
+class TFLiteLinear(TFLitePilot):
+    run = KerasLinear.run
+
+
+class TFLiteIMU(TFLitePilot):
+    def __init__(self, num_imu_inputs=6, *args, **kwargs):
+        super(TFLiteIMU, self).__init__(*args, **kwargs)
+        self.num_imu_inputs = num_imu_inputs
+
+    run = KerasIMU.run
+
+
+class TFLiteBehavioral(TFLitePilot):
+    run = KerasBehavioral.run
@@ -22,6 +22,7 @@ import tornado.web
 import tornado.gen
 
 from ... import utils
+from ..codec import PILCodec
 
 
 class RemoteWebServer():
@@ -104,10 +105,10 @@ class RemoteWebServer():
     
 class LocalWebController(tornado.web.Application):
 
-    def __init__(self):
+    def __init__(self, codec=None):
         ''' 
         Create and publish variables needed on many of 
-        the web handlers.
+        the web handlers. codec encodes the video frames, see parts/codec.py.
         '''
 
         print('Starting Donkey Server...')
@@ -119,6 +120,9 @@ class LocalWebController(tornado.web.Application):
         self.throttle = 0.0
         self.mode = 'user'
         self.recording = False
+        self.codec = codec or PILCodec()
+        self.img_arr = None
+        self.frame = None
 
         handlers = [
             (r"/", tornado.web.RedirectHandler, dict(url="/drive")),
@@ -139,8 +143,18 @@ class LocalWebController(tornado.web.Application):
         tornado.ioloop.IOLoop.instance().start()
 
 
+    def get_frame(self):
+        '''
+        the latest image encoded, once per image however many clients watch.
+        '''
+        frame = self.frame
+        if frame is None and self.img_arr is not None:
+            frame = self.frame = self.codec.encode(self.img_arr)
+        return frame
+
     def run_threaded(self, img_arr=None):
         self.img_arr = img_arr
+        self.frame = None
         return self.angle, self.throttle, self.mode, self.recording
         
     def run(self, img_arr=None):
@@ -189,10 +203,13 @@ class VideoAPI(tornado.web.RequestHandler):
             if self.served_image_timestamp + interval < time.time():
 
 
-                img = utils.arr_to_binary(self.application.img_arr)
+                img = self.application.get_frame()
+                if img is None:
+                    yield tornado.gen.Task(ioloop.add_timeout, ioloop.time() + interval)
+                    continue
 
                 self.write(my_boundary)
-                self.write("Content-type: image/jpeg\r\n")
+                self.write("Content-type: %s\r\n" % self.application.codec.mime)
                 self.write("Content-length: %s\r\n\r\n" % len(img)) 
                 self.write(img)
                 self.served_image_timestamp = time.time()
@@ -32,12 +32,20 @@ MODELS_PATH = os.path.join(CAR_PATH, 'models')
 #VEHICLE
 DRIVE_LOOP_HZ = 20
 MAX_LOOPS = 100000
+DRIVE_LOOP_OVERRUN = "late"     #(late|skip|drop) when a loop runs long: start the next one late, skip to the next on schedule, or drop recording and streaming until back on time
+PARALLEL_PARTS = False          #run parts that don't share any channel at the same time on a thread pool
+PARALLEL_PARTS_WORKERS = 4      #threads used when PARALLEL_PARTS is on
+PROFILE_EXPORT_PATH = None      #a .json or .csv file to write part timings to while driving, None to only print them at the end
+BUFFERED_CHANNELS = []          #channels like 'cam/image_array' to keep in preallocated triple buffers, with sequence numbers and timestamps
 
 #CAMERA
 CAMERA_TYPE = "PICAM"   # (PICAM|WEBCAM|CVCAM|MOCK)
 IMAGE_W = 160
 IMAGE_H = 120
 IMAGE_DEPTH = 3         # default RGB=3, make 1 for mono
+IMAGE_CODEC = "pil"     # (pil|opencv|simplejpeg|turbojpeg|png|auto) encodes the tub, web video and published images. auto is the fastest JPEG codec installed, see donkey codecbench
+IMAGE_QUALITY = 75      # JPEG quality 1-100
+IMAGE_SUBSAMPLING = "420"   # (444|422|420) JPEG chroma subsampling. 444 keeps color detail, 420 is smaller and faster
 CAMERA_FRAMERATE = DRIVE_LOOP_HZ
 
 #9865, over rides only if needed, ie. TX2..
@@ -84,7 +92,17 @@ OPTIMIZER = None                #adam, sgd, rmsprop, etc.. None accepts default
 LEARNING_RATE = 0.001           #only used when OPTIMIZER specified
 LEARNING_RATE_DECAY = 0.0       #only used when OPTIMIZER specified
 SEND_BEST_MODEL_TO_PI = False   #change to true to automatically send best model during training
-CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs, but crater if not enough mem.
+CACHE_IMAGES = True             #keep images in memory. will speed succesive epochs.
+IMAGE_CACHE_MB = 2048           #memory budget of the image cache. the least recently used images are dropped beyond it.
+IMAGE_CACHE_COMPRESSED = False  #cache the jpg bytes instead of decoded images. fits many more frames, but decodes on every use.
+TRAIN_WORKERS = 4               #number of workers preparing batches while the model trains. continuous training always uses one.
+TRAIN_USE_MULTIPROCESSING = False #use processes instead of threads for the workers. worker processes don't share the image cache.
+TRAIN_MAX_QUEUE_SIZE = 10       #max number of prepared batches waiting for the model.
+TRAIN_BALANCE = False           #draw each epoch's training records so the steering and throttle bins get their share, instead of mostly straight road.
+TRAIN_BALANCE_ANGLE_BINS = 15   #steering bins, as binned by linear_bin.
+TRAIN_BALANCE_THROTTLE_BINS = 1 #throttle bins from 0 to MODEL_CATEGORICAL_MAX_THROTTLE_RANGE. 1 balances on steering only.
+TRAIN_BALANCE_WEIGHTS = None    #a list of the share of each steering bin, from full left to full right. None shares equally.
+TRAIN_BALANCE_CAP = None        #max records of a bin in each epoch, times its weight. None draws as many records as the training set has.
 PRUNE_CNN = False
 PRUNE_PERCENT_TARGET = 75 # The desired percentage of pruning.
 PRUNE_PERCENT_PER_ITERATION = 20 # Percenge of pruning that is perform per iteration.
@@ -95,6 +113,7 @@ PRUNE_EVAL_PERCENT_OF_DATASET = .05  # percent of dataset used to perform evalua
 # only supported in Categorical and Linear models.
 ROI_CROP_TOP = 0
 ROI_CROP_BOTTOM = 0
+ROI_CROP_AT_LOAD = False    #cut the ROI rows off when images are loaded, and before the pilot when driving, instead of inside the model. a model trained this way needs it set when driving too.
 
 #model transfer options
 FREEZE_LAYERS = False
@@ -115,6 +134,10 @@ JOYSTICK_DEADZONE = 0.0         # when non zero, this is the smallest throttle b
 #and ideally wouldn't change once set.
 MODEL_CATEGORICAL_MAX_THROTTLE_RANGE = 0.5
 
+#how the pilot runs its model while driving
+PILOT_BACKEND = "predict"       #(predict|function|tflite) function calls the model directly, tflite converts it once at load and runs it with the TFLite interpreter
+PILOT_PRECISION = "float32"     #(float32|float16|int8) float16 and int8 shrink the weights, tflite backend only
+
 #RNN or 3D
 SEQUENCE_LENGTH = 3
 
@@ -127,6 +150,10 @@ HAVE_SOMBRERO = False
 #RECORD OPTIONS
 RECORD_DURING_AI = False
 USE_REWARDS = False
+TUB_STORAGE = "json"            #(json|columnar) columnar packs all non image channels into binary segments instead of a json file per record.
+TUB_WRITER_BACKGROUND = False   #encode and write records on a background thread, so disk stalls don't slow the drive loop
+TUB_WRITER_QUEUE_SIZE = 100     #records waiting for the background writer. more are dropped, and counted, when it falls behind
+TUB_WRITER_SYNC_EVERY = 100     #fsync the background writer's files every N records, 0 to leave it to the OS
 
 #LED
 HAVE_RGB_LED = False
@@ -29,6 +29,7 @@ from donkeycar.parts.throttle_filter import ThrottleFilter
 from donkeycar.parts.behavior import BehaviorPart
 from donkeycar.parts.file_watcher import FileWatcher
 from donkeycar.parts.launch import AiLaunch
+from donkeycar.parts.codec import get_codec
 
 def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type='single', meta=[] ):
     '''
@@ -54,8 +55,15 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         else:
             model_type = "categorical"
     
+    #one image codec for the tub, the web video and published camera images.
+    codec = get_codec(cfg.IMAGE_CODEC, cfg.IMAGE_QUALITY, cfg.IMAGE_SUBSAMPLING)
+
     #Initialize car
-    V = dk.vehicle.Vehicle()
+    V = dk.vehicle.Vehicle(parallel=cfg.PARALLEL_PARTS, max_workers=cfg.PARALLEL_PARTS_WORKERS,
+                           profile_path=cfg.PROFILE_EXPORT_PATH)
+
+    for channel in cfg.BUFFERED_CHANNELS:
+        V.mem.add_buffer(channel)
 
     if camera_type == "stereo":
 
@@ -137,7 +145,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
     else:        
         #This web controller will create a web server that is capable
         #of managing steering, throttle, and modes, and more.
-        ctr = LocalWebController()
+        ctr = LocalWebController(codec=codec)
 
     
     V.add(ctr, 
@@ -290,6 +298,7 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         try:
             print('loading model', model_path)
             kl.load(model_path)
+            kl.build_backend()
             print('finished loading in %s sec.' % (str(time.time() - start)) )
         except Exception as e:
             print(e)
@@ -299,7 +308,8 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         start = time.time()
         try:
             print('loading model weights', weights_path)
-            kl.model.load_weights(weights_path)
+            kl.load_weights(weights_path, by_name=False)
+            kl.build_backend()
             print('finished loading in %s sec.' % (str(time.time() - start)) )
         except Exception as e:
             print(e)
@@ -320,11 +330,14 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
 
     if model_path:
         #When we have a model, first create an appropriate Keras part
-        kl = dk.utils.get_model_by_type(model_type, cfg)
+        pilot_type = model_type
+        if '.tflite' in model_path and not model_type.startswith('tflite_'):
+            pilot_type = 'tflite_' + model_type
+        kl = dk.utils.get_model_by_type(pilot_type, cfg)
 
         model_reload_cb = None
 
-        if '.h5' in model_path:
+        if '.h5' in model_path or '.tflite' in model_path:
             #when we have a .h5 extension
             #load everything from the model file
             load_model(kl, model_path)
@@ -361,6 +374,13 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
 
         if cfg.TRAIN_LOCALIZER:
             outputs.append("pilot/loc")
+
+        if cfg.ROI_CROP_AT_LOAD:
+            #the model was trained on images with the ROI rows already cut off.
+            top, bottom = cfg.ROI_CROP_TOP, cfg.IMAGE_H - cfg.ROI_CROP_BOTTOM
+            V.add(Lambda(lambda img_arr: None if img_arr is None else img_arr[top:bottom]),
+                  inputs=['cam/image_array'], outputs=['cam/image_array_roi'], run_condition='run_pilot')
+            inputs = ['cam/image_array_roi'] + inputs[1:]
     
         V.add(kl, inputs=inputs, 
             outputs=outputs,
@@ -495,23 +515,22 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
             self.tub = tub
 
         def apply_neg_reward(self):
-            import json
             if self.tub is None:
                 return
+            #make sure the records still queued for writing are there to update.
+            self.tub.flush()
             iRecord = self.tub.current_ix
             iStop = iRecord - self.neg_time_ramp_steps
             reward = self.max_neg
             dr = -1.0 * self.max_neg / self.neg_time_ramp_steps
             while iRecord > iStop and iRecord > -1:
-                path = self.tub.get_json_record_path(iRecord)
+                ix = iRecord
                 iRecord = iRecord - 1
-                with open(path, 'r') as fp:
-                    json_data = json.load(fp)
+                if ix not in self.tub.catalog:
+                    continue
 
-                json_data['reward/value'] = reward
                 print("writing reward", reward)
-                with open(path, 'w') as fp:
-                    json.dump(json_data, fp)
+                self.tub.update_record(ix, 'reward/value', reward)
 
                 reward += dr
         
@@ -548,15 +567,17 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
         types += ['float', 'float']
     
     th = TubHandler(path=cfg.DATA_PATH)
-    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
-    V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+    tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, storage=cfg.TUB_STORAGE,
+        background=cfg.TUB_WRITER_BACKGROUND, queue_size=cfg.TUB_WRITER_QUEUE_SIZE, sync_every=cfg.TUB_WRITER_SYNC_EVERY,
+        codec=codec)
+    V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording', priority=-1)
 
     if cfg.PUB_CAMERA_IMAGES:
         from donkeycar.parts.network import TCPServeValue
         from donkeycar.parts.image import ImgArrToJpg
         pub = TCPServeValue("camera")
-        V.add(ImgArrToJpg(), inputs=['cam/image_array'], outputs=['jpg/bin'])
-        V.add(pub, inputs=['jpg/bin'])
+        V.add(ImgArrToJpg(codec=codec), inputs=['cam/image_array'], outputs=['jpg/bin'], priority=-1)
+        V.add(pub, inputs=['jpg/bin'], priority=-1)
 
     if type(ctr) is LocalWebController:
         print("You can now go to <your pi ip address>:8887 to drive your car.")
@@ -574,15 +595,20 @@ def drive(cfg, model_path=None, use_joystick=False, model_type=None, camera_type
     
             def new_tub_dir():
                 V.parts.pop()
-                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta)
-                V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording')
+                #finish writing the records still queued for the previous tub.
+                ctr.tub.shutdown()
+                tub = th.new_tub_writer(inputs=inputs, types=types, user_meta=meta, storage=cfg.TUB_STORAGE,
+                    background=cfg.TUB_WRITER_BACKGROUND, queue_size=cfg.TUB_WRITER_QUEUE_SIZE, sync_every=cfg.TUB_WRITER_SYNC_EVERY,
+                    codec=codec)
+                V.add(tub, inputs=inputs, outputs=["tub/num_records"], run_condition='recording', priority=-1)
                 ctr.set_tub(tub)
     
             ctr.set_button_down_trigger('cross', new_tub_dir)
 
     #run the vehicle for 20 seconds
     V.start(rate_hz=cfg.DRIVE_LOOP_HZ, 
-            max_loop_count=cfg.MAX_LOOPS)
+            max_loop_count=cfg.MAX_LOOPS,
+            overrun=cfg.DRIVE_LOOP_OVERRUN)
 
 
 if __name__ == '__main__':
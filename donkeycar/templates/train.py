@@ -32,11 +32,11 @@ import keras
 import pickle
 
 import donkeycar as dk
-from donkeycar.parts.datastore import Tub
+from donkeycar.parts.datastore import Tub, TubImagePack, ImageCache, RecordWatcher
 from donkeycar.parts.keras import KerasLinear, KerasIMU,\
      KerasCategorical, KerasBehavioral, Keras3D_CNN,\
      KerasRNN_LSTM, KerasLatent
-from donkeycar.parts.augment import augment_image
+from donkeycar.parts.augment import augment_batch
 from donkeycar.utils import *
 
 import sklearn
@@ -106,14 +106,68 @@ def make_key(sample):
     index = sample['index']
     return tub_path + str(index)
 
-def make_next_key(sample, index_offset):
-    tub_path = sample['tub_path']
-    index = sample['index'] + index_offset
-    return tub_path + str(index)
+def make_record_key(record_path):
+    return make_key({'tub_path': os.path.dirname(record_path), 'index': get_record_index(record_path)})
+
+
+def load_record_image(record, cfg, image_cache=None):
+    '''
+    get the scaled image of a record, straight from its tub's image pack
+    when there is one, otherwise through the image_cache if given
+    '''
+    pack = record.get('image_pack')
+    if pack is not None:
+        return pack.get(record['index'])
+    if image_cache is not None:
+        return image_cache.get(record['image_path'], lambda f: load_scaled_image_arr(f, cfg))
+    return load_scaled_image_arr(record['image_path'], cfg)
+
+
+class TubReader(object):
+    '''
+    Reads the records of one tub for collate_records, and is kept in
+    opts['tub_readers'] so continuous training opens each tub once.
+
+    A json tub is read from its record files, as the RecordWatcher finds
+    them, and is never opened as a Tub, which would build a catalog in a
+    tub that has none while rsync is still writing to it. A columnar tub
+    is opened as a Tub, its writer keeps the catalog, which is read again
+    when a record newer than it shows up.
+    '''
+    def __init__(self, path, cfg):
+        self.path = path
+        self.tub = None
+        try:
+            with open(os.path.join(path, 'meta.json'), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        self.columnar = meta.get('format') == 'columnar'
+        if self.columnar and os.path.exists(os.path.join(path, 'catalog.bin')):
+            self.tub = Tub(path)
+
+        height, width, depth = get_image_shape(cfg)
+        self.pack = TubImagePack(path, width, height, depth)
+        self.pack = self.pack.open() if self.pack.exists() else None
+
+    def get_json_record(self, record_path, index):
+        if not self.columnar:
+            with open(record_path, 'r') as fp:
+                return json.load(fp)
+        if self.tub is None:
+            raise FileNotFoundError('no catalog in columnar tub %s' % self.path)
+        if index not in self.tub.catalog:
+            self.tub.catalog.load()
+        return self.tub.get_json_record(index)
+
+    def get_image_pack(self, index):
+        return self.pack if self.pack is not None and index in self.pack else None
 
 
 def collate_records(records, gen_records, opts):
 
+    readers = opts.setdefault('tub_readers', {})
+
     for record_path in records:
 
         basepath = os.path.dirname(record_path)        
@@ -126,8 +180,9 @@ def collate_records(records, gen_records, opts):
             continue
 
         try:
-            with open(record_path, 'r') as fp:
-                json_data = json.load(fp)
+            if basepath not in readers:
+                readers[basepath] = TubReader(basepath, opts['cfg'])
+            json_data = readers[basepath].get_json_record(record_path, index)
         except:
             continue
 
@@ -167,7 +222,7 @@ def collate_records(records, gen_records, opts):
         except:
             pass
 
-        sample['img_data'] = None
+        sample['image_pack'] = readers[basepath].get_image_pack(index)
 
         #now assign test or val
         sample['train'] = (random.uniform(0., 1.0) > 0.2)
@@ -175,6 +230,79 @@ def collate_records(records, gen_records, opts):
         gen_records[key] = sample
 
 
+class BalancedSampler(object):
+    '''
+    Picks the training records of each epoch so that turns get as much of
+    it as straight road. Records are binned with linear_bin, on user/angle
+    into angle_bins and on user/throttle into throttle_bins from 0 to
+    max_throttle.
+
+    weights, one per angle bin, sets each bin's share of an epoch, equal by
+    default. Without cap an epoch draws as many records as there are, with
+    replacement. With cap each bin gives at most cap times its weight
+    records, without replacement, so the bins of straight road are cut down
+    and an epoch has fewer images to load.
+    '''
+    def __init__(self, records, angle_bins=15, throttle_bins=1, max_throttle=0.5, weights=None, cap=None, seed=None):
+        self.random = np.random.RandomState(seed)
+        self.cap = cap
+        self.n = len(records)
+
+        if weights is None:
+            weights = np.ones(angle_bins)
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (angle_bins,):
+            raise ValueError('need one weight per angle bin, got %d for %d bins' % (weights.size, angle_bins))
+
+        angle_bin = [np.argmax(linear_bin(float(r['json_data']['user/angle']), N=angle_bins)) for r in records]
+        throttle_bin = [np.argmax(linear_bin(float(r['json_data']['user/throttle']), N=throttle_bins, offset=0,
+                                             R=max_throttle)) for r in records]
+        bins = np.array(angle_bin, dtype=np.int64) * throttle_bins + np.array(throttle_bin, dtype=np.int64)
+
+        self.bins = np.unique(bins)
+        self.members = [np.nonzero(bins == b)[0] for b in self.bins]
+        self.bin_weights = weights[self.bins // throttle_bins]
+
+        #the chance of each record, so every bin gets its weight's share.
+        self.p = np.zeros(self.n)
+        for members, weight in zip(self.members, self.bin_weights):
+            self.p[members] = weight / len(members)
+        if self.n and not self.p.sum() > 0:
+            raise ValueError('the weights of the bins holding records are all zero')
+        if self.n:
+            self.p /= self.p.sum()
+
+    @classmethod
+    def from_config(cls, records, cfg, seed=None):
+        '''
+        the sampler configured by the TRAIN_BALANCE_* settings
+        '''
+        return cls(records, cfg.TRAIN_BALANCE_ANGLE_BINS, cfg.TRAIN_BALANCE_THROTTLE_BINS,
+                   cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE, cfg.TRAIN_BALANCE_WEIGHTS,
+                   cfg.TRAIN_BALANCE_CAP, seed)
+
+    def epoch(self):
+        '''
+        the positions in records of the records of a new epoch, shuffled
+        '''
+        if self.n == 0:
+            return np.zeros(0, dtype=np.int64)
+        if self.cap is not None:
+            picks = [self.random.permutation(members)[:int(round(self.cap * weight))]
+                     for members, weight in zip(self.members, self.bin_weights)]
+            return self.random.permutation(np.concatenate(picks))
+        return self.random.choice(self.n, self.n, p=self.p)
+
+    def epoch_size(self):
+        if self.cap is None:
+            return self.n
+        return sum(min(len(members), int(round(self.cap * weight)))
+                   for members, weight in zip(self.members, self.bin_weights))
+
+    def __str__(self):
+        return '%d records in %d bins, %d per epoch' % (self.n, len(self.bins), self.epoch_size())
+
+
 def save_json_and_weights(model, filename):
     '''
     given a keras model and a .h5 filename, save the model file
@@ -345,9 +473,16 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
     opts['keras_pilot'] = kl
     opts['continuous'] = continuous
 
+    image_cache = ImageCache.from_config(cfg)
+
     extract_data_from_pickles(cfg, tub_names)
 
-    records = gather_records(cfg, tub_names, opts, verbose=True)
+    if continuous:
+        #pick up the records written while training without rescanning every tub.
+        watcher = RecordWatcher(cfg, tub_names)
+        records, _ = watcher.poll()
+    else:
+        records = gather_records(cfg, tub_names, opts, verbose=True)
     print('collating %d records ...' % (len(records)))
     collate_records(records, gen_records, opts)
 
@@ -355,21 +490,26 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
         
         num_records = len(data)
 
+        layout = get_batch_layout(opts['keras_pilot'])
+
         while True:
 
             if isTrainSet and opts['continuous']:
                 '''
                 When continuous training, we look for new records after each epoch.
-                This will add new records to the train and validation set.
+                This will add new records to the train and validation set, and
+                drop the deleted ones.
                 '''
-                records = gather_records(cfg, tub_names, opts)
-                if len(records) > num_records:
-                    collate_records(records, gen_records, opts)
-                    new_num_rec = len(data)
-                    if new_num_rec > num_records:
-                        print('picked up', new_num_rec - num_records, 'new records!')
-                        num_records = new_num_rec 
-                        save_best.reset_best()
+                added, removed = watcher.poll()
+                for record_path in removed:
+                    data.pop(make_record_key(record_path), None)
+                if added:
+                    collate_records(added, gen_records, opts)
+                new_num_rec = len(data)
+                if new_num_rec > num_records:
+                    print('picked up', new_num_rec - num_records, 'new records!')
+                    save_best.reset_best()
+                num_records = new_num_rec
                 if num_records < min_records_to_train:
                     print("not enough records to train. need %d, have %d. waiting..." % (min_records_to_train, num_records))
                     time.sleep(10)
@@ -377,28 +517,14 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
 
             batch_data = []
 
-            keys = list(data.keys())
-
-            keys = shuffle(keys)
-
-            kl = opts['keras_pilot']
-
-            if type(kl.model.output) is list:
-                model_out_shape = (2, 1)
+            if isTrainSet and cfg.TRAIN_BALANCE:
+                keys = [key for key, record in data.items() if record['train']]
+                sampler = BalancedSampler.from_config([data[key] for key in keys], cfg)
+                keys = [keys[i] for i in sampler.epoch()]
             else:
-                model_out_shape = kl.model.output.shape
+                keys = list(data.keys())
 
-            if type(kl.model.input) is list:
-                model_in_shape = (2, 1)
-            else:    
-                model_in_shape = kl.model.input.shape
-
-            has_imu = type(kl) is KerasIMU
-            has_bvh = type(kl) is KerasBehavioral
-            img_out = type(kl) is KerasLatent
-            
-            if img_out:
-                import cv2
+                keys = shuffle(keys)
 
             for key in keys:
 
@@ -410,76 +536,18 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                 if _record['train'] != isTrainSet:
                     continue
 
-                if continuous:
-                    #in continuous mode we need to handle files getting deleted
-                    filename = _record['image_path']
-                    if not os.path.exists(filename):
-                        data.pop(key, None)
-                        continue
-
                 batch_data.append(_record)
 
                 if len(batch_data) == batch_size:
-                    inputs_img = []
-                    inputs_imu = []
-                    inputs_bvh = []
-                    angles = []
-                    throttles = []
-                    out_img = []
-
-                    for record in batch_data:
-                        #get image data if we don't already have it
-                        if record['img_data'] is None:
-                            filename = record['image_path']
-                            
-                            img_arr = load_scaled_image_arr(filename, cfg)
-
-                            if img_arr is None:
-                                break
-                            
-                            if aug:
-                                img_arr = augment_image(img_arr)
-
-                            if cfg.CACHE_IMAGES:
-                                record['img_data'] = img_arr
-                        else:
-                            img_arr = record['img_data']
-                            
-                        if img_out:                            
-                            rz_img_arr = cv2.resize(img_arr, (127, 127)) / 255.0
-                            out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
-                            
-                        if has_imu:
-                            inputs_imu.append(record['imu_array'])
-                        
-                        if has_bvh:
-                            inputs_bvh.append(record['behavior_arr'])
-
-                        inputs_img.append(img_arr)
-                        angles.append(record['angle'])
-                        throttles.append(record['throttle'])
-
-                    if img_arr is None:
-                        continue
-
-                    img_arr = np.array(inputs_img).reshape(batch_size,\
-                        cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
-
-                    if has_imu:
-                        X = [img_arr, np.array(inputs_imu)]
-                    elif has_bvh:
-                        X = [img_arr, np.array(inputs_bvh)]
-                    else:
-                        X = [img_arr]
-
-                    if img_out:
-                        y = [out_img, np.array(angles), np.array(throttles)]
-                    elif model_out_shape[1] == 2:
-                        y = [np.array([angles, throttles])]
-                    else:
-                        y = [np.array(angles), np.array(throttles)]
-
-                    yield X, y
+                    failed = []
+                    batch = make_batch(batch_data, layout, cfg, aug, image_cache, failed)
+
+                    if batch is not None:
+                        yield batch
+                    if continuous:
+                        #in continuous mode images can get deleted, forget their records.
+                        for record in failed:
+                            data.pop(make_key(record), None)
 
                     batch_data = []
     
@@ -494,8 +562,14 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
                                     mode='min',
                                     cfg=cfg)
 
-    train_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, True)
-    val_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, False)
+    if continuous:
+        train_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, True)
+        val_gen = generator(save_best, opts, gen_records, cfg.BATCH_SIZE, False)
+    else:
+        #the record set is fixed, so batches can be prepared by a pool of workers.
+        train_gen = TubSequence(gen_records, kl, cfg, cfg.BATCH_SIZE, True, aug, image_cache,
+                                balance=cfg.TRAIN_BALANCE)
+        val_gen = TubSequence(gen_records, kl, cfg, cfg.BATCH_SIZE, False, aug, image_cache)
     
     total_records = len(gen_records)
 
@@ -512,7 +586,9 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
     print('total records: %d' %(total_records))
     
     if not continuous:
-        steps_per_epoch = num_train // cfg.BATCH_SIZE
+        steps_per_epoch = len(train_gen)
+        if train_gen.sampler is not None:
+            print('balanced training set:', train_gen.sampler)
     else:
         steps_per_epoch = 100
     
@@ -521,6 +597,12 @@ def train(cfg, tub_names, model_name, transfer_model, model_type, continuous, au
 
     go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best)
 
+    if continuous:
+        watcher.close()
+
+    if image_cache is not None:
+        print('image cache:', image_cache)
+
     
     
 def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose, save_best=None):
@@ -552,8 +634,13 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
     else:
         epochs = cfg.MAX_EPOCHS
 
-    workers_count = 1
-    use_multiprocessing = False
+    #a Sequence can be split across several workers, a generator can't.
+    if isinstance(train_gen, keras.utils.Sequence):
+        workers_count = cfg.TRAIN_WORKERS
+        use_multiprocessing = cfg.TRAIN_USE_MULTIPROCESSING
+    else:
+        workers_count = 1
+        use_multiprocessing = False
 
     callbacks_list = [save_best]
 
@@ -569,7 +656,8 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
                     callbacks=callbacks_list, 
                     validation_steps=val_steps,
                     workers=workers_count,
-                    use_multiprocessing=use_multiprocessing)
+                    use_multiprocessing=use_multiprocessing,
+                    max_queue_size=cfg.TRAIN_MAX_QUEUE_SIZE)
                     
     full_model_val_loss = min(history.history['val_loss'])
     max_val_loss = full_model_val_loss + cfg.PRUNE_VAL_LOSS_DEGRADATION_LIMIT
@@ -645,7 +733,8 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
                         validation_steps=val_steps,
                         workers=workers_count,
                         callbacks=[early_stop],
-                        use_multiprocessing=use_multiprocessing)
+                        use_multiprocessing=use_multiprocessing,
+                        max_queue_size=cfg.TRAIN_MAX_QUEUE_SIZE)
 
             prune_loss = min(history.history['val_loss'])
             print('prune val_loss this iteration: {}'.format(prune_loss))
@@ -659,6 +748,175 @@ def go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epo
         print('pruning stopped at {} with a target of {}'.format(cnn_channels, target_channels))
 
 
+def get_batch_layout(kl):
+    '''
+    describe the inputs and outputs of the keras pilot, so batches can be
+    collated without holding on to the model.
+    '''
+    if type(kl.model.output) is list:
+        model_out_shape = (2, 1)
+    else:
+        model_out_shape = kl.model.output.shape
+
+    return { 'has_imu' : type(kl) is KerasIMU,
+             'has_bvh' : type(kl) is KerasBehavioral,
+             'img_out' : type(kl) is KerasLatent,
+             'two_outputs' : model_out_shape[1] == 2 }
+
+
+def load_batch_images(batch_data, cfg, image_cache=None, failed=None):
+    '''
+    load the images of the batch records, each one once. returns the
+    records that loaded and their images, the others are left out and
+    added to failed when it's given.
+    '''
+    records = []
+    images = []
+    for record in batch_data:
+        img_arr = load_record_image(record, cfg, image_cache)
+        if img_arr is None:
+            if failed is not None:
+                failed.append(record)
+            continue
+        records.append(record)
+        images.append(img_arr)
+    return records, images
+
+
+def make_batch(batch_data, layout, cfg, aug, image_cache=None, failed=None, images=None):
+    '''
+    load the images of the batch records and collate them into the X, y
+    lists that fit_generator expects. records whose image could not be
+    loaded are left out of the batch, and added to failed when it's given.
+    returns None when none of them loaded. images, already loaded by
+    load_batch_images, skips the loading. the whole batch is augmented at
+    once after the images come out of the cache, so each epoch sees a
+    fresh augmentation.
+    '''
+    inputs_img = []
+    inputs_imu = []
+    inputs_bvh = []
+    angles = []
+    throttles = []
+    out_img = []
+
+    if layout['img_out']:
+        import cv2
+
+    if images is None:
+        batch_data, images = load_batch_images(batch_data, cfg, image_cache, failed)
+    if not batch_data:
+        return None
+
+    for record, img_arr in zip(batch_data, images):
+        if layout['has_imu']:
+            inputs_imu.append(record['imu_array'])
+        
+        if layout['has_bvh']:
+            inputs_bvh.append(record['behavior_arr'])
+
+        inputs_img.append(img_arr)
+        angles.append(record['angle'])
+        throttles.append(record['throttle'])
+
+    img_arr = np.array(inputs_img).reshape((len(inputs_img),) + get_image_shape(cfg))
+
+    if aug:
+        img_arr = augment_batch(img_arr.astype(np.uint8, copy=False))
+
+    if layout['img_out']:
+        for img in img_arr:
+            rz_img_arr = cv2.resize(img, (127, 127)) / 255.0
+            out_img.append(rz_img_arr[:,:,0].reshape((127, 127, 1)))
+
+    if layout['has_imu']:
+        X = [img_arr, np.array(inputs_imu)]
+    elif layout['has_bvh']:
+        X = [img_arr, np.array(inputs_bvh)]
+    else:
+        X = [img_arr]
+
+    if layout['img_out']:
+        y = [out_img, np.array(angles), np.array(throttles)]
+    elif layout['two_outputs']:
+        y = [np.array([angles, throttles])]
+    else:
+        y = [np.array(angles), np.array(throttles)]
+
+    return X, y
+
+
+class TubSequence(keras.utils.Sequence):
+    """
+    Provides the train or validation batches of the collated records to fit_generator.
+    Batches are looked up by index, so keras can prepare several of them on its
+    worker pool while the model trains on the previous one.
+    With balance, each epoch's records are drawn by a BalancedSampler.
+    Records whose image fails to load are dropped from data and from the
+    epochs after, and their batch is filled up with other records.
+    """
+    def __init__(self, data, kl, cfg, batch_size, isTrainSet=True, aug=False, image_cache=None, balance=False):
+        self.data = data
+        self.set_keys = [key for key, record in data.items() if record['train'] == isTrainSet]
+        self.failed = set()
+        self.sampler = None
+        if balance:
+            self.sampler = BalancedSampler.from_config([data[key] for key in self.set_keys], cfg)
+        self.keys = self.epoch_keys()
+        self.layout = get_batch_layout(kl)
+        self.batch_size = batch_size
+        self.cfg = cfg
+        self.aug = aug
+        self.image_cache = image_cache
+
+    def __len__(self):
+        return len(self.keys) // self.batch_size
+
+    def __getitem__(self, idx):
+        keys = self.keys[idx * self.batch_size:(idx + 1) * self.batch_size]
+        records, images = [], []
+
+        while True:
+            batch_data = [self.data.get(key) for key in keys if key not in self.failed]
+            failed = []
+            loaded, loaded_images = load_batch_images([r for r in batch_data if r is not None],
+                                                      self.cfg, self.image_cache, failed)
+            records += loaded
+            images += loaded_images
+            for record in failed:
+                self.drop(make_key(record))
+
+            missing = self.batch_size - len(records)
+            if missing <= 0:
+                break
+            #a Sequence can't skip a batch, fill it up with other records.
+            candidates = [key for key in self.set_keys if key not in self.failed]
+            if not candidates:
+                break
+            keys = random.sample(candidates, min(missing, len(candidates)))
+
+        if not records:
+            raise ValueError('none of the %d records could be loaded' % len(self.set_keys))
+        return make_batch(records, self.layout, self.cfg, self.aug, images=images)
+
+    def drop(self, key):
+        '''
+        forget a record whose image failed to load
+        '''
+        self.failed.add(key)
+        self.data.pop(key, None)
+
+    def epoch_keys(self):
+        if self.sampler is not None:
+            keys = [self.set_keys[i] for i in self.sampler.epoch()]
+        else:
+            keys = shuffle(self.set_keys)
+        return [key for key in keys if key not in self.failed]
+
+    def on_epoch_end(self):
+        self.keys = self.epoch_keys()
+
+
 class SequencePredictionGenerator(keras.utils.Sequence):
     """
     Provides a thread safe data generator for the Keras predict_generator for use with kerasergeon. 
@@ -678,12 +936,100 @@ class SequencePredictionGenerator(keras.utils.Sequence):
 
         images = []
         for data in batch_data:
-            path = data['image_path']
-            img_arr = load_scaled_image_arr(path, self.cfg)
+            img_arr = load_record_image(data, self.cfg)
             images.append(img_arr)
 
         return np.array(images), np.array([])
 
+class SequenceDataset(object):
+    '''
+    The frames of the tubs and the windows of length consecutive records
+    that sequence models train on.
+
+    Each frame is stored once, tub after tub in record index order, and a
+    window is just the position of its first frame in starts. A run of
+    consecutive records in a tub gives a window starting at each of its
+    frames but the last length - 1. get_batch decodes each frame of its
+    windows once, however many of them overlap it.
+
+    With look_ahead, the first half of a window is the model's images and
+    the angle and throttle from the last of them on are its labels.
+    '''
+    def __init__(self, tubs, cfg, length, look_ahead=False):
+        self.cfg = cfg
+        self.length = length
+        self.look_ahead = look_ahead
+        self.num_images = length // 2 if look_ahead else length
+
+        self.records = []
+        angles, throttles, starts = [], [], []
+
+        for tub in tubs:
+            ixs = tub.catalog.index(exclude=tub.exclude)
+            print("Tub:", tub.path, "has", len(ixs), 'records')
+            pack = tub.get_image_pack(cfg)
+            first = len(self.records)
+
+            for ix in ixs.tolist():
+                json_data = tub.get_json_record(ix)
+                self.records.append({'tub_path': tub.path, 'index': ix,
+                                     'image_path': os.path.join(tub.path, json_data["cam/image_array"]),
+                                     'image_pack': pack if pack is not None and ix in pack else None})
+                angles.append(float(json_data['user/angle']))
+                throttles.append(float(json_data["user/throttle"]))
+
+            #a window starts wherever the next length - 1 records follow on.
+            breaks = np.concatenate([[0], np.nonzero(np.diff(ixs) != 1)[0] + 1, [len(ixs)]])
+            for begin, end in zip(breaks[:-1], breaks[1:]):
+                starts.append(np.arange(first + begin, first + end - length + 1))
+
+        self.angles = np.array(angles, dtype=np.float32)
+        self.throttles = np.array(throttles, dtype=np.float32)
+        self.starts = np.concatenate(starts).astype(np.int64) if starts else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get_batch(self, starts, image_cache=None, aug=False):
+        '''
+        the X, y batch of the windows beginning at starts. windows with a
+        frame that fails to load are left out, None when none are left.
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        positions = starts[:, np.newaxis] + np.arange(self.num_images)
+        unique, inverse = np.unique(positions, return_inverse=True)
+        inverse = inverse.reshape(positions.shape)
+
+        loaded = [load_record_image(self.records[pos], self.cfg, image_cache) for pos in unique.tolist()]
+        ok = np.array([img is not None for img in loaded])
+        keep = ok[inverse].all(axis=1)
+        if not keep.any():
+            return None
+        shape = next(img.shape for img in loaded if img is not None)
+        frames = np.array([img if img is not None else np.zeros(shape, dtype=np.uint8) for img in loaded])
+
+        if aug:
+            #augment each frame once, the windows sharing it see the same one.
+            frames = augment_batch(frames.astype(np.uint8, copy=False))
+
+        starts, inverse = starts[keep], inverse[keep]
+        imgs = frames[inverse]
+        batch_size = len(starts)
+
+        if self.look_ahead:
+            height, width = shape[:2]
+            out = starts[:, np.newaxis] + np.arange(self.num_images - 1, self.length)
+            X = [imgs.reshape(batch_size, height, width, self.num_images),
+                 np.zeros((batch_size, (self.num_images - 1) * 2))]
+            y = np.stack([self.angles[out], self.throttles[out]], axis=2).reshape(batch_size, -1)
+        else:
+            last = starts + self.length - 1
+            X = [imgs.reshape((batch_size, self.num_images) + shape)]
+            y = np.stack([self.angles[last], self.throttles[last]], axis=1)
+
+        return X, y
+
+
 def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, continuous, aug):
     '''
     use the specified data in tub_names to train an artifical neural network
@@ -700,51 +1046,8 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
     
     verbose = cfg.VEBOSE_TRAIN
 
-    records = []
-
-    for tub in tubs:
-        record_paths = glob.glob(os.path.join(tub.path, 'record_*.json'))
-        print("Tub:", tub.path, "has", len(record_paths), 'records')
-
-        record_paths.sort(key=get_record_index)
-        records += record_paths
-
-
-    print('collating records')
-    gen_records = {}
-
-    for record_path in records:
-
-        with open(record_path, 'r') as fp:
-            json_data = json.load(fp)
-
-        basepath = os.path.dirname(record_path)
-        image_filename = json_data["cam/image_array"]
-        image_path = os.path.join(basepath, image_filename)
-        sample = { 'record_path' : record_path, "image_path" : image_path, "json_data" : json_data }
-
-        sample["tub_path"] = basepath
-        sample["index"] = get_image_index(image_filename)
-
-        angle = float(json_data['user/angle'])
-        throttle = float(json_data["user/throttle"])
-
-        sample['target_output'] = np.array([angle, throttle])
-        sample['angle'] = angle
-        sample['throttle'] = throttle
-
-        sample['img_data'] = None
-
-        key = make_key(sample)
-
-        gen_records[key] = sample
-
-
+    image_cache = ImageCache.from_config(cfg)
 
-    print('collating sequences')
-
-    sequences = []
-    
     target_len = cfg.SEQUENCE_LENGTH
     look_ahead = False
     
@@ -752,114 +1055,34 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
         target_len = cfg.SEQUENCE_LENGTH * 2
         look_ahead = True
 
-    for k, sample in gen_records.items():
-
-        seq = []
-
-        for i in range(target_len):
-            key = make_next_key(sample, i)
-            if key in gen_records:
-                seq.append(gen_records[key])
-            else:
-                continue
-
-        if len(seq) != target_len:
-            continue
-
-        sequences.append(seq)
+    print('collating records')
+    dataset = SequenceDataset(tubs, cfg, target_len, look_ahead)
 
-    print("collated", len(sequences), "sequences of length", target_len)
+    print("collated", len(dataset), "sequences of length", target_len)
 
     #shuffle and split the data
-    train_data, val_data  = train_test_split(sequences, shuffle=True, test_size=(1 - cfg.TRAIN_TEST_SPLIT))
+    train_data, val_data  = train_test_split(dataset.starts, shuffle=True, test_size=(1 - cfg.TRAIN_TEST_SPLIT))
 
 
-    def generator(data, opt, batch_size=cfg.BATCH_SIZE):
+    def generator(data, batch_size=cfg.BATCH_SIZE):
         num_records = len(data)
 
         while True:
             #shuffle again for good measure
             data = shuffle(data)
 
-            for offset in range(0, num_records, batch_size):
-                batch_data = data[offset:offset+batch_size]
-
-                if len(batch_data) != batch_size:
-                    break
-
-                b_inputs_img = []
-                b_vec_in = []
-                b_labels = []
-                b_vec_out = []
-
-                for seq in batch_data:
-                    inputs_img = []
-                    vec_in = []
-                    labels = []
-                    vec_out = []
-                    num_images_target = len(seq)
-                    iTargetOutput = -1
-                    if opt['look_ahead']:
-                        num_images_target = cfg.SEQUENCE_LENGTH
-                        iTargetOutput = cfg.SEQUENCE_LENGTH - 1
-
-                    for iRec, record in enumerate(seq):
-                        #get image data if we don't already have it
-                        if len(inputs_img) < num_images_target:
-                            if record['img_data'] is None:
-                                img_arr = load_scaled_image_arr(record['image_path'], cfg)
-                                if img_arr is None:
-                                    break
-                                if aug:
-                                    img_arr = augment_image(img_arr)
-                                
-                                if cfg.CACHE_IMAGES:
-                                    record['img_data'] = img_arr
-                            else:
-                                img_arr = record['img_data']                  
-                                
-                            inputs_img.append(img_arr)
-
-                        if iRec >= iTargetOutput:
-                            vec_out.append(record['angle'])
-                            vec_out.append(record['throttle'])
-                        else:
-                            vec_in.append(0.0) #record['angle'])
-                            vec_in.append(0.0) #record['throttle'])
-                        
-                    label_vec = seq[iTargetOutput]['target_output']
-
-                    if look_ahead:
-                        label_vec = np.array(vec_out)
-
-                    labels.append(label_vec)
-
-                    b_inputs_img.append(inputs_img)
-                    b_vec_in.append(vec_in)
-
-                    b_labels.append(labels)
-
-                
-                if look_ahead:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.IMAGE_H, cfg.IMAGE_W, cfg.SEQUENCE_LENGTH)]
-                    X.append(np.array(b_vec_in))
-                    y = np.array(b_labels).reshape(batch_size, (cfg.SEQUENCE_LENGTH + 1) * 2)
-                else:
-                    X = [np.array(b_inputs_img).reshape(batch_size,\
-                        cfg.SEQUENCE_LENGTH, cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)]
-                    y = np.array(b_labels).reshape(batch_size, 2)
+            for offset in range(0, num_records - batch_size + 1, batch_size):
+                batch = dataset.get_batch(data[offset:offset+batch_size], image_cache, aug)
+                if batch is not None:
+                    yield batch
 
-                yield X, y
-
-    opt = { 'look_ahead' : look_ahead, 'cfg' : cfg }
-
-    train_gen = generator(train_data, opt)
-    val_gen = generator(val_data, opt)   
+    train_gen = generator(train_data)
+    val_gen = generator(val_data)   
+    gen_records = dict(enumerate(dataset.records))
 
     model_path = os.path.expanduser(model_name)
 
-    total_records = len(sequences)
+    total_records = len(dataset)
     total_train = len(train_data)
     total_val = len(val_data)
 
@@ -872,6 +1095,9 @@ def sequence_train(cfg, tub_names, model_name, transfer_model, model_type, conti
         raise Exception("Too little data to train. Please record more records.")
     
     go_train(kl, cfg, train_gen, val_gen, gen_records, model_name, steps_per_epoch, val_steps, continuous, verbose)
+
+    if image_cache is not None:
+        print('image cache:', image_cache)
     
     ''' 
     kl.train(train_gen, 
@@ -940,6 +1166,9 @@ def extract_data_from_pickles(cfg, tubs):
             with open(join(base_path, 'record_{}.json'.format(filename)), 'w') as f:
                 json.dump(data['val'], f)
 
+        if len(file_paths) > 0:
+            Tub(tub_path).rebuild_catalog()
+
 
 def prune_model(model, apoz_df, n_channels_delete):
     from kerassurgeon import Surgeon
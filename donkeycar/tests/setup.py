@@ -22,10 +22,15 @@ def tub(tub_path):
     t = create_sample_tub(tub_path, records=128)
     return t
 
-def create_sample_tub(path, records=128):
+@pytest.fixture
+def columnar_tub(tub_path):
+    t = create_sample_tub(tub_path, records=128, storage='columnar')
+    return t
+
+def create_sample_tub(path, records=128, storage='json'):
     inputs=['cam/image_array', 'user/angle', 'user/throttle']
     types=['image_array', 'float', 'float']
-    t = Tub(path, inputs=inputs, types=types)
+    t = Tub(path, inputs=inputs, types=types, storage=storage)
     cam = SquareBoxCamera()
     tel = MovingSquareTelemetry()
     for _ in range(records):
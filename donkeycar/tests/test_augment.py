@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from donkeycar.parts.augment import augment_batch, augment_batch_np, \
+    random_persp_coeffs, random_shadows
+
+
+def sample_batch(n=4, depth=3):
+    imgs = (np.random.RandomState(0).rand(n, 120, 160, depth) * 255).astype(np.uint8)
+    imgs[:, 40:80, 40:100] = 200
+    return imgs
+
+
+def test_augment_batch_shape():
+    imgs = sample_batch()
+    out = augment_batch(imgs, shadows=True, do_warp_persp=True)
+    assert out.shape == imgs.shape and out.dtype == np.uint8
+    gray = augment_batch(sample_batch(depth=1), shadows=True, do_warp_persp=True)
+    assert gray.shape == (4, 120, 160, 1)
+
+
+def test_augment_batch_seed():
+    imgs = sample_batch()
+    a = augment_batch(imgs, True, True, seed=7)
+    b = augment_batch(imgs, True, True, seed=np.random.RandomState(7))
+    assert np.array_equal(a, b)
+    assert not np.array_equal(a, augment_batch(imgs, True, True, seed=8))
+
+
+def test_augment_batch_matches_pil():
+    imgs = sample_batch()
+    factors = np.array([[1.5, 0.7, 1.2, 0.4]] * 4)
+    out = augment_batch_np(imgs, factors, None, None)
+    img = Image.fromarray(imgs[0])
+    for enhance, factor in zip([ImageEnhance.Brightness, ImageEnhance.Contrast,
+                                ImageEnhance.Sharpness, ImageEnhance.Color], factors[0]):
+        img = enhance(img).enhance(factor)
+    assert np.abs(np.array(img).astype(int) - out[0]).max() <= 4
+
+
+def test_augment_batch_np_warp():
+    imgs = sample_batch()
+    rng = np.random.RandomState(3)
+    coeffs = random_persp_coeffs(4, 160, 120, rng)
+    shade = random_shadows(4, 120, 160, rng)
+    out = augment_batch_np(imgs, np.ones((4, 4)), shade, coeffs)
+    assert out.shape == imgs.shape
+    assert out.max() <= imgs.max()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pytest
+
+from donkeycar.parts.codec import available_codecs, get_codec, benchmark_codec, PILCodec, PNGCodec, RawCodec
+from donkeycar.parts.datastore import Tub
+from donkeycar.parts.image import ImgArrToJpg
+
+
+def make_frame(h=120, w=160):
+    y, x = np.mgrid[0:h, 0:w]
+    return np.uint8(np.stack([x * 255 / w, y * 255 / h, np.full((h, w), 128)], axis=2))
+
+
+def test_codec_round_trip():
+    frame = make_frame()
+    for codec in available_codecs():
+        out = codec.decode(codec.encode(frame))
+        assert out.shape == frame.shape
+        assert out.dtype == np.uint8
+        if codec.ext == '.jpg':
+            assert np.abs(out.astype(int) - frame).mean() < 5
+        else:
+            assert np.array_equal(out, frame)
+
+
+def test_codec_settings():
+    frame = make_frame()
+    assert len(PILCodec(quality=30).encode(frame)) < len(PILCodec(quality=95).encode(frame))
+    assert len(PILCodec(subsampling='420').encode(frame)) < len(PILCodec(subsampling='444').encode(frame))
+    with pytest.raises(ValueError):
+        PILCodec(subsampling='411')
+    with pytest.raises(ValueError):
+        get_codec('gif')
+    assert get_codec('auto').ext == '.jpg'
+
+
+def test_benchmark_codec():
+    result = benchmark_codec(PILCodec(), [make_frame()] * 4, repeat=1)
+    assert result['codec'] == 'pil'
+    assert result['encode_ms'] > 0 and result['decode_ms'] > 0 and result['bytes'] > 0
+
+
+def test_img_arr_to_jpg():
+    data = ImgArrToJpg(codec=PNGCodec()).run(make_frame())
+    assert data[1:4] == b'PNG'
+    assert ImgArrToJpg().run(None) is None
+
+
+def test_tub_png_codec(tmpdir):
+    path = os.path.join(str(tmpdir), 'tub')
+    inputs, types = ['cam/image_array', 'user/angle'], ['image_array', 'float']
+    tub = Tub(path, inputs=inputs, types=types, codec=PNGCodec())
+    frame = make_frame()
+    ix = tub.put_record({'cam/image_array': frame, 'user/angle': 0.5})
+    assert os.path.exists(os.path.join(path, '%d_cam-image_array_.png' % ix))
+
+    tub = Tub(path)
+    assert tub.image_ext == '.png'
+    assert np.array_equal(tub.get_record(ix)['cam/image_array'], frame)
+    with pytest.raises(ValueError):
+        Tub(path, codec=PILCodec())
+    with pytest.raises(ValueError):
+        Tub(os.path.join(str(tmpdir), 'raw'), inputs=inputs, types=types, codec=RawCodec())
+    assert not os.path.exists(os.path.join(str(tmpdir), 'raw'))
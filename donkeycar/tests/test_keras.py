@@ -56,3 +56,102 @@ def test_3dconv():
     assert km.model is not None
     img = get_test_img(km.model)
     km.run(img)
+
+def test_inference_backends():
+    km = KerasCategorical()
+    img = get_test_img(km.model)
+    expected = km.run(img)
+    assert km.profile_timings()['inference'] > 0
+    assert km.profile_timings() == {}
+
+    km.set_backend('function')
+    assert np.allclose(km.run(img), expected, atol=1e-4)
+    assert isinstance(km.backend, FunctionBackend)
+
+    km.set_backend('tflite', 'float16')
+    assert np.allclose(km.run(img), expected, atol=0.05)
+
+    with pytest.raises(ValueError):
+        km.set_backend('function', 'int8')
+    with pytest.raises(ValueError):
+        km.set_backend('onnx')
+
+def test_function_backend_single_output():
+    km = KerasRNN_LSTM()
+    img = get_test_img(km.model)
+    expected = km.run(img)
+    km.set_backend('function')
+    assert np.allclose(km.run(img), expected, atol=1e-4)
+
+def test_tflite_pilot(tmpdir):
+    import donkeycar.templates.config_defaults as defaults
+    from donkeycar.config import Config
+    from donkeycar.management.base import ConvertModel
+    from donkeycar.parts.tflite import TFLiteCategorical
+    cfg = Config()
+    cfg.from_object(defaults)
+    km = get_model_by_type('categorical', cfg)
+    model_path = str(tmpdir.join('pilot.h5'))
+    out_path = str(tmpdir.join('pilot.tflite'))
+    km.model.save(model_path)
+
+    result = ConvertModel().convert(cfg, model_path, out_path, samples=5)
+    assert max(result['max_delta']) < 1e-3
+    tl = get_model_by_type('tflite_categorical', cfg)
+    assert isinstance(tl, TFLiteCategorical)
+    tl.load(out_path)
+    img = get_test_img(km.model)
+    assert np.allclose(tl.run(img), km.run(img), atol=1e-3)
+    assert tl.profile_timings()['inference'] > 0
+
+def test_tflite_output_order(tmpdir):
+    """ steering and throttle come back in the Keras model's order """
+    pytest.importorskip('tensorflow')
+    from donkeycar.parts.tflite import TFLiteRunner, TFLiteLinear, keras_model_to_tflite, OUTPUT_NAME
+    km = KerasLinear()
+    for name, bias in [('n_outputs0', 0.5), ('n_outputs1', -0.25)]:
+        layer = km.model.get_layer(name)
+        kernel, _ = layer.get_weights()
+        layer.set_weights([np.zeros_like(kernel), np.full((1,), bias, dtype=np.float32)])
+    out_path = str(tmpdir.join('linear.tflite'))
+    with open(out_path, 'wb') as fp:
+        fp.write(keras_model_to_tflite(km.model))
+
+    tl = TFLiteLinear()
+    tl.load(out_path)
+    assert [d['name'] for d in tl.runner.output_details] == [OUTPUT_NAME % 0, OUTPUT_NAME % 1]
+    angle, throttle = tl.run(get_test_img(km.model))
+    assert np.isclose(angle, 0.5) and np.isclose(throttle, -0.25)
+
+    details = tl.runner.output_details
+    assert TFLiteRunner.order_outputs(details[::-1]) == details
+
+def test_saliency_engine():
+    import tensorflow as tf
+    from donkeycar.parts.salient import SaliencyEngine, SalientVis
+    km = KerasCategorical()
+    engine = SaliencyEngine(km.model)
+    imgs = np.random.randint(0, 255, (3, 120, 160, 3)).astype(np.uint8)
+    masks = engine.masks(imgs)
+    assert masks.shape == (3, 120, 160)
+    assert masks.min() >= 0 and masks.max() <= 1
+
+    num_ops = len(tf.get_default_graph().get_operations())
+    overlay = engine.overlay(imgs)
+    assert overlay.shape == imgs.shape and overlay.dtype == np.uint8
+    assert len(tf.get_default_graph().get_operations()) == num_ops
+
+    vis = SalientVis(km)
+    assert vis.run(imgs[0]).shape == imgs[0].shape
+    assert np.allclose(vis.compute_visualisation_mask(imgs[1]), masks[1], atol=1e-5)
+
+    cropped = SaliencyEngine(default_categorical(roi_crop=(20, 10)))
+    assert cropped.masks(imgs).shape == (3, 120, 160)
+
+def test_run_batch():
+    imgs = np.random.randint(0, 255, (4, 120, 160, 3)).astype(np.uint8)
+    for km in (KerasCategorical(), KerasLinear()):
+        angles, throttles = km.run_batch(imgs)
+        for img, angle, throttle in zip(imgs, angles, throttles):
+            expected = km.run(img)
+            assert np.allclose((angle, throttle), expected, atol=1e-4)
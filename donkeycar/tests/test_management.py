@@ -1,4 +1,5 @@
 
+import pytest
 from donkeycar.management import base
 from tempfile import tempdir
 
@@ -6,4 +7,99 @@ def get_test_tub_path():
     tempdir()
 
 def test_tubcheck():
-    tc = base.TubCheck()
\ No newline at end of file
+    tc = base.TubCheck()
+
+def test_bench_tub_and_train():
+    from donkeycar.management.bench import Bench, load_bench_config, flatten
+    cfg = load_bench_config('/nonexistent/config.py')
+    cfg.BATCH_SIZE = 8
+    report = Bench().bench(cfg, ['tub', 'train'], records=20, batches=1)
+    results = report['results']
+    assert set(results.keys()) == {'tub', 'train'}
+    assert results['tub']['json']['tubgroup_records'] == 40
+    assert results['train']['plain']['samples_per_sec'] > 0
+    assert all(isinstance(v, (int, float)) for v in flatten(results).values())
+
+def test_movie_renderer(tmpdir):
+    from moviepy.editor import VideoFileClip
+    from donkeycar.parts.keras import KerasCategorical
+    from donkeycar.parts.salient import SaliencyEngine
+    from donkeycar.management.makemovie import MovieRenderer
+    from donkeycar.tests.setup import create_sample_tub
+    tub = create_sample_tub(str(tmpdir.join('tub')), records=30)
+    kl = KerasCategorical()
+    renderer = MovieRenderer(tub, kl, SaliencyEngine(kl.model), start=5, end=24, batch_size=8, workers=2)
+    assert len(renderer) == 20
+
+    out = str(tmpdir.join('movie.mp4'))
+    assert renderer.render(out, fps=20, scale=2) == 20
+    clip = VideoFileClip(out)
+    assert tuple(clip.size) == (320, 240)
+    clip.close()
+
+    assert MovieRenderer(tub).render(str(tmpdir.join('plain.mp4')), fps=20, size=(100, 75)) == 30
+
+
+def test_movie_renderer_roi_crop_at_load(tmpdir):
+    from donkeycar.management.bench import load_bench_config
+    from donkeycar.management.makemovie import MovieRenderer, model_crop
+    from donkeycar.parts.salient import SaliencyEngine
+    from donkeycar.tests.setup import create_sample_tub
+    from donkeycar.utils import get_model_by_type
+    import numpy as np
+    cfg = load_bench_config('/nonexistent/config.py')
+    cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM, cfg.ROI_CROP_AT_LOAD = 20, 10, True
+    tub = create_sample_tub(str(tmpdir.join('tub')), records=10)
+    kl = get_model_by_type('categorical', cfg)
+    assert kl.model.input_shape[1] == 90
+    renderer = MovieRenderer(tub, kl, SaliencyEngine(kl.model), batch_size=4, workers=2, crop=model_crop(cfg))
+    assert renderer.render(str(tmpdir.join('movie.mp4')), fps=20, scale=1) == 10
+
+    #no saliency in the rows cut off.
+    engine = SaliencyEngine(kl.model)
+    renderer = MovieRenderer(tub, None, engine, crop=model_crop(cfg))
+    records, imgs = renderer.load_batch(renderer.ixs[:2])
+    frames = renderer.draw_batch(records, imgs)
+    assert frames.shape == imgs.shape
+    assert np.array_equal(frames[:, :20], engine.overlay(imgs, np.zeros(imgs.shape[:3]))[:, :20])
+
+def test_evaluate(tmpdir):
+    from donkeycar.management.bench import load_bench_config
+    from donkeycar.management.evaluate import Evaluate, bin_index
+    from donkeycar.parts.keras import KerasCategorical, KerasLinear
+    from donkeycar.tests.setup import create_sample_tub
+    from donkeycar.utils import linear_bin
+    import numpy as np
+    angles = np.linspace(-1, 1, 41)
+    assert list(bin_index(angles, 15, 1, 2.0)) == [np.argmax(linear_bin(a)) for a in angles]
+
+    cfg = load_bench_config('/nonexistent/config.py')
+    tub_a = create_sample_tub(str(tmpdir.join('tub_a')), records=20)
+    create_sample_tub(str(tmpdir.join('tub_b')), records=15)
+    tub_a.exclude_index(3)
+    tub_a.write_exclude()
+    KerasCategorical().model.save(str(tmpdir.join('cat.h5')))
+    KerasLinear().model.save(str(tmpdir.join('lin.h5')))
+
+    report = Evaluate().evaluate(cfg, [str(tmpdir.join('tub_a')), str(tmpdir.join('tub_b'))],
+                                 [str(tmpdir.join('cat.h5')), str(tmpdir.join('lin.h5'))],
+                                 ['categorical', 'linear'], batch_size=8, workers=2)
+    results = report['results']
+    assert results['stats']['records'] == 34
+    assert list(results['models'].keys()) == ['cat.h5', 'lin.h5']
+    for metrics in results['models'].values():
+        assert sum(metrics['angle']['bin_counts']) == 34
+        assert 0 <= metrics['throttle']['bin_accuracy'] <= 1
+        assert metrics['angle']['rmse'] >= metrics['angle']['mae']
+        assert metrics['frames_per_sec'] > 0
+
+    for model_type in ['imu', 'rnn']:
+        with pytest.raises(ValueError):
+            Evaluate().evaluate(cfg, [str(tmpdir.join('tub_a'))], [str(tmpdir.join('cat.h5'))], [model_type])
+
+
+def test_commands_are_base_commands():
+    from donkeycar.management.command import BaseCommand
+    assert base.BaseCommand is BaseCommand
+    for cmd in [base.Bench, base.MakeMovie, base.Evaluate, base.CreateCar]:
+        assert issubclass(cmd, BaseCommand)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from donkeycar.memory import Memory, FrameBuffer
+
+
+def test_memory_put_get():
+    mem = Memory()
+    mem.put(['a', 'b'], (1, 2))
+    mem.put(['c'], 3)
+    assert mem.get(['a', 'b', 'c', 'missing']) == [1, 2, 3, None]
+    assert mem['a'] == 1
+
+
+def test_memory_buffered_channel():
+    mem = Memory()
+    buf = mem.add_buffer('cam/image_array', depth=3)
+    assert mem.get(['cam/image_array']) == [None]
+
+    frame = np.full((120, 160, 3), 1, dtype=np.uint8)
+    mem.put(['cam/image_array'], frame)
+    first = mem.get(['cam/image_array'])[0]
+    assert np.array_equal(first, frame)
+    assert first is not frame
+    slots = buf.slots
+
+    #the frame a part read is left alone by the next put
+    mem.put(['cam/image_array'], np.full((120, 160, 3), 2, dtype=np.uint8))
+    assert first.max() == 1
+    assert mem['cam/image_array'].max() == 2
+    assert buf.slots is slots
+
+    value, seq, stamp = mem.get_stamped('cam/image_array')
+    assert seq == 2 == mem.seq('cam/image_array')
+    assert stamp is not None
+    assert 'cam/image_array' in mem.keys()
+
+
+def test_frame_buffer_reallocates():
+    buf = FrameBuffer((2, 2), np.uint8, depth=2)
+    buf.put(np.ones((3, 3), dtype=np.float32))
+    assert buf.get().shape == (3, 3) and buf.get().dtype == np.float32
+    buf.put(None)
+    assert buf.get() is None
+    with pytest.raises(ValueError):
+        FrameBuffer(depth=1)
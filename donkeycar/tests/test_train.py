@@ -1,13 +1,14 @@
 # -*- coding: utf-8 -*- #
 import pytest
 import os
+import numpy as np
 
-from donkeycar.templates.train import multi_train
+from donkeycar.templates.train import multi_train, collate_records, TubSequence
 from donkeycar.parts.datastore import Tub
 from donkeycar.parts.simulation import SquareBoxCamera, MovingSquareTelemetry
 
 #fixtures
-from .setup import tub, tub_path, on_pi
+from .setup import tub, tub_path, on_pi, columnar_tub
 
 @pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
 def test_train_cat(tub, tub_path):
@@ -53,6 +54,114 @@ def test_train_linear(tub, tub_path):
     aug = False
     multi_train(cfg, tub, model, transfer, model_type, continuous, aug)
 
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_train_columnar(columnar_tub, tub_path):
+    import donkeycar.templates.config_defaults as cfg
+    tempfolder = tub_path[:-3]
+    model_path = os.path.join(tempfolder, 'test.h5')
+    cfg.MAX_EPOCHS = 1
+    cfg.BATCH_SIZE = 10
+    cfg.SHOW_PLOT = False
+    cfg.VEBOSE_TRAIN = False
+    cfg.OPTIMIZER = "adam"
+
+    multi_train(cfg, tub_path, model_path, None, "linear", False, False)
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_train_image_pack(tub, tub_path):
+    import donkeycar.templates.config_defaults as cfg
+    tempfolder = tub_path[:-3]
+    model_path = os.path.join(tempfolder, 'test.h5')
+    cfg.MAX_EPOCHS = 1
+    cfg.BATCH_SIZE = 10
+    cfg.SHOW_PLOT = False
+    cfg.VEBOSE_TRAIN = False
+    cfg.OPTIMIZER = "adam"
+
+    tub.pack_images(cfg)
+    multi_train(cfg, tub_path, model_path, None, "linear", False, False)
+
+def test_collate_continuous_no_catalog(tub_path):
+    """ continuous polls read a tub without building a catalog in it """
+    import shutil
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.parts.datastore import RecordWatcher
+    from .setup import create_sample_tub
+    t = create_sample_tub(tub_path, records=5)
+    os.remove(t.catalog_path)
+    c = create_sample_tub(tub_path + '_columnar', records=3, storage='columnar')
+    watcher = RecordWatcher(cfg, tub_path + '*', use_inotify=False)
+    watcher.SETTLE_SECONDS = 0
+    opts = { 'cfg' : cfg, 'categorical' : False }
+    gen_records = {}
+
+    added, _ = watcher.poll()
+    collate_records(added, gen_records, opts)
+    assert len(gen_records) == 8
+    readers = opts['tub_readers']
+
+    #rsync brings a new record over, the columnar writer appends one.
+    shutil.copy(os.path.join(t.path, 'record_1.json'), os.path.join(t.path, 'record_6.json'))
+    c.put_record({'cam/image_array': np.zeros((120, 160, 3), dtype=np.uint8),
+                  'user/angle': 0.1, 'user/throttle': 0.2})
+    added, _ = watcher.poll()
+    collate_records(added, gen_records, opts)
+    assert len(gen_records) == 10
+    assert opts['tub_readers'] is readers and len(readers) == 2
+    assert not os.path.exists(t.catalog_path)
+    watcher.close()
+
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_tub_sequence(tub, tub_path):
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.parts.keras import KerasLinear
+    kl = KerasLinear()
+    opts = { 'cfg' : cfg, 'categorical' : False }
+    gen_records = {}
+    collate_records(tub.gather_records(), gen_records, opts)
+
+    seq = TubSequence(gen_records, kl, cfg, 10, True)
+    num_train = len([r for r in gen_records.values() if r['train']])
+    assert len(seq) == num_train // 10
+
+    X, y = seq[0]
+    assert X[0].shape == (10, cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+    assert len(y) == 2 and y[0].shape == (10,)
+
+    keys = list(seq.keys)
+    seq.on_epoch_end()
+    assert sorted(seq.keys) == sorted(keys)
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_tub_sequence_missing_images(tub, tub_path):
+    """ a batch whose images are all missing is filled from other records """
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.parts.keras import KerasLinear
+    kl = KerasLinear()
+    opts = { 'cfg' : cfg, 'categorical' : False }
+    gen_records = {}
+    collate_records(tub.gather_records(), gen_records, opts)
+
+    seq = TubSequence(gen_records, kl, cfg, 10, True)
+    missing = seq.keys[:10]
+    for key in missing:
+        os.remove(gen_records[key]['image_path'])
+
+    X, y = seq[0]
+    assert X[0].shape == (10, cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+    assert y[0].shape == (10,)
+    assert seq.failed == set(missing)
+    assert not any(key in gen_records for key in missing)
+    seq.on_epoch_end()
+    assert not set(missing) & set(seq.keys)
+
+    for key in seq.keys:
+        os.remove(gen_records[key]['image_path'])
+    with pytest.raises(ValueError):
+        seq[0]
+
+
 '''
 
 latent test requires opencv right now. and fails on travis ci. 
@@ -102,4 +211,78 @@ def test_train_seq(tub, tub_path):
     continuous = False
     aug = True
     multi_train(cfg, tub, model, transfer, model_type, continuous, aug)
-    
\ No newline at end of file
+    
+
+def test_balanced_sampler():
+    from donkeycar.templates.train import BalancedSampler
+    #90 straight records, 10 full left turns
+    records = [{'json_data': {'user/angle': 0.0, 'user/throttle': 0.3}} for _ in range(90)] + \
+              [{'json_data': {'user/angle': -1.0, 'user/throttle': 0.3}} for _ in range(10)]
+
+    sampler = BalancedSampler(records, seed=0)
+    epoch = sampler.epoch()
+    assert len(epoch) == 100
+    turns = np.count_nonzero(epoch >= 90)
+    assert 35 < turns < 65
+
+    sampler = BalancedSampler(records, cap=20, seed=0)
+    epoch = sampler.epoch()
+    assert sampler.epoch_size() == len(epoch) == 30
+    assert np.count_nonzero(epoch >= 90) == 10
+    assert len(set(epoch.tolist())) == 30
+
+    weights = np.ones(15)
+    weights[0] = 0.5
+    sampler = BalancedSampler(records, weights=weights, cap=20, seed=0)
+    assert np.count_nonzero(sampler.epoch() >= 90) == 10
+
+    with pytest.raises(ValueError):
+        BalancedSampler(records, weights=[1, 1])
+
+
+@pytest.mark.skipif(on_pi() == True, reason='Too slow on RPi')
+def test_tub_sequence_balanced(tub, tub_path):
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.parts.keras import KerasLinear
+    kl = KerasLinear()
+    opts = { 'cfg' : cfg, 'categorical' : False }
+    gen_records = {}
+    collate_records(tub.gather_records(), gen_records, opts)
+
+    seq = TubSequence(gen_records, kl, cfg, 10, True, balance=True)
+    num_train = len([r for r in gen_records.values() if r['train']])
+    assert seq.sampler.n == num_train
+    assert len(seq) == num_train // 10
+    assert set(seq.keys) <= set(seq.set_keys)
+
+
+def test_sequence_dataset(tub):
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.templates.train import SequenceDataset
+    tub.erase_record(50)
+    num_records = tub.get_num_records()
+
+    dataset = SequenceDataset([tub], cfg, 3)
+    assert len(dataset.records) == num_records
+    #a window can't span the gap left by record 50.
+    assert len(dataset) == num_records - 2 * 2
+    for start in dataset.starts:
+        ixs = [dataset.records[start + i]['index'] for i in range(3)]
+        assert ixs == list(range(ixs[0], ixs[0] + 3))
+
+    X, y = dataset.get_batch(dataset.starts[:4])
+    assert X[0].shape == (4, 3, cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+    assert y.shape == (4, 2)
+    last = dataset.records[dataset.starts[1] + 2]
+    assert y[1][0] == np.float32(tub.get_json_record(last['index'])['user/angle'])
+
+    from donkeycar.config import Config
+    mono = Config()
+    mono.from_object(cfg)
+    mono.IMAGE_DEPTH = 1
+    dataset = SequenceDataset([tub], mono, 4, look_ahead=True)
+    X, y = dataset.get_batch(dataset.starts[:2])
+    assert X[0].shape == (2, cfg.IMAGE_H, cfg.IMAGE_W, 2)
+    assert X[1].shape == (2, 2)
+    assert y.shape == (2, 6)
+    assert y[0][2] == dataset.angles[dataset.starts[0] + 2]
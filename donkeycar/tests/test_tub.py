@@ -2,13 +2,14 @@
 import tempfile
 import unittest
 from donkeycar.parts.datastore import TubWriter, Tub
-from donkeycar.parts.datastore import TubHandler
+from donkeycar.parts.datastore import TubHandler, ImageCache, TubImageStacker
 import os
 
+import numpy as np
 import pytest
 
 #fixtures
-from .setup import tub, tub_path
+from .setup import tub, tub_path, columnar_tub
 
 
 def test_tub_load(tub, tub_path):
@@ -108,3 +109,359 @@ class TestTubWriter(unittest.TestCase):
         assert t2.meta['inputs'] == self.inputs
         assert t2.meta['location'] == "Here2"
 
+
+
+def test_tub_catalog(tub, tub_path):
+    """ The catalog tracks records as they are written and removed """
+    assert tub.get_num_records() == 128
+    assert tub.get_index(shuffled=False) == list(range(1, 129))
+    assert tub.get_last_ix() == 128
+
+    tub.remove_record(5)
+    tub.remove_record(128)
+    tub.remove_record(127)
+    assert tub.get_num_records() == 125
+    assert 5 not in tub.get_index(shuffled=False)
+    assert tub.get_last_ix() == 126
+
+    # a fresh Tub reads the same index back from catalog.bin
+    t2 = Tub(tub_path)
+    assert t2.get_index(shuffled=False) == tub.get_index(shuffled=False)
+    assert t2.get_last_ix() == tub.get_last_ix()
+
+
+def test_tub_catalog_rebuild(tub, tub_path):
+    """ Tubs without a catalog get one built from their record files """
+    index = tub.get_index(shuffled=False)
+    os.unlink(tub.catalog_path)
+    t2 = Tub(tub_path)
+    assert os.path.exists(t2.catalog_path)
+    assert t2.get_index(shuffled=False) == index
+    assert t2.catalog.get(index[-1])['ms'] == tub.get_json_record(index[-1])['milliseconds']
+
+
+def test_tub_catalog_rebuild_read_only(tub, tub_path, monkeypatch):
+    """ A tub whose catalog can't be written still indexes its records """
+    import donkeycar.parts.datastore as datastore
+    index = tub.get_index(shuffled=False)
+    os.unlink(tub.catalog_path)
+
+    def read_only(src, dst):
+        raise PermissionError('read-only file system')
+    monkeypatch.setattr(datastore.os, 'replace', read_only)
+    t2 = Tub(tub_path)
+    assert not os.path.exists(t2.catalog_path)
+    assert not os.path.exists(t2.catalog_path + '.tmp')
+    assert t2.get_num_records() == len(index)
+    assert t2.get_index(shuffled=False) == index
+
+
+def test_tub_get_columns_missing(tub):
+    """ Asking for records the tub doesn't hold raises KeyError """
+    cols = tub.get_columns(['user/angle'], ixs=[3, 1])
+    assert list(cols['user/angle']) == [tub.get_json_record(3)['user/angle'], tub.get_json_record(1)['user/angle']]
+    tub.remove_record(5)
+    with pytest.raises(KeyError):
+        tub.get_columns(['user/angle'], ixs=[4, 5])
+    with pytest.raises(KeyError):
+        tub.get_columns(['user/angle'], ixs=[1000])
+
+
+def test_tub_catalog_exclude(tub, tub_path):
+    """ Excluded records are flagged in the catalog """
+    tub.exclude_index(2)
+    tub.write_exclude()
+    os.unlink(tub.exclude_path)
+    t2 = Tub(tub_path)
+    assert t2.exclude == {2}
+    assert 2 not in [int(os.path.basename(f).split('_')[1].split('.')[0]) for f in t2.gather_records()]
+
+
+def test_columnar_tub(columnar_tub, tub_path):
+    """ A columnar tub stores no json records but reads back the same way """
+    import glob
+    assert glob.glob(os.path.join(tub_path, 'record_*.json')) == []
+    t2 = Tub(tub_path)
+    assert t2.store is not None
+    assert t2.get_num_records() == 128
+    rec = t2.get_record(1)
+    assert rec['cam/image_array'].shape == (120, 160, 3)
+    assert type(rec['user/angle']) == float
+    assert len(t2.gather_records()) == 128
+    assert len(t2.get_df()) == 128
+
+    cols = t2.get_columns(['user/angle'])
+    assert cols['user/angle'].dtype == np.float64
+    assert cols['user/angle'][0] == rec['user/angle']
+
+
+def test_columnar_tub_types(tub_path):
+    """ Columnar tubs handle str, int, boolean and vector channels """
+    inputs = ['user/mode', 'behavior/state', 'recording', 'behavior/one_hot_state_array', 'user/angle']
+    types = ['str', 'int', 'boolean', 'vector', 'float']
+    t = Tub(tub_path, inputs=inputs, types=types, storage='columnar')
+    ix = t.put_record({'user/mode': 'local_angle', 'behavior/state': 2, 'recording': True,
+                       'behavior/one_hot_state_array': [0.0, 1.0], 'user/angle': None})
+    rec = Tub(tub_path).get_record(ix)
+    assert rec['user/mode'] == 'local_angle'
+    assert rec['behavior/state'] == 2
+    assert rec['recording'] is True
+    assert rec['behavior/one_hot_state_array'] == [0.0, 1.0]
+    assert rec['user/angle'] is None
+
+    t.update_record(ix, 'user/angle', 0.5)
+    assert Tub(tub_path).get_record(ix)['user/angle'] == 0.5
+
+
+def test_columnar_tub_row_count(tub_path, monkeypatch):
+    """ Appending keeps a row count instead of statting segments, long strings are cut """
+    from donkeycar.parts.datastore import TubColumnStore
+    t = Tub(tub_path, inputs=['user/mode', 'user/angle'], types=['str', 'float'], storage='columnar')
+    t.put_record({'user/mode': 'user', 'user/angle': 0.1})
+
+    def no_stat(segment):
+        raise AssertionError('segment files were statted')
+    monkeypatch.setattr(t.store, 'segment_rows', no_stat)
+    ix = t.put_record({'user/mode': 'é' * 40, 'user/angle': 0.2})
+    assert len(t.store) == 2
+    monkeypatch.undo()
+
+    assert len(TubColumnStore(tub_path)) == 2
+    mode = Tub(tub_path).get_record(ix)['user/mode']
+    assert mode == 'é' * 16
+
+
+def test_columnar_tub_rebuild(columnar_tub, tub_path):
+    """ The catalog of a columnar tub can be rebuilt from its rows """
+    columnar_tub.erase_record(10)
+    index = columnar_tub.get_index(shuffled=False)
+    os.unlink(columnar_tub.catalog_path)
+    t2 = Tub(tub_path)
+    assert t2.get_index(shuffled=False) == index
+    assert t2.get_record(11)['user/angle'] == columnar_tub.get_record(11)['user/angle']
+
+
+def test_record_sampler():
+    """ The sampler sees every record once per shuffled epoch, repeatably """
+    from donkeycar.parts.datastore import RecordSampler
+    it = iter(RecordSampler(10, seed=1))
+    first = [next(it) for _ in range(10)]
+    second = [next(it) for _ in range(10)]
+    assert sorted(first) == sorted(second) == list(range(10))
+    assert first != second
+    it2 = iter(RecordSampler(10, seed=1))
+    assert [next(it2) for _ in range(10)] == first
+
+    it = iter(RecordSampler(3, shuffle=False))
+    assert [next(it) for _ in range(6)] == [0, 1, 2, 0, 1, 2]
+
+    it = iter(RecordSampler(4, weights=[0, 0, 1, 3], seed=0))
+    drawn = [next(it) for _ in range(400)]
+    assert set(drawn) == {2, 3}
+    assert drawn.count(3) > 2 * drawn.count(2)
+
+    with pytest.raises(ValueError):
+        RecordSampler(3, weights=[1, 1])
+
+
+def test_tub_record_gen(tub):
+    """ Tub record generators draw records without replacement per epoch """
+    tub.update_df()
+    gen = tub.get_record_gen(keys=['user/angle'], seed=0)
+    angles = [next(gen)['user/angle'] for _ in range(128)]
+    assert sorted(angles) == sorted(tub.df['user/angle'].tolist())
+    assert type(angles[0]) == float
+    gen = tub.get_record_gen(keys=['user/angle'], seed=0)
+    assert next(gen)['user/angle'] == angles[0]
+
+
+def test_tub_group(tub_path):
+    """ A TubGroup reads records and columns of its tubs without a DataFrame """
+    from donkeycar.parts.datastore import TubGroup
+    from .setup import create_sample_tub
+    t1 = create_sample_tub(tub_path + '_1', records=10)
+    t2 = create_sample_tub(tub_path + '_2', records=5, storage='columnar')
+    tg = TubGroup(','.join([t1.path, t2.path]))
+    assert tg._df is None
+    assert tg.get_num_records() == 15
+
+    cols = tg.get_columns(['user/angle', 'milliseconds'], positions=[12, 3])
+    assert cols['user/angle'][0] == t2.get_record(t2.get_index(shuffled=False)[2])['user/angle']
+    assert cols['user/angle'][1] == t1.get_record(t1.get_index(shuffled=False)[3])['user/angle']
+    assert tg._df is None
+
+    recs = list(tg.iter_records(tg.sample(4, random_state=0), keys=['cam/image_array', 'user/angle']))
+    assert len(recs) == 4
+    assert set(recs[0].keys()) == {'cam/image_array', 'user/angle'}
+    assert recs[0]['cam/image_array'].shape == (120, 160, 3)
+
+    train_gen, val_gen = tg.get_train_val_gen(['cam/image_array'], ['user/angle'], batch_size=4)
+    X, Y = next(train_gen)
+    assert X[0].shape == (4, 120, 160, 3)
+    assert Y[0].shape == (4,)
+    assert len(tg.df) == 15
+
+
+def test_tub_group_df_and_positions(tub_path):
+    """ df is a DataFrame of records, positions picks records of the group """
+    from donkeycar.parts.datastore import Tub, TubGroup
+    from .setup import create_sample_tub
+    t1 = create_sample_tub(tub_path + '_1', records=10)
+    t2 = create_sample_tub(tub_path + '_2', records=5)
+    tg = TubGroup(','.join([t1.path, t2.path]))
+    assert not isinstance(tg, Tub)
+    angles = tg.get_columns(['user/angle'])['user/angle']
+
+    gen = tg.get_record_gen(keys=['user/angle'], shuffle=False, positions=[12, 3])
+    assert [next(gen)['user/angle'] for _ in range(4)] == [angles[12], angles[3]] * 2
+
+    df = tg.get_df().iloc[[12, 3]]
+    gen = tg.get_record_gen(keys=['user/angle'], shuffle=False, df=df)
+    assert [next(gen)['user/angle'] for _ in range(2)] == [angles[12], angles[3]]
+
+    batch = next(tg.get_batch_gen(None, batch_size=2, shuffle=False, df=df))
+    assert set(batch.keys()) == set(df.columns)
+    assert batch['cam/image_array'].shape == (2, 120, 160, 3)
+
+    gen = t1.get_record_gen(keys=['user/angle'], shuffle=False, positions=[4])
+    assert next(gen)['user/angle'] == t1.get_df()['user/angle'].iloc[4]
+
+
+def test_tub_image_pack(tub):
+    """ Packed images match the decoded and scaled jpgs """
+    import donkeycar.templates.config_defaults as cfg
+    from donkeycar.utils import load_scaled_image_arr
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = 160, 120, 3
+    assert tub.get_image_pack(cfg) is None
+    tub.pack_images(cfg)
+    pack = tub.get_image_pack(cfg)
+    assert len(pack) == 128
+    assert isinstance(pack.images, np.memmap)
+    img = load_scaled_image_arr(tub.get_json_record(7)['cam/image_array'], cfg)
+    assert np.array_equal(pack.get(7), img)
+    assert pack.get_batch([3, 7, 9]).shape == (3, 120, 160, 3)
+    assert pack.get(1000) is None
+    assert list(pack.rows([0, 7, 1000])) == [-1, 6, -1]
+    with pytest.raises(KeyError):
+        pack.get_batch([7, 1000])
+
+
+def test_image_cache(tub):
+    """ The image cache stays within its budget and drops the least recently used """
+    from PIL import Image
+    paths = [tub.get_json_record(ix)['cam/image_array'] for ix in range(1, 6)]
+    load = lambda f: np.array(Image.open(f))
+    size = load(paths[0]).nbytes
+    cache = ImageCache(size * 3)
+    for path in paths[:3]:
+        cache.get(path, load)
+    assert np.array_equal(cache.get(paths[0], load), load(paths[0]))
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.get(paths[3], load)
+    assert len(cache) == 3 and cache.nbytes <= size * 3
+    assert paths[1] not in cache and paths[0] in cache
+    assert cache.evictions == 1
+
+    compressed = ImageCache(size, compressed=True)
+    for path in paths:
+        compressed.get(path, load)
+    assert len(compressed) == 5
+    assert np.array_equal(compressed.get(paths[4], load), load(paths[4]))
+    assert compressed.hits == 1
+
+
+def test_tub_image_stacker_cache(tub_path, tub):
+    """ The image stacker reads each image once through its cache """
+    cache = ImageCache(64 * 1024 * 1024)
+    stacker = TubImageStacker(tub_path, image_cache=cache)
+    plain = TubImageStacker(tub_path)
+    for ix in range(3, 6):
+        rec = stacker.get_record(ix)
+        assert np.array_equal(rec['cam/image_array'], plain.get_record(ix)['cam/image_array'])
+    assert cache.misses == 5
+
+
+def test_tub_writer_background(tub_path):
+    """ The background writer writes every accepted record by shutdown """
+    inputs = ['cam/image_array', 'user/angle']
+    types = ['image_array', 'float']
+    tub = TubWriter(tub_path, inputs=inputs, types=types, background=True, queue_size=8, sync_every=5, block=True)
+    img = np.zeros((120, 160, 3), dtype=np.uint8)
+    counts = []
+    for i in range(20):
+        img[:] = i
+        counts.append(tub.run(img, i / 10.0))
+    assert counts == list(range(1, 21))
+    tub.flush()
+    assert tub.get_num_records() == 20
+    assert tub.get_json_record(20)['user/angle'] == 1.9
+    tub.erase_last_n_records(2)
+    assert tub.run(img, 0.0) == tub.current_ix + 1
+    tub.shutdown()
+    t2 = Tub(tub_path)
+    assert t2.get_num_records() == tub.get_num_records()
+    #each queued record kept its own copy of the image
+    assert t2.get_record(5)['cam/image_array'].mean() == pytest.approx(4, abs=1)
+
+
+def test_tub_writer_back_pressure(tub_path):
+    """ A full queue drops records and counts them """
+    tub = TubWriter(tub_path, inputs=['user/angle'], types=['float'], background=True, queue_size=2)
+    with tub.write_lock:
+        #hold up the worker, so the queue fills
+        for i in range(10):
+            tub.run(float(i))
+        assert tub.dropped > 0
+        assert tub.accepted + tub.dropped == 10
+    tub.shutdown()
+    assert tub.get_num_records() == tub.accepted
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_tub_writer_capture_time(tub_path, background):
+    """ Records are stamped when run is called, not when they are written """
+    import time
+    tub = TubWriter(tub_path, inputs=['user/angle'], types=['float'], background=background)
+    with tub.write_lock:
+        before = int((time.time() - tub.start_time) * 1000)
+        assert tub.run(0.5) == 1
+        time.sleep(0.3)
+    assert tub.run(0.6) == 2
+    tub.shutdown()
+    ms = Tub(tub_path).get_json_record(1)['milliseconds']
+    assert before <= ms < before + 200
+    assert Tub(tub_path).catalog.get(1)['ms'] == ms
+
+
+@pytest.mark.parametrize('use_inotify', [False, True])
+def test_record_watcher(tub_path, use_inotify):
+    """ The watcher reports the records added and removed since the last poll """
+    from donkeycar.parts.datastore import RecordWatcher
+    from .setup import create_sample_tub
+    t = create_sample_tub(tub_path, records=10)
+    watcher = RecordWatcher(None, tub_path + '*', use_inotify=use_inotify)
+    if use_inotify and watcher.inotify is None:
+        pytest.skip('inotify is not available')
+    #don't wait for the file system timestamps to settle.
+    watcher.SETTLE_SECONDS = 0
+
+    added, removed = watcher.poll()
+    assert len(added) == 10 and removed == []
+    assert sorted(added) == sorted(os.path.abspath(p) for p in t.gather_records())
+    assert watcher.poll() == ([], [])
+
+    ix = t.put_record({'cam/image_array': np.zeros((120, 160, 3), dtype=np.uint8),
+                       'user/angle': 0.1, 'user/throttle': 0.2})
+    t.erase_record(3)
+    added, removed = watcher.poll()
+    assert added == [RecordWatcher.record_path(os.path.abspath(tub_path), ix)]
+    assert removed == [RecordWatcher.record_path(os.path.abspath(tub_path), 3)]
+
+    t2 = create_sample_tub(tub_path + '_2', records=4, storage='columnar')
+    added, removed = watcher.poll()
+    assert len(added) == 4 and removed == []
+    t2.put_record({'cam/image_array': np.zeros((120, 160, 3), dtype=np.uint8),
+                   'user/angle': 0.1, 'user/throttle': 0.2})
+    added, removed = watcher.poll()
+    assert len(added) == 1 and os.path.dirname(added[0]) == os.path.abspath(t2.path)
+    watcher.close()
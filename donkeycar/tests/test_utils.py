@@ -40,3 +40,57 @@ class TestMapping(unittest.TestCase):
         assert max == 0
 
 
+
+def make_cfg(w, h, d, crop_at_load=False):
+    import donkeycar.templates.config_defaults as defaults
+    from donkeycar.config import Config
+    cfg = Config()
+    cfg.from_object(defaults)
+    cfg.IMAGE_W, cfg.IMAGE_H, cfg.IMAGE_DEPTH = w, h, d
+    cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM, cfg.ROI_CROP_AT_LOAD = 20, 10, crop_at_load
+    return cfg
+
+
+def test_load_scaled_image_arr(tmpdir):
+    import numpy as np
+    from PIL import Image
+    from donkeycar.utils import load_scaled_image_arr, get_image_shape, rgb2gray
+    y, x = np.mgrid[0:240, 0:320]
+    frame = np.uint8(np.stack([x * 255 / 320, y * 255 / 240, np.full((240, 320), 64)], axis=2))
+    path = os.path.join(str(tmpdir), 'frame.jpg')
+    Image.fromarray(frame).save(path, quality=95)
+
+    img = load_scaled_image_arr(path, make_cfg(320, 240, 3))
+    assert img.shape == (240, 320, 3) and img.dtype == np.uint8
+
+    cfg = make_cfg(80, 60, 1)
+    img = load_scaled_image_arr(path, cfg)
+    assert img.shape == (60, 80, 1) and img.dtype == np.uint8
+    gray = rgb2gray(frame[::4, ::4])
+    assert np.abs(img[:, :, 0].astype(float) - gray).mean() < 4
+
+    cfg = make_cfg(160, 120, 3, crop_at_load=True)
+    assert get_image_shape(cfg) == (90, 160, 3)
+    img = load_scaled_image_arr(path, cfg)
+    assert img.shape == (90, 160, 3)
+    assert img.flags['C_CONTIGUOUS'] and img.base is None
+
+
+def test_frame_history():
+    import numpy as np
+    from donkeycar.utils import FrameHistory
+    history = FrameHistory(3, capacity=4)
+    frames = [np.full((2, 2), i, dtype=np.uint8) for i in range(10)]
+    window = history.push(frames[0])
+    assert window.shape == (3, 2, 2)
+    assert [w[0, 0] for w in window] == [0, 0, 0]
+    for i in range(1, 10):
+        window = history.push(frames[i])
+        assert [w[0, 0] for w in window] == [max(i - 2, 0), max(i - 1, 0), i]
+        assert window.flags['C_CONTIGUOUS']
+        assert np.shares_memory(window, history.buffer)
+
+    stack = FrameHistory(3, axis=-1, dtype=np.uint8, fill=0)
+    window = stack.push(np.full((2, 2), 7.6))
+    assert window.shape == (2, 2, 3)
+    assert window[0, 0].tolist() == [0, 0, 7]
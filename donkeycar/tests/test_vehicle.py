@@ -26,4 +26,101 @@ def test_add_part():
 
 def test_vehicle_run(vehicle):
     vehicle.start(rate_hz=20, max_loop_count=2)
-    assert vehicle is not None
\ No newline at end of file
+    assert vehicle is not None
+
+def test_part_dependencies():
+    v = dk.Vehicle(parallel=True)
+    v.add(Lambda(lambda: 1), outputs=['a'])
+    v.add(Lambda(lambda: 2), outputs=['b'])
+    v.add(Lambda(lambda a, b: a + b), inputs=['a', 'b'], outputs=['c'])
+    v.add(Lambda(lambda a: None), inputs=['a'])
+    v.add(Lambda(lambda: 5), outputs=['a'])
+    v.add(Lambda(lambda: 6), outputs=['d'], run_condition='c')
+    v.scheduler.build(v.parts)
+    assert v.scheduler.deps == [set(), set(), {0, 1}, {0}, {0, 2, 3}, {2}]
+
+
+def test_vehicle_run_parallel():
+    import threading
+    v = dk.Vehicle(parallel=True, max_workers=2)
+    started = threading.Barrier(2, timeout=5)
+    def wait_for_other():
+        #only passes when both parts run at the same time
+        started.wait()
+        return threading.current_thread().name
+    v.add(Lambda(wait_for_other), outputs=['x'])
+    v.add(Lambda(wait_for_other), outputs=['y'])
+    v.add(Lambda(lambda x, y: x != y), inputs=['x', 'y'], outputs=['z'])
+    v.start(rate_hz=20, max_loop_count=2)
+    assert v.mem.get(['z'])[0] is True
+
+
+def test_vehicle_overrun_drop():
+    import time
+    v = dk.Vehicle()
+    counts = {'high': 0, 'low': 0}
+    def high():
+        counts['high'] += 1
+    def slow_low():
+        counts['low'] += 1
+        time.sleep(0.03)
+    v.add(Lambda(high))
+    v.add(Lambda(slow_low), priority=-1)
+    v.start(rate_hz=50, max_loop_count=9, overrun='drop')
+    assert counts['high'] == 10
+    assert counts['low'] < 10
+    assert v.overruns > 0
+    assert v.profiler.stats()['overruns'] == v.overruns
+
+
+def test_vehicle_overrun_skip():
+    import time
+    v = dk.Vehicle()
+    v.add(Lambda(lambda: time.sleep(0.03)))
+    start = time.monotonic()
+    v.start(rate_hz=50, max_loop_count=3, overrun='skip')
+    #each 30ms loop waits for the next 20ms deadline
+    assert time.monotonic() - start >= 0.15
+    with pytest.raises(ValueError):
+        v.start(overrun='sometimes')
+
+
+def test_part_profiler(tmpdir):
+    import json
+    import csv
+    v = dk.Vehicle(profile_path=str(tmpdir.join('profile.json')))
+    v.add(Lambda(lambda: 1), outputs=['a'])
+    v.add(Lambda(lambda a: a), inputs=['a'], outputs=['b'])
+    v.profiler.window = 4
+    v.add(Lambda(lambda: 2), outputs=['c'])
+    v.start(rate_hz=200, max_loop_count=9)
+
+    with open(str(tmpdir.join('profile.json'))) as fp:
+        stats = json.load(fp)
+    assert list(stats['parts'].keys()) == ['Lambda', 'Lambda_2', 'Lambda_3']
+    assert stats['parts']['Lambda']['count'] == 10
+    assert stats['tick']['count'] == 10
+    assert stats['tick']['p50'] <= stats['tick']['p99'] <= stats['tick']['max']
+    assert len(v.profiler.records[v.parts[2]['part']].times) == 4
+
+    v.profiler.export(str(tmpdir.join('profile.csv')))
+    with open(str(tmpdir.join('profile.csv'))) as fp:
+        rows = list(csv.reader(fp))
+    assert rows[0] == ['part', 'count', 'avg', 'p50', 'p95', 'p99', 'max', 'overruns']
+    assert [r[0] for r in rows[1:]] == ['Lambda', 'Lambda_2', 'Lambda_3', '(tick)']
+
+
+def test_part_profiler_timings():
+    class Timed:
+        def run(self):
+            return 1
+        def profile_timings(self):
+            return {'step': 0.001}
+
+    v = dk.Vehicle()
+    v.add(Timed(), outputs=['a'])
+    v.start(rate_hz=200, max_loop_count=4)
+    stats = v.profiler.stats()
+    assert list(stats['parts'].keys()) == ['Timed', 'Timed.step']
+    assert stats['parts']['Timed.step']['count'] == 5
+    assert abs(stats['parts']['Timed.step']['p50'] - 1.0) < 1e-6
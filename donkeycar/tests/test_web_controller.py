@@ -20,3 +20,10 @@ def test_json_output(server):
 
 
 
+def test_video_frame(server):
+    import numpy as np
+    assert server.get_frame() is None
+    server.run_threaded(np.zeros((120, 160, 3), dtype=np.uint8))
+    frame = server.get_frame()
+    assert frame[:2] == b'\xff\xd8'
+    assert server.get_frame() is frame
@@ -114,18 +114,91 @@ def rgb2gray(rgb):
     return np.dot(rgb[...,:3], [0.299, 0.587, 0.114])
 
 
+class FrameHistory(object):
+    '''
+    The last length frames, for parts that look at a sequence of them,
+    kept in a buffer allocated on the first push with room for capacity
+    frames, 4 * length by default.
+
+    push copies the new frame into the buffer and returns the window of
+    the last length frames, oldest first, as a view into the buffer. Frames
+    are written one after the other, only when the buffer is full are the
+    last length - 1 moved back to its start, so the window is always one
+    contiguous slice and no tick copies the whole window. The view is only
+    valid until the next push.
+
+    axis is where the frames are stacked in the window, 0 for a
+    (length, H, W, D) window or -1 to stack them as channels, (H, W, length).
+    Until length frames were pushed, the window is filled with the first
+    frame, or with fill when given.
+    '''
+    def __init__(self, length, capacity=None, axis=0, dtype=None, fill=None):
+        if capacity is None:
+            capacity = 4 * length
+        if capacity < length:
+            raise ValueError('capacity %d is less than the length %d' % (capacity, length))
+        self.length = length
+        self.capacity = capacity
+        self.axis = axis
+        self.dtype = dtype
+        self.fill = fill
+        self.buffer = None
+        self.pos = 0
+
+    def push(self, frame):
+        frame = np.asarray(frame)
+        if self.buffer is None:
+            self.buffer = np.empty((self.capacity,) + frame.shape, dtype=self.dtype or frame.dtype)
+            self.buffer[:self.length - 1] = frame if self.fill is None else self.fill
+            self.pos = self.length - 1
+        elif self.pos == self.capacity:
+            self.buffer[:self.length - 1] = self.buffer[self.pos - self.length + 1:self.pos]
+            self.pos = self.length - 1
+        self.buffer[self.pos] = frame
+        self.pos += 1
+        return self.window()
+
+    def window(self):
+        window = self.buffer[self.pos - self.length:self.pos]
+        if self.axis != 0:
+            window = np.moveaxis(window, 0, self.axis)
+        return window
+
+    def clear(self):
+        self.buffer = None
+        self.pos = 0
+
+
+def get_image_shape(cfg):
+    '''
+    the (height, width, depth) of the images models are fed. with
+    ROI_CROP_AT_LOAD the ROI_CROP_TOP and ROI_CROP_BOTTOM rows are already gone.
+    '''
+    height = cfg.IMAGE_H
+    if cfg.ROI_CROP_AT_LOAD:
+        height -= cfg.ROI_CROP_TOP + cfg.ROI_CROP_BOTTOM
+    return (height, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+
+
 def load_scaled_image_arr(filename, cfg):
     '''
-    load an image from the filename, and use the cfg to resize if needed
+    load an image from the filename, and use the cfg to resize if needed.
+    JPEGs are decoded at the smallest DCT scale still covering IMAGE_W x IMAGE_H,
+    and straight to grayscale when IMAGE_DEPTH is 1, so smaller inputs
+    cost less to load. the result is uint8, shaped like get_image_shape(cfg).
     '''
-    import donkeycar as dk
     try:
         img = Image.open(filename)
+        mode = 'L' if cfg.IMAGE_DEPTH == 1 else 'RGB'
+        if img.format == 'JPEG':
+            img.draft(mode, (cfg.IMAGE_W, cfg.IMAGE_H))
+        if img.mode != mode:
+            img = img.convert(mode)
         if img.height != cfg.IMAGE_H or img.width != cfg.IMAGE_W:
             img = img.resize((cfg.IMAGE_W, cfg.IMAGE_H))
-        img_arr = np.array(img)
-        if img_arr.shape[2] == 3 and cfg.IMAGE_DEPTH == 1:
-            img_arr = dk.utils.rgb2gray(img_arr).reshape(cfg.IMAGE_H, cfg.IMAGE_W, 1)
+        img_arr = np.array(img).reshape(cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+        if cfg.ROI_CROP_AT_LOAD:
+            img_arr = img_arr[cfg.ROI_CROP_TOP:cfg.IMAGE_H - cfg.ROI_CROP_BOTTOM].copy()
     except:
         print('failed to load image:', filename)
         img_arr = None
@@ -196,13 +269,14 @@ def linear_bin(a, N=15, offset=1, R=2.0):
     return arr
 
 
-def linear_unbin(arr, N=15, offset=-1, R=2.0):
+def linear_unbin(arr, N=15, offset=-1, R=2.0, axis=None):
     '''
     preform inverse linear_bin, taking
     one hot encoded arr, and get max value
-    rescale given R range and offset
+    rescale given R range and offset.
+    with axis, unbin each row of a batch along that axis
     '''
-    b = np.argmax(arr)
+    b = np.argmax(arr, axis=axis)
     a = b *(R/(N + offset)) + offset
     return a
 
@@ -288,6 +362,26 @@ def param_gen(params):
         yield dict(zip(params.keys(), p ))
 
 
+def prefetch_map(func, items, workers=4, ahead=None):
+    '''
+    yield func(item) for each item, in order, computed by a pool of
+    workers threads. at most ahead results, 2 * workers by default, are
+    waiting to be consumed, so memory stays bounded over long inputs.
+    '''
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    ahead = ahead or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(func, item))
+            if len(pending) > ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
 def run_shell_command(cmd, cwd=None, timeout=15):
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
     out = []
@@ -406,8 +500,23 @@ def get_model_by_type(model_type, cfg):
     if model_type is None:
         model_type = "categorical"
 
-    input_shape = (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH)
+    input_shape = get_image_shape(cfg)
     roi_crop = (cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM)
+    if cfg.ROI_CROP_AT_LOAD:
+        #the images come in already cropped.
+        roi_crop = (0, 0)
+
+    if model_type.startswith("tflite_"):
+        from donkeycar.parts.tflite import TFLiteCategorical, TFLiteLinear, TFLiteIMU, TFLiteBehavioral
+        if model_type == "tflite_categorical":
+            return TFLiteCategorical(throttle_range=cfg.MODEL_CATEGORICAL_MAX_THROTTLE_RANGE)
+        elif model_type == "tflite_linear":
+            return TFLiteLinear()
+        elif model_type == "tflite_imu":
+            return TFLiteIMU(num_imu_inputs=6)
+        elif model_type == "tflite_behavior":
+            return TFLiteBehavioral()
+        raise Exception("unknown model type: %s" % model_type)
 
     if model_type == "localizer" or cfg.TRAIN_LOCALIZER:
         kl = KerasLocalizer(num_outputs=2, num_behavior_inputs=len(cfg.BEHAVIOR_LIST), num_locations=cfg.NUM_LOCATIONS, input_shape=input_shape)
@@ -428,6 +537,8 @@ def get_model_by_type(model_type, cfg):
     else:
         raise Exception("unknown model type: %s" % model_type)
 
+    kl.set_backend(cfg.PILOT_BACKEND, cfg.PILOT_PRECISION)
+
     return kl
 
 def get_test_img(model):
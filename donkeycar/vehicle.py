@@ -6,46 +6,230 @@ Created on Sun Jun 25 10:44:24 2017
 @author: wroscoe
 """
 
+import os
+import csv
+import json
+import math
 import time
+from collections import OrderedDict
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
 from .memory import Memory
 from prettytable import PrettyTable
 
+class TimingWindow:
+    '''
+    Durations of one part, or of the whole tick, in seconds. The most recent
+    `size` of them are kept in a fixed size ring buffer for the percentiles,
+    the count, total and max are kept over everything recorded.
+    '''
+    def __init__(self, name, size):
+        self.name = name
+        self.times = np.zeros(size)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.start = None
+
+    def add(self, delta):
+        self.times[self.count % len(self.times)] = delta
+        self.count += 1
+        self.total += delta
+        if delta > self.max:
+            self.max = delta
+
+    def stats(self):
+        '''
+        count, avg, p50, p95, p99 and max in ms, None when nothing was recorded
+        '''
+        if self.count == 0:
+            return None
+        recent = self.times[:min(self.count, len(self.times))]
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99]) * 1000
+        return OrderedDict([('count', self.count),
+                            ('avg', self.total / self.count * 1000),
+                            ('p50', p50), ('p95', p95), ('p99', p99),
+                            ('max', self.max * 1000)])
+
+
 class PartProfiler:
-    def __init__(self):
-        self.records = {}
+    '''
+    Times each part run and each drive loop tick, in fixed memory.
+    Parts are reported by class name, numbered when a vehicle has more than
+    one part of the same class. The stats can be exported to a .json or
+    .csv file, which the vehicle rewrites every 200 loops when it has an
+    export_path, so it can be watched while driving.
+
+    The loop overruns are counted by the drive loop, the profiler reports
+    them through get_overruns.
+    '''
+    STATS = ['count', 'avg', 'p50', 'p95', 'p99', 'max']
+
+    def __init__(self, window=1000, export_path=None, get_overruns=None):
+        self.window = window
+        self.export_path = export_path
+        self.records = OrderedDict()
+        self.tick = TimingWindow('tick', window)
+        self.get_overruns = get_overruns or (lambda: 0)
+
+    @property
+    def overruns(self):
+        return self.get_overruns()
 
     def profile_part(self, p):
-        self.records[p] = { "times" : [] }
+        if p in self.records:
+            return
+        names = set(w.name for w in self.records.values())
+        name = p.__class__.__name__
+        i = 2
+        while name in names:
+            name = '%s_%d' % (p.__class__.__name__, i)
+            i += 1
+        self.records[p] = TimingWindow(name, self.window)
 
     def on_part_start(self, p):
-        self.records[p]['times'].append(time.time())
+        self.records[p].start = time.perf_counter()
 
     def on_part_finished(self, p):
-        now = time.time()
-        prev = self.records[p]['times'][-1]
-        delta = now - prev
-        thresh = 0.000001
-        if delta < thresh or delta > 100000.0:
-            delta = thresh
-        self.records[p]['times'][-1] = delta
+        w = self.records[p]
+        w.add(time.perf_counter() - w.start)
+        if hasattr(p, 'profile_timings'):
+            #parts can report how long steps inside their run took, like a
+            #pilot's model inference. they are listed as <part>.<step>.
+            for step, seconds in p.profile_timings().items():
+                key = (p, step)
+                if key not in self.records:
+                    self.records[key] = TimingWindow('%s.%s' % (w.name, step), self.window)
+                self.records[key].add(seconds)
+
+    def on_tick_start(self):
+        self.tick.start = time.perf_counter()
+
+    def on_tick_finished(self):
+        self.tick.add(time.perf_counter() - self.tick.start)
+
+    def stats(self):
+        parts = OrderedDict()
+        for w in self.records.values():
+            stats = w.stats()
+            if stats is not None:
+                parts[w.name] = stats
+        return OrderedDict([('parts', parts),
+                            ('tick', self.tick.stats()),
+                            ('overruns', self.overruns)])
 
     def report(self):
         print("Part Profile Summary: (times in ms)")
         pt = PrettyTable()
-        pt.field_names =["part", "max", "min", "avg"]
-        for p, val in self.records.items():
-            arr = val['times']
-            if len(arr) == 0:
-                continue
-            pt.add_row( [p.__class__.__name__ ,
-                "%.2f" % (max(arr) * 1000),
-                "%.2f" % (min(arr) * 1000),
-                "%.2f" % (sum(arr) / len(arr) * 1000) ])
+        pt.field_names = ["part"] + self.STATS
+        stats = self.stats()
+        rows = list(stats['parts'].items())
+        if stats['tick'] is not None:
+            rows.append(('(tick)', stats['tick']))
+        for name, val in rows:
+            pt.add_row([name, val['count']] + ["%.2f" % val[k] for k in self.STATS[1:]])
         print(pt)
+        print("loop overruns:", self.overruns)
+
+    def export(self, path=None):
+        '''
+        write the stats to path, as csv when it ends with .csv and json otherwise.
+        the file is replaced atomically, so readers never see a partial one.
+        '''
+        path = path or self.export_path
+        stats = self.stats()
+        tmp = path + '.tmp'
+        with open(tmp, 'w', newline='') as fp:
+            if path.endswith('.csv'):
+                writer = csv.writer(fp)
+                writer.writerow(['part'] + self.STATS + ['overruns'])
+                for name, val in stats['parts'].items():
+                    writer.writerow([name] + [val[k] for k in self.STATS] + [''])
+                if stats['tick'] is not None:
+                    writer.writerow(['(tick)'] + [stats['tick'][k] for k in self.STATS] + [stats['overruns']])
+            else:
+                json.dump(stats, fp, indent=2)
+        os.replace(tmp, path)
+
+
+class PartScheduler:
+    '''
+    Runs the parts of a drive loop tick concurrently on a thread pool.
+
+    A part waits for every part added before it that it shares a channel
+    with: one that writes a channel it reads or writes, or that reads a
+    channel it writes. Its run_condition counts as an input. So parts that
+    share channels keep the order they were added in, as in the sequential
+    loop, and parts with no channel in common run at the same time.
+    '''
+    def __init__(self, max_workers=4):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.deps = None
+        self.dependents = None
+
+    def build(self, parts):
+        '''
+        work out which earlier parts each part depends on
+        '''
+        channels = []
+        for entry in parts:
+            reads = set(entry['inputs'])
+            if entry.get('run_condition'):
+                reads.add(entry['run_condition'])
+            channels.append((reads, set(entry['outputs'])))
+
+        self.deps = []
+        self.dependents = [[] for _ in parts]
+        for i, (reads, writes) in enumerate(channels):
+            deps = set()
+            for j in range(i):
+                other_reads, other_writes = channels[j]
+                if reads & other_writes or writes & (other_reads | other_writes):
+                    deps.add(j)
+                    self.dependents[j].append(i)
+            self.deps.append(deps)
+
+    def reset(self):
+        '''
+        the parts changed, the dependencies are rebuilt on the next run
+        '''
+        self.deps = None
+
+    def run(self, parts, run_part):
+        '''
+        call run_part for each entry of parts, each one as soon as the parts
+        it depends on have finished. returns when they all have.
+        '''
+        if self.deps is None:
+            self.build(parts)
+
+        waiting = [set(deps) for deps in self.deps]
+        ready = [i for i, deps in enumerate(waiting) if not deps]
+        running = {}
+
+        while ready or running:
+            for i in ready:
+                running[self.pool.submit(run_part, parts[i])] = i
+            ready = []
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                #raise any exception of the part in the drive loop thread
+                future.result()
+                for k in self.dependents[i]:
+                    waiting[k].discard(i)
+                    if not waiting[k]:
+                        ready.append(k)
+            ready.sort()
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
 
 class Vehicle():
-    def __init__(self, mem=None):
+    def __init__(self, mem=None, parallel=False, max_workers=4, profile_path=None):
 
         if not mem:
             mem = Memory()
@@ -53,11 +237,16 @@ class Vehicle():
         self.parts = []
         self.on = True
         self.threads = []
-        self.profiler = PartProfiler()
+        self.profiler = PartProfiler(export_path=profile_path, get_overruns=lambda: self.overruns)
+        #optionally run parts that don't share channels concurrently.
+        self.scheduler = PartScheduler(max_workers) if parallel else None
+        #when set, parts with a negative priority are left out of the tick.
+        self.dropping = False
+        self.overruns = 0
 
 
     def add(self, part, inputs=[], outputs=[], 
-            threaded=False, run_condition=None):
+            threaded=False, run_condition=None, priority=0):
         """
         Method to add a part to the vehicle drive loop.
 
@@ -69,6 +258,10 @@ class Vehicle():
                 Channel names to save to memory.
             threaded : boolean
                 If a part should be run in a separate thread.
+            priority : int
+                Parts with a negative priority, like recording or streaming,
+                are dropped from the ticks after an overrun with the 'drop'
+                overrun policy of start().
         """
 
         p = part
@@ -78,6 +271,7 @@ class Vehicle():
         entry['inputs'] = inputs
         entry['outputs'] = outputs
         entry['run_condition'] = run_condition
+        entry['priority'] = priority
 
         if threaded:
             t = Thread(target=part.update, args=())
@@ -87,14 +281,20 @@ class Vehicle():
         self.parts.append(entry)
         self.profiler.profile_part(part)
 
+        if self.scheduler is not None:
+            self.scheduler.reset()
+
     def remove(self, part):
         """
         remove part form list
         """
         self.parts.remove(part)
 
+        if self.scheduler is not None:
+            self.scheduler.reset()
+
 
-    def start(self, rate_hz=10, max_loop_count=None, verbose=False):
+    def start(self, rate_hz=10, max_loop_count=None, verbose=False, overrun='late'):
         """
         Start vehicle's main drive loop.
 
@@ -111,8 +311,18 @@ class Vehicle():
         max_loop_count : int
             Maxiumum number of loops the drive loop should execute. This is
             used for testing the all the parts of the vehicle work.
+        overrun : str
+            What to do when a loop takes longer than 1 / rate_hz.
+            'late' starts the next loop right away, and the following ones
+            on time from there. 'skip' drops the missed loops and waits for
+            the next one on the original schedule. 'drop' starts the next
+            loop right away, leaving out the parts with a negative priority
+            until a loop finishes on time again.
         """
 
+        if overrun not in ('late', 'skip', 'drop'):
+            raise ValueError('unknown overrun policy: %s' % overrun)
+
         try:
 
             self.on = True
@@ -126,27 +336,46 @@ class Vehicle():
             print('Starting vehicle...')
             #time.sleep(1)
 
+            period = 1.0 / rate_hz
+            #loops are scheduled on absolute deadlines, so sleep jitter doesn't add up.
+            deadline = time.monotonic()
             loop_count = 0
             while self.on:
-                start_time = time.time()
                 loop_count += 1
 
+                self.profiler.on_tick_start()
                 self.update_parts()
+                self.profiler.on_tick_finished()
 
                 #stop drive loop if loop_count exceeds max_loopcount
                 if max_loop_count and loop_count > max_loop_count:
                     self.on = False
 
-                sleep_time = 1.0 / rate_hz - (time.time() - start_time)
-                if sleep_time > 0.0:
-                    time.sleep(sleep_time)
+                deadline += period
+                now = time.monotonic()
+                late = now - deadline
+                self.dropping = False
+
+                if late <= 0.0:
+                    time.sleep(-late)
                 else:
+                    self.overruns += 1
                     # print a message when could not maintain loop rate.
                     if verbose:
-                        print('WARN::Vehicle: jitter violation in vehicle loop with value:', abs(sleep_time))
+                        print('WARN::Vehicle: jitter violation in vehicle loop with value:', late)
 
-                if verbose and loop_count % 200 == 0:
-                    self.profiler.report()
+                    if overrun == 'skip':
+                        deadline += math.ceil(late / period) * period
+                        time.sleep(deadline - now)
+                    else:
+                        deadline = now
+                        self.dropping = overrun == 'drop'
+
+                if loop_count % 200 == 0:
+                    if verbose:
+                        self.profiler.report()
+                    if self.profiler.export_path:
+                        self.profiler.export()
 
         except KeyboardInterrupt:
             pass
@@ -158,37 +387,50 @@ class Vehicle():
         '''
         loop over all parts
         '''
-        for entry in self.parts:
+        if self.scheduler is not None:
+            self.scheduler.run(self.parts, self.update_part)
+            return
 
-            run = True
-
-            #check run condition, if it exists
-            if entry.get('run_condition'):
-                run_condition = entry.get('run_condition')
-                run = self.mem.get([run_condition])[0]
-            
-            if run:
-                #get part
-                p = entry['part']
-
-                #start timing part run
-                self.profiler.on_part_start(p)
-
-                #get inputs from memory
-                inputs = self.mem.get(entry['inputs'])
-
-                #run the part
-                if entry.get('thread'):
-                    outputs = p.run_threaded(*inputs)
-                else:
-                    outputs = p.run(*inputs)
+        for entry in self.parts:
+            self.update_part(entry)
 
-                #save the output to memory
-                if outputs is not None:
-                    self.mem.put(entry['outputs'], outputs)
 
-                #finish timing part run
-                self.profiler.on_part_finished(p)
+    def update_part(self, entry):
+        '''
+        run a single part, reading its inputs from and writing its outputs to memory
+        '''
+        run = True
+
+        #check run condition, if it exists
+        if entry.get('run_condition'):
+            run_condition = entry.get('run_condition')
+            run = self.mem.get([run_condition])[0]
+        
+        if self.dropping and entry['priority'] < 0:
+            run = False
+
+        if run:
+            #get part
+            p = entry['part']
+
+            #start timing part run
+            self.profiler.on_part_start(p)
+
+            #get inputs from memory
+            inputs = self.mem.get(entry['inputs'])
+
+            #run the part
+            if entry.get('thread'):
+                outputs = p.run_threaded(*inputs)
+            else:
+                outputs = p.run(*inputs)
+
+            #save the output to memory
+            if outputs is not None:
+                self.mem.put(entry['outputs'], outputs)
+
+            #finish timing part run
+            self.profiler.on_part_finished(p)
  
 
     def stop(self):        
@@ -202,4 +444,9 @@ class Vehicle():
             except Exception as e:
                 print(e)
 
+        if self.scheduler is not None:
+            self.scheduler.shutdown()
+
         self.profiler.report()
+        if self.profiler.export_path:
+            self.profiler.export()